@@ -0,0 +1,190 @@
+'''
+asyncio serving mode (aiohttp) with request micro-batching. Concurrent /recommend requests are collected for
+up to BATCH_WINDOW_MS milliseconds or BATCH_MAX_SIZE requests and answered with one batched encode and one
+matrix search, then the results are fanned back out. Responses are the same as api/server.py's.
+
+    python -m api.async_server
+    python api/load_test.py http://localhost:5000 64 2000
+'''
+import sys
+import os
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+from aiohttp import web
+from api.server import warmup, hot_swap, get_recommender, get_n, get_min_score, apply_min_score, check_admin_token, start_reload
+from scripts.bundles import active_version, list_bundles
+from api.micro_batcher import MicroBatcher
+
+# Runs one micro-batch: requests with the same n, filters and diversity share a recommend_many call. When a
+# shared call fails, its requests are run one at a time, so only the request that caused the error gets it.
+def recommend_batch(items):
+    rec = get_recommender()
+    groups = {}
+    for i, (data, n, filters, diversity) in enumerate(items):
+        groups.setdefault(json.dumps([n, filters, diversity], sort_keys=True), []).append(i)
+
+    results = [None] * len(items)
+    for rows in groups.values():
+        _, n, filters, diversity = items[rows[0]]
+        try:
+            recommendations = rec.recommend_many([items[i][0] for i in rows], n, filters, diversity=diversity)
+        except Exception as e:
+            recommendations = [e] if len(rows) == 1 else [recommend_one(rec, items[i]) for i in rows]
+        for i, similar_songs in zip(rows, recommendations):
+            results[i] = similar_songs
+    return results
+
+# Recommendations for a single batched request, or the exception it raised
+def recommend_one(rec, item):
+    data, n, filters, diversity = item
+    try:
+        return rec.recommend_many([data], n, filters, diversity=diversity)[0]
+    except Exception as e:
+        return e
+
+batcher = MicroBatcher(recommend_batch,
+                       max_batch_size=int(os.environ.get('BATCH_MAX_SIZE', 64)),
+                       max_wait_ms=float(os.environ.get('BATCH_WINDOW_MS', 2)))
+
+def error_response(message, status):
+    return web.json_response({"status": "error", "message": message, "data": None}, status=status)
+
+async def home(request):
+    return web.Response(text="Hello, World!")
+
+async def healthz(request):
+    return web.json_response({"status": "ok", "warmup": warmup.status()})
+
+async def readyz(request):
+    status = warmup.start().status()
+    return web.json_response({"status": status["state"], "warmup": status}, status=200 if status["state"] == "ready" else 503)
+
+async def recommend_songs(request):
+    try:
+        data = await request.json()
+        n = get_n(data)
+        min_score = get_min_score(data)
+
+        # waits for the micro-batch this request joins
+        similar_songs = await batcher.submit((data, n, data.get('filters'), data.get('diversity')))
+        scores = get_recommender().score_distribution(similar_songs)
+        similar_songs = apply_min_score(similar_songs, min_score)
+
+        if similar_songs:
+            return web.json_response({
+                "status": "success",
+                "message": "Songs recommended successfully",
+                "data": similar_songs,
+                "scores": scores
+            })
+
+        return web.json_response({
+            "status": "error",
+            "message": "Failed to recommend songs",
+            "data": None,
+            "scores": scores
+        })
+
+    except ValueError as e:
+        # invalid JSON, n, min_score or diversity options, or filters the latent store cannot answer
+        return error_response(str(e), 400)
+
+    except Exception as e:
+        print(f'Internal Server Error: /recommend: {e}')
+        return error_response('Failed to recommend a song, internal server error', 500)
+
+async def recommend_songs_batch(request):
+    try:
+        data = await request.json()
+        profiles = data.get('profiles') if data else None
+        if not isinstance(profiles, list) or not profiles:
+            return error_response("Expected a non-empty list of profiles", 400)
+
+        n = get_n(data)
+        min_score = get_min_score(data)
+
+        # the profiles join micro-batches like any other request
+        recommendations = await asyncio.gather(*[
+            batcher.submit((profile, n, data.get('filters'), data.get('diversity'))) for profile in profiles
+        ])
+        rec = get_recommender()
+        scores = [rec.score_distribution(similar_songs) for similar_songs in recommendations]
+        recommendations = [apply_min_score(similar_songs, min_score) for similar_songs in recommendations]
+
+        return web.json_response({
+            "status": "success",
+            "message": "Songs recommended successfully",
+            "data": recommendations,
+            "scores": scores
+        })
+
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    except Exception as e:
+        print(f'Internal Server Error: /recommend/batch: {e}')
+        return error_response('Failed to recommend songs, internal server error', 500)
+
+async def similar_songs(request):
+    try:
+        song_id = int(request.match_info['song_id'])
+        n = int(request.query.get('n', 10))
+        similar = await asyncio.get_running_loop().run_in_executor(None, lambda: get_recommender().get_similar_songs(song_id, n))
+        if similar is None:
+            return error_response(f"Unknown song id {song_id}", 404)
+
+        return web.json_response({
+            "status": "success",
+            "message": "Similar songs retrieved successfully",
+            "data": similar
+        })
+
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    except Exception as e:
+        print(f'Internal Server Error: /similar: {e}')
+        return error_response('Failed to find similar songs, internal server error', 500)
+
+async def cache_stats(request):
+    cache = get_recommender().result_cache if warmup.state == 'ready' else None
+    return web.json_response({
+        "status": "success",
+        "data": {"cache": cache.stats() if cache is not None else None, "batcher": batcher.stats()}
+    })
+
+async def admin_reload(request):
+    denied = check_admin_token(request.headers)
+    if denied:
+        return error_response(*denied)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    body, status = start_reload(data)
+    return web.json_response(body, status=status)
+
+async def admin_version(request):
+    denied = check_admin_token(request.headers)
+    if denied:
+        return error_response(*denied)
+    return web.json_response({"status": "success", "data": {**hot_swap.status(), "active": active_version(), "bundles": list_bundles()}})
+
+def create_app():
+    app = web.Application()
+    app.add_routes([
+        web.get('/', home),
+        web.get('/healthz', healthz),
+        web.get('/readyz', readyz),
+        web.post('/recommend', recommend_songs),
+        web.post('/recommend/batch', recommend_songs_batch),
+        web.get(r'/similar/{song_id:\d+}', similar_songs),
+        web.get('/cache/stats', cache_stats),
+        web.post('/admin/reload', admin_reload),
+        web.get('/admin/version', admin_version),
+    ])
+    return app
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+# Swaps in a new version of the recommender without a restart. The new version is loaded (and answers a
+# synthetic query) on a background thread next to the one serving requests, then replaces it with a single
+# reference assignment, so at most two versions are loaded at once. Requests hold the instance they got from
+# get() until they finish, so a request that started on the old version finishes on it; the old version is
+# freed once the last of them is done. A failed load leaves the serving version in place, and a version that
+# failed is not loaded again by polling (only by an explicit reload).
+class HotSwap():
+    def __init__(self, warmup, load_version, synthetic_query=None, watch=None, poll_seconds=10, on_swap=None):
+        self.warmup = warmup # loads the version served on start, see warmup.py
+        self.load_version = load_version # fn(version) that builds the recommender of a version
+        self.synthetic_query = synthetic_query # optional fn(recommender) run before it is swapped in
+        self.watch = watch # optional fn() returning the version to serve, polled so forked workers converge
+        self.poll_seconds = poll_seconds
+        self.on_swap = on_swap # optional fn(version) run after an activating reload swapped the version in
+        self.failed = set() # versions that failed to load, skipped when polling
+        self.lock = threading.Lock()
+        self.last_reload = None
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.thread = None
+        self.loading = None
+        self.polled_at = 0
+
+    # The recommender serving requests, after checking (at most every poll_seconds) whether another version
+    # should be loaded
+    def get(self, timeout=None):
+        instance = self.warmup.get(timeout)
+        if self.watch is not None and time.time() - self.polled_at >= self.poll_seconds:
+            self.polled_at = time.time()
+            wanted = self.watch()
+            if wanted is not None and wanted != getattr(instance, 'version', None) and wanted not in self.failed:
+                self.reload(wanted)
+        return instance
+
+    # Starts loading version in the background, returns False if another version is still loading. With activate,
+    # on_swap runs once the version is swapped in (not when it fails), so the other workers only converge to a
+    # version that loaded. The loading thread does not survive a fork, a forked worker can start its own.
+    def reload(self, version, activate=False):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.loading = version
+            self.thread = threading.Thread(target=self.run, args=(version, activate), name="recommender-reload", daemon=True)
+            self.thread.start()
+        return True
+
+    def run(self, version, activate=False):
+        start = time.perf_counter()
+        result = {'version': version, 'started_at': time.time()}
+        try:
+            instance = self.load_version(version)
+            if self.synthetic_query is not None:
+                self.synthetic_query(instance)
+            self.warmup.replace(instance)
+            self.failed.discard(version)
+            result['state'] = 'swapped'
+            if activate and self.on_swap is not None:
+                self.on_swap(version)
+        except Exception as e:
+            print(f'Reload of version {version} failed: {e}')
+            if result.get('state') != 'swapped':
+                self.failed.add(version)
+                result['state'] = 'failed'
+            result['error'] = str(e)
+        finally:
+            result['seconds'] = round(time.perf_counter() - start, 4)
+            self.last_reload = result
+            self.loading = None
+
+    def status(self):
+        instance = self.warmup.instance
+        return {
+            'version': getattr(instance, 'version', None) if instance is not None else None,
+            'state': self.warmup.state,
+            'loading': self.loading if self.pid == os.getpid() else None,
+            'last_reload': self.last_reload,
+            'failed': sorted(self.failed),
+            'pid': os.getpid(),
+        }
@@ -0,0 +1,71 @@
+'''
+Load test for the /recommend endpoint of either server: keeps a fixed number of requests in flight and
+reports latency percentiles and throughput.
+
+    python api/load_test.py [url] [concurrency] [requests]
+    python api/load_test.py http://localhost:5000 64 2000
+'''
+import sys
+import time
+import asyncio
+import numpy as np
+import aiohttp
+
+# Random slider values around the defaults of the frontend form, so the result cache does not answer everything
+def make_profile(rng):
+    return {
+        "tempo": int(rng.integers(60, 180)),
+        "popularity": int(rng.integers(0, 100)),
+        "energy": int(rng.integers(0, 100)),
+        "danceability": int(rng.integers(0, 100)),
+        "positiveness": int(rng.integers(0, 100)),
+        "speechiness": int(rng.integers(0, 100)),
+        "liveness": int(rng.integers(0, 100)),
+        "acousticness": int(rng.integers(0, 100)),
+        "instrumentalness": int(rng.integers(0, 100)),
+        "good_for_party": int(rng.integers(0, 2)),
+        "artist": str(rng.choice(["drake", "taylor swift", "adele", "the weeknd"])),
+        "genre": str(rng.choice(["hip hop", "pop", "rock"])),
+        "emotion": str(rng.choice(["joy", "sadness", "anger", "love"])),
+        "n": 10,
+    }
+
+async def run_load_test(url, concurrency, total_requests, seed=0):
+    rng = np.random.default_rng(seed)
+    profiles = [make_profile(rng) for _ in range(total_requests)]
+    latencies = []
+    errors = 0
+    next_request = 0
+
+    async def worker(session):
+        nonlocal errors, next_request
+        while next_request < total_requests:
+            profile = profiles[next_request]
+            next_request += 1
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{url}/recommend", json=profile) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    print(f"{total_requests} requests, {concurrency} concurrent, {errors} errors, {elapsed:.2f} s")
+    print(f"QPS: {total_requests / elapsed:.1f}")
+    print(f"latency ms  mean {latencies.mean():.2f}  p50 {np.percentile(latencies, 50):.2f}  "
+          f"p99 {np.percentile(latencies, 99):.2f}  max {latencies.max():.2f}")
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:5000"
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    total_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    asyncio.run(run_load_test(url.rstrip("/"), concurrency, total_requests))
@@ -0,0 +1,63 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Collects concurrent requests on an asyncio event loop and processes them together. The first request of a
+# batch opens a window of max_wait_ms; the batch is flushed when the window closes or max_batch_size requests
+# are waiting, whichever comes first. process_batch(items) runs on a worker thread (so the loop keeps
+# accepting requests) and returns one result, or an Exception to raise, per item.
+class MicroBatcher():
+    def __init__(self, process_batch, max_batch_size=64, max_wait_ms=2.0, max_concurrent_batches=1):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="micro-batch")
+        self.pending = [] # (item, future)
+        self.timer = None
+        self.batches = 0
+        self.items = 0
+
+    # Queues an item and waits for its result
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.batches += 1
+        self.items += len(batch)
+        asyncio.get_running_loop().create_task(self.run(batch))
+
+    async def run(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.process_batch, [item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done(): # the client went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -1,9 +1,13 @@
 import sys
 import os
+import json
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from scripts.Recommender import Recommender
+from scripts.bundles import bundles_root, bundle_artifacts, active_version, set_active_version, list_bundles
+from api.warmup import Warmup
+from api.hot_swap import HotSwap
 import numpy as np
 import heapq
 
@@ -11,21 +15,100 @@ import heapq
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Lazy load the recommender to avoid initialization during import
-recommender = None
+# Build the recommender in the background as soon as the process starts, so the first request does not pay for
+# artifact downloads and loading. Set EAGER_WARMUP=0 to load on the first request instead.
+# With BUNDLE_DIR set, the active bundle is loaded (see scripts/bundles.py), otherwise the release artifacts.
+def create_recommender(version=None):
+    version = version or active_version()
+    print(f"Initializing recommender{f' from bundle {version}' if version else ''}...")
+    # LATENT_INDEX selects the nearest-neighbour index: brute_force (exact), ivf, hnsw or pq, and
+    # LATENT_INDEX_PARAMS its params as JSON, e.g. {"n_shards": 4} to split a brute force scan over 4 threads
+    rec = Recommender(index=os.environ.get('LATENT_INDEX', 'brute_force'),
+                      index_params=json.loads(os.environ.get('LATENT_INDEX_PARAMS', '{}')),
+                      artifacts=bundle_artifacts(version) if version else None, version=version)
+    print("Recommender initialized successfully!")
+    return rec
 
+# Runs one recommendation so the latent store pages and inference path are warm before the worker is ready
+def run_synthetic_query(rec):
+    rec.recommend_many([{}], 5)
+
+warmup = Warmup(create_recommender, synthetic_query=run_synthetic_query if os.environ.get('WARMUP_QUERY', '1') != '0' else None)
+if os.environ.get('EAGER_WARMUP', '1') != '0':
+    warmup.start()
+
+# New bundle versions are loaded next to the serving one and swapped in (POST /admin/reload). Every worker polls
+# the ACTIVE bundle every BUNDLE_POLL_SECONDS, so workers that did not get the reload request follow it.
+hot_swap = HotSwap(warmup, create_recommender,
+                   synthetic_query=run_synthetic_query if os.environ.get('WARMUP_QUERY', '1') != '0' else None,
+                   watch=active_version if bundles_root() else None,
+                   poll_seconds=float(os.environ.get('BUNDLE_POLL_SECONDS', 10)),
+                   on_swap=set_active_version)
+
+# Requests keep the recommender they got here until they finish, even if a reload swaps in another version
 def get_recommender():
-    global recommender
-    if recommender is None:
-        print("Initializing recommender for the first time...")
-        recommender = Recommender()
-        print("Recommender initialized successfully!")
-    return recommender
+    return hot_swap.get()
+
+# Admin endpoints need the ADMIN_TOKEN in an X-Admin-Token header, and are disabled when it is not set.
+# Returns an error message and status, or None when the request is allowed.
+def check_admin_token(headers):
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        return "Admin endpoints are disabled, set ADMIN_TOKEN to enable them", 403
+    if headers.get('X-Admin-Token') != token:
+        return "Invalid admin token", 401
+    return None
+
+# Activates a bundle and starts loading it, returns (response body, status)
+def start_reload(data):
+    version = (data or {}).get('version')
+    if not bundles_root():
+        return {"status": "error", "message": "Bundles are disabled, set BUNDLE_DIR", "data": None}, 400
+    if not isinstance(version, str) or version not in list_bundles():
+        return {"status": "error", "message": f"Unknown bundle version {version}", "data": None}, 404
+    # ACTIVE is written once the version is swapped in, the other workers then load it on their next poll
+    if not hot_swap.reload(version, activate=True):
+        return {"status": "error", "message": "Another version is still loading", "data": hot_swap.status()}, 409
+    return {"status": "accepted", "message": f"Loading version {version}", "data": hot_swap.status()}, 202
+
+# Number of songs to return, a positive int of at most MAX_RECOMMENDATIONS (default 100)
+def get_n(data, default=5):
+    n = data.get('n', default)
+    if isinstance(n, bool) or not isinstance(n, int) or n < 1:
+        raise ValueError("n must be a positive integer")
+    max_n = int(os.environ.get('MAX_RECOMMENDATIONS', 100))
+    if n > max_n:
+        raise ValueError(f"n must be at most {max_n}")
+    return n
+
+# Optional minimum cosine similarity of returned songs, None returns the top n whatever their scores
+def get_min_score(data):
+    min_score = data.get('min_score')
+    if min_score is not None and (isinstance(min_score, bool) or not isinstance(min_score, (int, float))):
+        raise ValueError("min_score must be a number")
+    return min_score
+
+# Drops songs scoring below min_score from a list of recommendations
+def apply_min_score(similar_songs, min_score):
+    if min_score is None:
+        return similar_songs
+    return [song for song in similar_songs if song['score'] >= min_score]
 
 @app.route("/")
 def home():
     return "Hello, World!"
 
+# Liveness: the process is up, whether or not the recommender has finished loading
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok", "warmup": warmup.status()})
+
+# Readiness: 200 once the recommender is loaded (and the synthetic query ran), 503 while loading or after a failure
+@app.route("/readyz")
+def readyz():
+    status = warmup.start().status()
+    return jsonify({"status": status["state"], "warmup": status}), 200 if status["state"] == "ready" else 503
+
 @app.route("/recommend", methods=["POST", "GET"])
 def recommend_songs():
     try:
@@ -35,14 +118,16 @@ def recommend_songs():
         # Get the recommender instance (lazy loaded)
         rec = get_recommender()
         
-        n = data.get('n', 5)
+        n = get_n(data)
+        min_score = get_min_score(data)
     
-        # Generate the latent space for this combination
-        latent_space = rec.generate_latent_space(n, data)
-        print("Generated the latent space for user.")
+        # Generate the latent space for this combination and get the n most similar latent spaces (or the
+        # cached result of an identical request)
+        similar_songs = rec.recommend(data, n, data.get('filters'), diversity=data.get('diversity'))
 
-        # Get similar latent spaces
-        similar_songs = rec.get_similiar_latent_space(latent_space, n)
+        # the distribution of the top n scores, before min_score, to help tune it
+        scores = rec.score_distribution(similar_songs)
+        similar_songs = apply_min_score(similar_songs, min_score)
 
         if similar_songs:
             print("Successfully retrieved similiar songs for user")
@@ -55,16 +140,26 @@ def recommend_songs():
             return jsonify({
                 "status": "success",
                 "message": "Songs recommended successfully",
-                "data": similar_songs
+                "data": similar_songs,
+                "scores": scores
             })
         
         print("Failed to find similiar songs for a user")
         return jsonify({
             "status": "error",
             "message": "Failed to recommend songs",
-            "data": None
+            "data": None,
+            "scores": scores
         })
-        
+
+    except ValueError as e:
+        # invalid n, min_score or diversity options, or filters the latent store cannot answer
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "data": None
+        }), 400
+
     except Exception as e:
         print(f'Internal Server Error: /recommend: {e}')
         return jsonify({
@@ -72,6 +167,114 @@ def recommend_songs():
             'message': 'Failed to recommend a song, internal server error'
         }), 500
 
+@app.route("/recommend/batch", methods=["POST"])
+def recommend_songs_batch():
+    try:
+        data = request.get_json()
+        profiles = data.get('profiles') if data else None
+
+        if not isinstance(profiles, list) or not profiles:
+            return jsonify({
+                "status": "error",
+                "message": "Expected a non-empty list of profiles",
+                "data": None
+            }), 400
+
+        print(f"Recommending songs for a batch of {len(profiles)} profiles...")
+        rec = get_recommender()
+        n = get_n(data)
+        min_score = get_min_score(data)
+
+        # one encoder call and one batched search for every profile
+        recommendations = rec.recommend_many(profiles, n, data.get('filters'), diversity=data.get('diversity'))
+        scores = [rec.score_distribution(similar_songs) for similar_songs in recommendations]
+        recommendations = [apply_min_score(similar_songs, min_score) for similar_songs in recommendations]
+
+        # Convert numpy float32 to regular Python float for JSON serialization
+        for similar_songs in recommendations:
+            for song in similar_songs:
+                song['score'] = float(song['score'])
+
+        return jsonify({
+            "status": "success",
+            "message": "Songs recommended successfully",
+            "data": recommendations,
+            "scores": scores
+        })
+
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "data": None
+        }), 400
+
+    except Exception as e:
+        print(f'Internal Server Error: /recommend/batch: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to recommend songs, internal server error'
+        }), 500
+
+# "More like this": the n songs most similar to a catalog song, from the precomputed neighbour lists
+@app.route("/similar/<int:song_id>")
+def similar_songs(song_id):
+    try:
+        n = int(request.args.get('n', 10))
+        similar = get_recommender().get_similar_songs(song_id, n)
+        if similar is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown song id {song_id}",
+                "data": None
+            }), 404
+
+        return jsonify({
+            "status": "success",
+            "message": "Similar songs retrieved successfully",
+            "data": similar
+        })
+
+    except ValueError as e:
+        # n is not a positive integer
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "data": None
+        }), 400
+
+    except Exception as e:
+        print(f'Internal Server Error: /similar: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to find similar songs, internal server error'
+        }), 500
+
+# Hit/miss counters of this worker's result cache
+@app.route("/cache/stats")
+def cache_stats():
+    cache = get_recommender().result_cache
+    if cache is None:
+        return jsonify({"status": "disabled", "data": None})
+    return jsonify({"status": "success", "data": cache.stats()})
+
+# Loads a bundle in the background and swaps it in once it answered a synthetic query: {"version": "..."}
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    denied = check_admin_token(request.headers)
+    if denied:
+        return jsonify({"status": "error", "message": denied[0], "data": None}), denied[1]
+    body, status = start_reload(request.get_json(silent=True))
+    return jsonify(body), status
+
+# The version this worker is serving, the one it is loading and how the last reload went
+@app.route("/admin/version")
+def admin_version():
+    denied = check_admin_token(request.headers)
+    if denied:
+        return jsonify({"status": "error", "message": denied[0], "data": None}), denied[1]
+    return jsonify({"status": "success", "data": {**hot_swap.status(), "active": active_version(), "bundles": list_bundles()}})
+
 # Run the application if the script is executed directly
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
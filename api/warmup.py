@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+# Builds the recommender on a background thread as soon as the process starts, instead of on the first request.
+# Construction happens at most once per process (guarded by a lock), requests wait for it to finish, and the
+# load phase timings are exposed for the health and readiness endpoints.
+class Warmup():
+    def __init__(self, factory, synthetic_query=None):
+        self.factory = factory # builds the recommender
+        self.synthetic_query = synthetic_query # optional fn(recommender) run once before the worker is ready
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.thread = None
+        self.instance = None
+        self.error = None
+        self.started_at = None
+        self.timings = {}
+        self.done = threading.Event()
+
+    # Starts loading in the background if it is not already loading. Also restarts it after a failed attempt
+    # and in a worker forked while it was still loading (the loading thread does not survive a fork). A worker
+    # forked after loading finished keeps the parent's recommender, sharing its memory.
+    def start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                if self.instance is not None:
+                    self.pid = os.getpid()
+                else:
+                    self.reset()
+            if self.error is not None and self.done.is_set():
+                self.reset()
+            if self.thread is None:
+                self.started_at = time.time()
+                self.thread = threading.Thread(target=self.run, name="recommender-warmup", daemon=True)
+                self.thread.start()
+        return self
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            instance = self.factory()
+            self.timings.update(getattr(instance, 'load_timings', {}))
+
+            if self.synthetic_query is not None:
+                query_start = time.perf_counter()
+                self.synthetic_query(instance)
+                self.timings['synthetic_query'] = round(time.perf_counter() - query_start, 4)
+
+            self.instance = instance
+        except Exception as e:
+            print(f'Recommender warm-up failed: {e}')
+            self.error = str(e)
+        finally:
+            self.timings['total'] = round(time.perf_counter() - start, 4)
+            self.done.set()
+
+    # Returns the recommender, waiting for it to finish loading
+    def get(self, timeout=None):
+        self.start()
+        if not self.done.wait(timeout):
+            raise TimeoutError('Recommender is still loading')
+        if self.instance is None:
+            raise RuntimeError(f'Recommender failed to load: {self.error}')
+        return self.instance
+
+    # Replaces the loaded recommender with another version (see hot_swap.py). A single reference assignment,
+    # requests that already got the previous instance finish on it.
+    def replace(self, instance):
+        self.instance = instance
+        self.error = None
+
+    @property
+    def state(self):
+        if self.instance is not None:
+            return 'ready'
+        if self.thread is None or self.pid != os.getpid():
+            return 'not_started'
+        if not self.done.is_set():
+            return 'loading'
+        return 'failed'
+
+    def status(self):
+        return {
+            'state': self.state,
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'timings': dict(self.timings),
+            'error': self.error,
+        }
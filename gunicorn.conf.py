@@ -0,0 +1,42 @@
+'''
+gunicorn settings for serving api/server.py with several worker processes (gunicorn reads this file from the
+working directory):
+
+    gunicorn api.server:application
+
+The recommender is loaded once in the master before any worker is forked. The latent store and neighbour
+lists are memory mapped and the encoder weights, index and vocabularies are NumPy arrays, so every worker
+shares the master's pages instead of loading its own copy; total memory stays roughly flat as workers are
+added (compare PSS, not RSS, which counts shared pages in every process).
+
+Configuration (all optional):
+    WEB_CONCURRENCY  number of worker processes, default 2
+    PORT             port to listen on, default 5000
+    WARMUP_TIMEOUT   seconds the master waits for the recommender before forking the workers anyway, default 300
+'''
+import os
+import gc
+
+# artifacts are verified against the release manifest committed next to this file
+os.environ.setdefault('ARTIFACT_MANIFEST', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifact-manifest.json'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = True
+timeout = 120
+
+# Runs in the master after the app module is imported and before workers are forked. A load that fails or
+# takes longer than WARMUP_TIMEOUT does not stop the master: the workers start anyway, report 503 on /readyz
+# and load (or retry) the recommender themselves.
+def when_ready(server):
+    from api.server import warmup
+    try:
+        warmup.get(timeout=float(os.environ.get('WARMUP_TIMEOUT', 300)))
+    except Exception as e:
+        server.log.error(f"Recommender not loaded in the master, the workers will load it: {e}")
+        return
+    # objects that survive from here on are never scanned by the garbage collector, so collections in the
+    # workers do not write to (and copy) the pages shared with the master
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Recommender loaded in the master: {warmup.status()['timings']}")
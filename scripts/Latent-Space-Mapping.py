@@ -1,99 +1,136 @@
-
-
-
 '''
 This files serves as a script for making a lookup table for the songs with the latent spaces. In other words
-'''
-from models import load_saved_model
-from data import load_data, embed_num_data, process_non_num_features
-import pandas as pd
-import numpy as np
-import tensorflow as tf
-
-def create_latent_lookup_table(n_rows=10000000, batch_size=10000):
-
-    # load the already trained models
-    autoencoder, encoder_model = load_saved_model()
-
-    # get the data that was used to trained the model (will be used to re-calculating latent spaces)
-    data = load_data(p_col_names=False, max_rows=n_rows)
-    data = embed_num_data(data)
-    data, artist_count, genre_count, emotion_count = process_non_num_features(data)
-
-    # get the new data we will attach to each latent space
-    metadata_cols = ["Artist(s)", "Genre", "song", "Length", "Album", "Release Date", 
-                     "Similar Artist 1", "Similar Song 1", "Similarity Score 1", 
-                     "Similar Artist 2", "Similar Song 2", "Similarity Score 2", 
-                     "Similar Artist 3", "Similar Song 3", "Similarity Score 3"]
-
-    metadata = data[metadata_cols]
-    
-    numerical_data = data.drop(columns=metadata_cols + ["text", "Key", "Loudness (db)", "Time signature", 
-                                                       "Explicit", "Good for Yoga/Stretching", 
-                                                       "Good for Relaxation/Meditation", "emotion", "Artist_IDS", "Genre_IDS", "Emotion_IDS"])
-    
-    artist_ids = data["Artist_IDS"].values
-    genre_ids = data["Genre_IDS"].values
-    emotion_ids = data["Emotion_IDS"].values
-
-    # Adjust n_rows to the actual number of rows in the data after processing
-    n_rows = len(numerical_data)
-    print(f"Total rows after processing: {n_rows}")
-
-    all_latent_vectors = []
-    all_metadata = []
 
-    # run the encoding model in batches, saving the resulting latent spaces along with the new data into a csv file
-    batches = (n_rows + batch_size - 1) // batch_size  
-    for i in range(batches):
-        # get start and end index of batch
-        start_idx = i * batch_size
-        end_idx = min((i + 1) * batch_size, n_rows)
+It streams the pre-processed columns written by `python data.py stream` through the encoder in batches. A
+producer thread encodes the next batch while the main thread writes the previous one into a preallocated vector
+file (../data/latent-mapping/vectors.npy), and progress.json records the last completed batch, so an interrupted
+run resumes where it stopped. Only a few batches are held in memory whatever the catalog size; the latent store
+is then assembled from the memory mapped vectors and the pre-processed text columns.
 
-        # Skip if the batch is empty
-        if start_idx >= n_rows:
-            print(f"Skipping batch {i} as start_idx ({start_idx}) exceeds data length ({n_rows})")
-            continue
-
-        # get the data in the current batch
-        batch_numerical = numerical_data.iloc[start_idx:end_idx].values
-        batch_artists = artist_ids[start_idx:end_idx]
-        batch_genres = genre_ids[start_idx:end_idx]
-        batch_emotion = emotion_ids[start_idx:end_idx]
-        batch_meta = metadata.iloc[start_idx:end_idx]
-
-        # Check if batch is empty or has incorrect shape
-        if len(batch_numerical) == 0:
-            print(f"Skipping empty batch {i} (start_idx: {start_idx}, end_idx: {end_idx})")
-            continue
-
-        print(f"Processing batch {i+1}/{batches} with {len(batch_numerical)} samples")
-
-        # run the encoder model with the batch data
-        predictions = encoder_model.predict([batch_numerical, batch_artists, batch_genres, batch_emotion], batch_size=batch_size)
-
-        # Append to lists
-        all_latent_vectors.append(predictions)
-        all_metadata.append(batch_meta)
-
-    # Concatenate all batches
-    all_latent_vectors = np.vstack(all_latent_vectors)
-    all_metadata = pd.concat(all_metadata, ignore_index=True)
-    
-    # Determine the number of latent dimensions from the shape of all_latent_vectors
-    latent_dim = all_latent_vectors.shape[1]
-    print(f"Latent dimension detected: {latent_dim}")
-
-    # Create a DataFrame with metadata and latent vectors
-    latent_df = pd.concat([all_metadata.reset_index(drop=True), 
-                          pd.DataFrame(all_latent_vectors, columns=[f"latent_{i}" for i in range(latent_dim)])], 
-                          axis=1)
+    python Latent-Space-Mapping.py [batch_size]
+'''
+import sys
+import os
+import json
+import time
+import queue
+import threading
+from models import load_encoder_model, ensure_model_file
+from data import open_columnar, ID_COLUMNS
+from latent_store import write_latent_store, normalize_rows, METADATA_COLUMNS
+from neighbors import build_neighbors_file
+import numpy as np
 
-    # Save to CSV
-    latent_df.to_csv("../data/latent-space-lookup.csv", index=False)
+# Identifies the inputs of a mapping run, a saved progress is only resumed for the same inputs
+def mapping_signature(columnar_dir, model_path, n_rows, latent_dim, batch_size):
+    columns_json = os.path.join(columnar_dir, "columns.json")
+    return {
+        "rows": n_rows,
+        "latent_dim": latent_dim,
+        "batch_size": batch_size,
+        "pre_processed_mtime": os.path.getmtime(columns_json),
+        "model_mtime": os.path.getmtime(model_path),
+        "model_size": os.path.getsize(model_path),
+    }
+
+def load_progress(job_dir, signature):
+    try:
+        with open(os.path.join(job_dir, "progress.json")) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return progress["completed_batches"] if progress.get("signature") == signature else 0
+
+def save_progress(job_dir, signature, completed_batches):
+    path = os.path.join(job_dir, "progress.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"signature": signature, "completed_batches": completed_batches}, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+# Producer: encodes batches first_batch..n_batches - 1 and puts (batch, latents) on a bounded queue, then None.
+# An exception is put on the queue for the consumer to raise.
+def encode_batches(encoder_model, numerical_columns, id_columns, n_rows, batch_size, first_batch, n_batches, out_queue, stop):
+    try:
+        for i in range(first_batch, n_batches):
+            if stop.is_set():
+                return
+            start_idx, end_idx = i * batch_size, min((i + 1) * batch_size, n_rows)
+            batch_numerical = np.column_stack([column[start_idx:end_idx] for column in numerical_columns])
+            batch_ids = [np.asarray(column[start_idx:end_idx]) for column in id_columns]
+            predictions = encoder_model.predict([batch_numerical] + batch_ids, batch_size=batch_size, verbose=0)
+            out_queue.put((i, normalize_rows(np.asarray(predictions, dtype=np.float32))))
+        out_queue.put(None)
+    except Exception as e:
+        out_queue.put(e)
+
+def create_latent_lookup_table(batch_size=10000, columnar_dir="../data/pre-processed", job_dir="../data/latent-mapping", prefetch=2):
+    start = time.time()
+
+    if not os.path.exists(os.path.join(columnar_dir, "columns.json")):
+        raise FileNotFoundError(f"No pre-processed columns in {columnar_dir}, run `python data.py stream` first")
+
+    # the already trained encoder and the memory mapped columns that were used to train it
+    encoder_model = load_encoder_model()
+    columns, text_columns = open_columnar(columnar_dir)
+    numerical = {name: column for name, column in columns.items() if name not in ID_COLUMNS}
+    id_columns = [columns[name] for name in ID_COLUMNS]
+    n_rows = len(id_columns[0])
+    latent_dim = encoder_model.output_shape[-1]
+    n_batches = (n_rows + batch_size - 1) // batch_size
+    print(f"Total rows after processing: {n_rows}, latent dimension: {latent_dim}")
+
+    # resume into the existing vector file when the inputs are the same, otherwise start over
+    os.makedirs(job_dir, exist_ok=True)
+    vectors_path = os.path.join(job_dir, "vectors.npy")
+    signature = mapping_signature(columnar_dir, ensure_model_file('encoder_model'), n_rows, latent_dim, batch_size)
+    first_batch = load_progress(job_dir, signature) if os.path.exists(vectors_path) else 0
+    if first_batch:
+        vectors = np.load(vectors_path, mmap_mode="r+")
+        print(f"Resuming from batch {first_batch + 1}/{n_batches}")
+    else:
+        vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(n_rows, latent_dim))
+        save_progress(job_dir, signature, 0)
+
+    # encode batch i + 1 while batch i is written
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    producer = threading.Thread(target=encode_batches, daemon=True,
+                                args=(encoder_model, list(numerical.values()), id_columns, n_rows, batch_size,
+                                      first_batch, n_batches, batches, stop))
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            i, latents = item
+            vectors[i * batch_size:i * batch_size + len(latents)] = latents
+            vectors.flush()
+            save_progress(job_dir, signature, i + 1)
+            print(f"Processed batch {i + 1}/{n_batches} with {len(latents)} samples")
+    finally:
+        stop.set()
+        while producer.is_alive():
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                producer.join(0.1)
+    encoded = time.time()
+    print(f"Encoded {n_rows} rows in {encoded - start:.2f} seconds")
+
+    # Save the binary store the Recommender memory maps at serve time, with the emotion and the normalized
+    # numerical features of every song as filter columns
+    filters = {"emotion": text_columns["emotion"]}
+    filters.update(numerical)
+    vectors = np.load(vectors_path, mmap_mode="r")
+    write_latent_store("../data/latent-store.bin", vectors,
+                       {name: text_columns[col] for name, col in METADATA_COLUMNS.items()}, filters, normalized=True)
+    print(f"Wrote ../data/latent-store.bin in {time.time() - encoded:.2f} seconds")
+
+    # Precompute every song's nearest neighbours for the /similar endpoint
+    build_neighbors_file("../data/latent-store.bin", "../data/song-neighbors.npy")
 
 if __name__ == "__main__":
-    create_latent_lookup_table()
-
-
-
+    create_latent_lookup_table(batch_size=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -1,147 +1,251 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from scripts.models import load_saved_model
+from scripts.encoder_inference import NumpyEncoder, extract_encoder_weights, save_encoder_weights, load_encoder_weights
+from scripts.artifacts import ArtifactManager
+from scripts.latent_store import SegmentedStore, convert_csv_to_latent_store
+from scripts.latent_index import SegmentedIndex, create_index, load_index, index_path, OFFLINE_INDEXES
+from scripts.segments import load_segmented_store, resolve_base, compacted_neighbors
+from scripts.result_cache import create_result_cache
+from scripts.neighbors import load_neighbors
+from scripts.rerank import mmr_select, parse_diversity
+from scripts.vocabulary import Vocabulary
 import pandas as pd
 import json
+import time
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import heapq
-import requests
-import shutil
-import csv
-
-# Function to download file from URL
-def download_file(url, local_path):
-    try:
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        print(f"Downloading from {url} to {local_path}")
-        
-        response = requests.get(url, stream=True, timeout=300)  # 5 minute timeout
-        response.raise_for_status()  # Raise an exception for bad status codes
-        
-        with open(local_path, 'wb') as f:
-            shutil.copyfileobj(response.raw, f)
-        
-        # Verify file was created and has content
-        if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-            print(f"Successfully downloaded {local_path} ({os.path.getsize(local_path)} bytes)")
-            return local_path
-        else:
-            raise Exception(f"Download failed: file {local_path} is empty or doesn't exist")
-            
-    except Exception as e:
-        print(f"Error downloading {url}: {str(e)}")
-        raise e
 
-def read_csv_without_pandas(file_path):
-    data = []
-    headers = []
-    
-    with open(file_path, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        headers = next(csv_reader)  # Get headers
-        
-        for row in csv_reader:
-            data.append(row)
-    
-    return headers, data
+# user input key -> numerical feature, in the column order of pre-processed-data.csv
+FEATURE_MAPPING = {
+    "tempo": "Tempo",
+    "popularity": "Popularity",
+    "energy": "Energy",
+    "danceability": "Danceability",
+    "positiveness": "Positiveness",
+    "speechiness": "Speechiness",
+    "liveness": "Liveness",
+    "acousticness": "Acousticness",
+    "instrumentalness": "Instrumentalness",
+    "good_for_party": "Good for Party",
+    "good_for_work_study": "Good for Work/Study",
+    "good_for_exercise": "Good for Exercise",
+    "good_for_running": "Good for Running",
+    "good_for_driving": "Good for Driving",
+    "good_for_social_gatherings": "Good for Social Gatherings",
+    "good_for_morning_routine": "Good for Morning Routine",
+    "good_for_meditation_stretching": "Good For Meditation/Stretching"
+}
+
+# filters on these match the artist, genre or emotion of a song, any other filter is a FEATURE_MAPPING range
+CATEGORY_FILTERS = ["artist", "genre", "emotion"]
+
+# Reduces an artist, genre or emotion to the form its id was assigned from during training (the first of a
+# comma separated list, lowercased), so "Drake, Future" matches an artist filter of "drake"
+def filter_key(value):
+    return str(value).split(",")[0].strip().lower()
 
 class Recommender():
-    autoencoder = None
-    encoder_model = None
-    latent_dict = {}
-    age_dict = {}
+    encoder_model = None # NumpyEncoder, so requests never go through Keras predict()
+    latent_store = None # songs indexed by integer id: L2-normalized latent vectors plus columnar metadata (a
+                        # SegmentedStore when new songs were appended as delta segments, see segments.py)
+    latent_index = None # nearest-neighbour index over latent_store.vectors
+    song_neighbors = None # precomputed top-k neighbour ids and scores of every song, see neighbors.py
+    age_dict = {} # artist/genre/emotion -> Vocabulary of the ids used in training
     normalized_params = {} # min/max values used for normalizing input
+    load_timings = {} # load phase -> seconds, for the API's readiness endpoints
+    result_cache = None # ResultCache of recent recommendations, configured with the RESULT_CACHE* env vars
+    version = None # bundle version the state was loaded from, None for the release artifacts
+
+    # index: "brute_force" (exact), "ivf", "hnsw" or "pq" (approximate), see latent_index.py for index_params.
+    # By default the loaded state is shared by every Recommender of the process. Given the ArtifactManager of a
+    # bundle (see bundles.py), the instance loads and keeps its own state instead, so several versions can be
+    # loaded side by side and swapped (see api/hot_swap.py).
+    def __init__(self, index="brute_force", index_params=None, artifacts=None, version=None):
+        # Downloads and verifies artifacts from the GitHub release into a local cache (ARTIFACT_CACHE_DIR)
+        self.artifacts = artifacts or ArtifactManager()
+        self.version = version
+        state = Recommender
+        if artifacts is not None:
+            state = self
+            self.encoder_model = self.latent_store = self.latent_index = self.song_neighbors = None
+            self.age_dict, self.normalized_params, self.load_timings = {}, {}, {}
+
+        # fetch everything this process still needs concurrently, failures are handled by each loader's fallback
+        self.timed('fetch_artifacts', lambda: self.artifacts.fetch_all([key for key, needed in [
+            ('encoder_weights', self.encoder_model is None),
+            ('latent_store', self.latent_store is None),
+            ('song_neighbors', self.song_neighbors is None),
+            ('artist_json', not self.age_dict),
+            ('genre_json', not self.age_dict),
+            ('emotion_json', not self.age_dict),
+            ('normalization_params', not self.normalized_params),
+        ] if needed]))
 
-    def __init__(self):
         # Load models during initialization, not at class definition
-        if Recommender.autoencoder is None or Recommender.encoder_model is None:
-            print("Loading TensorFlow models...")
-            Recommender.autoencoder, Recommender.encoder_model = load_saved_model()
-            print("Models loaded successfully!")
-        # Define GitHub Release URLs (replace with actual URLs from your GitHub Release)
-        self.github_urls = {
-            'latent_space_lookup': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/latent-space-lookup.csv',
-            'artist_json': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/artist-json.json',
-            'genre_json': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/genre-json.json',
-            'emotion_json': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/emotion-json.json',
-            'normalization_params': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/normalization-params.json',
-            'encoder_model': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/encoder-model.keras'
-        }
-        # Define local temporary paths for serverless environment
-        self.local_paths = {
-            'latent_space_lookup': os.path.join('/tmp', 'data', 'latent-space-lookup.csv'),
-            'artist_json': os.path.join('/tmp', 'data', 'artist-json.json'),
-            'genre_json': os.path.join('/tmp', 'data', 'genre-json.json'),
-            'emotion_json': os.path.join('/tmp', 'data', 'emotion-json.json'),
-            'normalization_params': os.path.join('/tmp', 'data', 'normalization-params.json'),
-            'encoder_model': os.path.join('/tmp', 'models', 'encoder-model.keras')
-        }
-        
-        if not Recommender.latent_dict:
-            Recommender.latent_dict = self.create_latent_lookup_table()
+        if self.encoder_model is None:
+            print("Loading encoder...")
+            state.encoder_model = self.timed('encoder', self.load_encoder)
+            print("Encoder loaded successfully!")
+
+        if self.latent_store is None:
+            state.latent_store = self.timed('latent_store', self.load_latent_store)
 
-        if not Recommender.age_dict:
-            Recommender.age_dict = self.create_age_dict()
+        index_params = index_params or {}
+        if self.latent_index is None or self.latent_index.kind != index or not self.latent_index.matches(**index_params):
+            state.latent_index = self.timed('latent_index', lambda: self.load_latent_index(index, index_params))
+        # search time params only apply to this instance, the shared index keeps its own
+        self.latent_index = self.latent_index.tuned(**index_params)
 
-        if not Recommender.normalized_params:
-            Recommender.normalized_params = self.create_normalized_params()
+        if self.song_neighbors is None:
+            state.song_neighbors = self.timed('song_neighbors', self.load_song_neighbors)
+
+        if not self.age_dict:
+            state.age_dict = self.timed('age_dict', self.create_age_dict)
+
+        if not self.normalized_params:
+            state.normalized_params = self.timed('normalized_params', self.create_normalized_params)
+
+        # one cache for every version, cache_namespace keeps their results apart
+        if Recommender.result_cache is None:
+            Recommender.result_cache = create_result_cache()
+
+    # Runs one load step and records how long it took (in seconds) in load_timings
+    def timed(self, phase, load):
+        start = time.perf_counter()
+        result = load()
+        self.load_timings[phase] = round(time.perf_counter() - start, 4)
+        return result
 
     # Download files if not present locally
     def ensure_file(self, key):
-        local_path = self.local_paths.get(key)
-        if not os.path.exists(local_path):
-            url = self.github_urls.get(key)
-            print(f'Downloading {key} from {url} to {local_path}')
-            download_file(url, local_path)
-        return local_path
-
-    # Creates a lookup table based on our 32D latent space
-    def create_latent_lookup_table(self):
-        table = {}
-        data_path = self.ensure_file('latent_space_lookup')
-        
-        # Read CSV without pandas
-        headers, rows = read_csv_without_pandas(data_path)
-        
-        # Find latent column indices
-        latent_indices = [i for i, header in enumerate(headers) if header.startswith('latent_')]
-        
-        for row in rows:
-            # Extract latent values
-            latent_values = tuple(float(row[i]) for i in latent_indices)
-            
-            # Extract metadata
-            metadata = {
-                "artist": row[headers.index("Artist(s)")],
-                "genre": row[headers.index("Genre")],
-                "song": row[headers.index("song")],
-                # ... add other fields as needed
-            }
-            
-            table[latent_values] = metadata
-        
-        return table
+        return self.artifacts.fetch(key)
+
+    # Loads the exported encoder weights for NumPy inference. Releases without a weight bundle fall back to
+    # loading the Keras encoder (never the full autoencoder) once and exporting the weights locally, so later
+    # cold starts skip TensorFlow.
+    def load_encoder(self):
+        try:
+            weights_path = self.ensure_file('encoder_weights')
+        except Exception as e:
+            print(f"Encoder weights unavailable, extracting them from the Keras model: {e}")
+            from scripts.models import load_encoder_model
+            keras_encoder = load_encoder_model()
+            weights_path = save_encoder_weights(self.artifacts.local_path('encoder_weights'), extract_encoder_weights(keras_encoder))
+        return NumpyEncoder(load_encoder_weights(weights_path))
+
+    # Memory maps the binary latent store and any delta segments appended to it, converting the CSV lookup
+    # table once if no store has been published
+    def load_latent_store(self):
+        try:
+            store_path = self.ensure_file('latent_store')
+        except Exception as e:
+            print(f"Latent store unavailable, converting the CSV lookup table instead: {e}")
+            store_path = convert_csv_to_latent_store(self.ensure_file('latent_space_lookup'), self.artifacts.local_path('latent_store'))
+        return load_segmented_store(store_path)
+
+    # The published store the neighbour lists and the saved indexes are built over
+    def base_store(self):
+        store = self.latent_store
+        return store.segments[0] if isinstance(store, SegmentedStore) else store
+
+    # Memory maps the precomputed neighbour lists of the base segment (rebuilt by the latest compaction, if any).
+    # They are optional: without them (or if they were built for a different catalog) similar songs are found
+    # with the latent index instead.
+    def load_song_neighbors(self):
+        try:
+            path = compacted_neighbors(self.artifacts.local_path('latent_store')) or self.ensure_file('song_neighbors')
+            neighbors = load_neighbors(path)
+        except Exception as e:
+            print(f"Song neighbours unavailable, similar songs will be searched instead: {e}")
+            return None
+        if len(neighbors) != len(self.base_store()):
+            print(f"Song neighbours cover {len(neighbors)} songs, the latent store has {len(self.base_store())}, ignoring them")
+            return None
+        return neighbors
+
+    # Loads a previously built index from disk, or builds (and saves) it over the latent store. Delta segments
+    # are scanned exactly next to it.
+    def load_latent_index(self, kind, index_params):
+        index = self.load_base_index(kind, index_params, self.base_store().vectors)
+        if isinstance(self.latent_store, SegmentedStore):
+            return SegmentedIndex(index, self.latent_store)
+        return index
+
+    # hnsw indexes are only built offline (python scripts/latent_index.py build hnsw), without a saved one the
+    # exact scan answers instead
+    def load_base_index(self, kind, index_params, vectors):
+        if kind == "brute_force":
+            return create_index(kind, **index_params).build(vectors)
 
-    # creates the age (artist, genre, emotion) dict (corresponding values to each a.g.e we used during training)
+        path = index_path(resolve_base(self.artifacts.local_path('latent_store'))[0], kind)
+        if os.path.exists(path):
+            try:
+                index = load_index(path, vectors)
+                if index.kind == kind and index.matches(**index_params):
+                    return index
+                print(f"The saved {kind} index does not match {index_params}")
+            except ValueError as e:
+                print(f"The saved {kind} index is unusable: {e}")
+
+        if kind in OFFLINE_INDEXES:
+            print(f"No {kind} index for this latent store, falling back to the exact scan. Build it offline with "
+                  f"`python scripts/latent_index.py build {kind}`")
+            return create_index("brute_force").build(vectors)
+
+        print(f"Building {kind} index over {len(vectors)} songs...")
+        index = create_index(kind, **index_params).build(vectors)
+        index.save(path)
+        return index
+
+    # Returns the metadata for a song id, as returned in the "id" field of recommendations
+    def get_song(self, song_id):
+        if song_id < 0 or song_id >= len(self.latent_store):
+            return None
+        return {"id": int(song_id), **self.latent_store[song_id]}
+
+    # Returns the n songs most similar to a catalog song (excluding itself), or None for an unknown id. One row
+    # lookup in the precomputed neighbour lists, or a search for the song's vector when they do not cover n or
+    # the song (songs of delta segments). Until the next compaction, the lists of base songs do not include
+    # songs from delta segments. Raises ValueError for an n below 1.
+    def get_similar_songs(self, song_id, n):
+        if n < 1:
+            raise ValueError("n must be a positive integer")
+        if song_id < 0 or song_id >= len(self.latent_store):
+            return None
+        neighbors = self.song_neighbors
+        if neighbors is not None and n <= neighbors.dtype["ids"].shape[0] and song_id < len(neighbors):
+            row = neighbors[song_id]
+            ids, scores = row["ids"][:n], row["scores"][:n]
+            ids, scores = ids[ids >= 0], scores[ids >= 0]
+        else:
+            ids, scores = self.latent_index.search(np.asarray(self.latent_store.vectors[song_id]), n + 1)
+            ids, scores = ids[ids != song_id][:n], scores[ids != song_id][:n]
+        return [
+            {"id": int(idx), "score": float(score), "metadata": self.latent_store[idx]}
+            for idx, score in zip(ids, scores)
+        ]
+
+    # creates the age (artist, genre, emotion) dict (corresponding values to each a.g.e we used during training).
+    # Each JSON dict is kept as a hashed Vocabulary, which stays shared between forked workers.
     def create_age_dict(self):
         age_dict = {}
 
         artist_path = self.ensure_file('artist_json')
         with open(artist_path) as json_file:
             artist_data = json.load(json_file)
-            age_dict['artist'] = artist_data
+            age_dict['artist'] = Vocabulary.from_dict(artist_data)
         
         genre_path = self.ensure_file('genre_json')
         with open(genre_path) as json_file:
             genre_data = json.load(json_file)
-            age_dict['genre'] = genre_data
+            age_dict['genre'] = Vocabulary.from_dict(genre_data)
         
         emotion_path = self.ensure_file('emotion_json')
         with open(emotion_path) as json_file:
             emotion_data = json.load(json_file)
-            age_dict['emotion'] = emotion_data
+            age_dict['emotion'] = Vocabulary.from_dict(emotion_data)
         
         return age_dict
     
@@ -154,7 +258,7 @@ class Recommender():
         if value is None:
             return 0.0
         
-        params = Recommender.normalized_params.get(feature_name)
+        params = self.normalized_params.get(feature_name)
         if not params:
             return 0.0
             
@@ -166,95 +270,184 @@ class Recommender():
         else:
             return (value - x_min) / (x_max - x_min)
 
+    # Normalizes the numerical features and looks up the artist, genre and emotion ids of a batch of user
+    # inputs, returning the four encoder input arrays
+    def prepare_model_inputs(self, profiles):
+        # missing values and features without normalization params become 0.0, as in normalize_value
+        raw = np.array([[np.nan if data.get(key) is None else data.get(key) for key in FEATURE_MAPPING] for data in profiles], dtype=np.float64)
+        raw = raw.reshape(len(profiles), len(FEATURE_MAPPING))
+        params = [self.normalized_params.get(feature) or {"min": 0, "max": 0} for feature in FEATURE_MAPPING.values()]
+        x_min = np.array([p["min"] for p in params], dtype=np.float64)
+        x_range = np.array([p["max"] for p in params], dtype=np.float64) - x_min
+        num_data = np.divide(raw - x_min, x_range, out=np.zeros_like(raw), where=x_range != 0)
+        num_data = np.nan_to_num(num_data, nan=0.0).astype(np.float32)
+
+        # process the non-numerical data
+        def lookup(kind, value, lower=True):
+            if value is None:
+                return 0
+            return self.age_dict[kind].get(value.lower() if lower else value, 0)
+
+        artist_array = np.array([lookup("artist", data.get("artist")) for data in profiles], dtype=np.int32)
+        genre_array = np.array([lookup("genre", data.get("genre")) for data in profiles], dtype=np.int32)
+        emotion_array = np.array([lookup("emotion", data.get("emotion"), lower=False) for data in profiles], dtype=np.int32)
+
+        return [num_data, artist_array, genre_array, emotion_array]
+
+    # Generates the latent spaces of a batch of user inputs with a single encoder call
+    def generate_latent_spaces(self, profiles):
+        if not profiles:
+            return np.zeros((0, self.latent_store.dim), dtype=np.float32)
+        inputs = self.prepare_model_inputs(profiles)
+        return self.encoder_model.predict(inputs)
+
     # Generates a latent space on the user inputted data using the encoder model
     def generate_latent_space(self, n, data):
-        
-        # process 17 numerical features of data (same column order as pre-processed-data.csv)
-        num_data = []
-        
-        feature_mapping = {
-            "tempo": "Tempo",
-            "popularity": "Popularity", 
-            "energy": "Energy",
-            "danceability": "Danceability",
-            "positiveness": "Positiveness",
-            "speechiness": "Speechiness",
-            "liveness": "Liveness",
-            "acousticness": "Acousticness",
-            "instrumentalness": "Instrumentalness",
-            "good_for_party": "Good for Party",
-            "good_for_work_study": "Good for Work/Study",
-            "good_for_exercise": "Good for Exercise",
-            "good_for_running": "Good for Running",
-            "good_for_driving": "Good for Driving",
-            "good_for_social_gatherings": "Good for Social Gatherings",
-            "good_for_morning_routine": "Good for Morning Routine",
-            "good_for_meditation_stretching": "Good For Meditation/Stretching"
-        }
-        
-        # Normalize each numerical feature
-        for input_key, feature_name in feature_mapping.items():
-            normalized_value = self.normalize_value(data.get(input_key), feature_name)
-            num_data.append(normalized_value)
-        
-        # process the non-numerical data
-        artist_value = 0 if data["artist"] is None else Recommender.age_dict["artist"].get(data["artist"].lower(), 0)
-        genre_value = 0 if data["genre"] is None else Recommender.age_dict["genre"].get(data["genre"].lower(), 0) 
-        emotion_value = 0 if data["emotion"] is None else Recommender.age_dict["emotion"].get(data["emotion"], 0)
-
-        # run the model with the properly formatted input data
-        num_data_array = np.array([num_data]) 
-        artist_array = np.array([artist_value])  
-        genre_array = np.array([genre_value])  
-        emotion_array = np.array([emotion_value])  
-        
-        predictions = Recommender.encoder_model.predict([num_data_array, artist_array, genre_array, emotion_array])
+        return self.generate_latent_spaces([data])[0]
 
-        # return the 32d latent space
-        return predictions[0]
-    
-    # Find similar latent spaces to a given latent space
-    def get_similiar_latent_space(self, latent_space, n):
-        # Convert latent_space to a NumPy array if it isn't already
-        latent_space = np.array(latent_space, dtype=np.float32)
-        
-        # Extract all latent vectors and metadata from latent_dict
-        latent_keys = np.array([list(map(float, key)) for key in Recommender.latent_dict.keys()], dtype=np.float32)
-        metadata_list = list(Recommender.latent_dict.values())
-        
-        if latent_keys.shape[0] == 0:
-            return []
-            
-        # Compute cosine similarity for all vectors at once
-        # Cosine similarity = dot product / (norm of latent_space * norm of each key)
-        latent_space_norm = np.linalg.norm(latent_space)
-        keys_norms = np.linalg.norm(latent_keys, axis=1)
-        dot_products = np.dot(latent_keys, latent_space)
-        cosine_similarities = dot_products / (latent_space_norm * keys_norms)
-        
-        # Filter by threshold
-        threshold = 0.9
-        mask = cosine_similarities > threshold
-        
-        # Get indices of vectors above threshold
-        valid_indices = np.where(mask)[0]
-        valid_similarities = cosine_similarities[valid_indices]
-        valid_metadata = [metadata_list[i] for i in valid_indices]
-        
-        if len(valid_indices) == 0:
-            return []
-            
-        # Get top n indices based on similarity scores
-        if len(valid_indices) <= n:
-            top_n_indices = np.arange(len(valid_indices))
+    # Sorted row ids of the songs matching every filter, or None when there are no filters. Filters look like
+    #   {"genre": "hip hop", "artist": ["drake", "future"], "emotion": "joy", "tempo": {"min": 110, "max": 130}}
+    # (a list matches any of its values, ranges are in the same units as the user input). Raises ValueError
+    # for filters the store cannot answer.
+    def filter_rows(self, filters):
+        if not filters:
+            return None
+        if not isinstance(filters, dict):
+            raise ValueError("filters must be an object")
+
+        matches = []
+        for name, condition in filters.items():
+            if name in CATEGORY_FILTERS:
+                column = self.latent_store.filter_column(name)
+                if column is None:
+                    raise ValueError(f"The latent store has no {name} column to filter on")
+                wanted = condition if isinstance(condition, list) else [condition]
+                matches.append(column.rows_matching(wanted, filter_key))
+            elif name in FEATURE_MAPPING:
+                feature = FEATURE_MAPPING[name]
+                column = self.latent_store.filter_column(feature)
+                if column is None or feature not in self.normalized_params:
+                    raise ValueError(f"The latent store has no {feature} column to filter on")
+                if not isinstance(condition, dict) or not set(condition) <= {"min", "max"}:
+                    raise ValueError(f"Filter {name} must look like {{\"min\": ..., \"max\": ...}}")
+                low, high = (None if condition.get(bound) is None else self.normalize_value(condition[bound], feature) for bound in ("min", "max"))
+                matches.append(column.rows_between(low, high))
+            else:
+                raise ValueError(f"Unknown filter {name}")
+
+        # intersect the smallest sets first
+        matches.sort(key=len)
+        rows = matches[0]
+        for other in matches[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    # Artist group id of each song id in an array, songs by the same (first listed) artist share a group
+    def artist_groups(self, ids):
+        column = self.latent_store.filter_column("artist")
+        if column is None:
+            raise ValueError("The latent store has no artist column to cap artists on")
+        return column.group_ids_of(ids, filter_key)
+
+    # Re-ranks a pool of (ids, scores) to n songs with maximal marginal relevance and per-artist caps
+    def diversify(self, ids, scores, n, diversity):
+        vectors = np.take(self.latent_store.vectors, ids, axis=0)
+        groups = self.artist_groups(ids) if diversity["max_per_artist"] is not None else None
+        picked = mmr_select(scores, vectors, n, diversity["lambda"], groups, diversity["max_per_artist"])
+        return ids[picked], scores[picked]
+
+    # Find the n most similar songs for each of a batch of latent spaces, one list of results per latent space.
+    # The top n are selected first, so a list only comes back shorter than n when the catalog (or the songs
+    # matching the filters, see filter_rows) has fewer songs, or when min_score drops low scoring songs.
+    # diversity ({"lambda", "max_per_artist", "pool"}, see rerank.py) re-ranks a larger pool of the most
+    # similar songs down to n.
+    def get_similiar_latent_spaces(self, latent_spaces, n, filters=None, min_score=None, diversity=None):
+        latent_spaces = np.asarray(latent_spaces, dtype=np.float32).reshape(len(latent_spaces), -1)
+        results = [[] for _ in range(len(latent_spaces))]
+
+        if len(self.latent_store) == 0 or n <= 0:
+            return results
+
+        norms = np.linalg.norm(latent_spaces, axis=1)
+        valid = np.flatnonzero(norms > 0)
+        if len(valid) == 0:
+            return results
+
+        candidates = self.filter_rows(filters)
+        diversity = parse_diversity(diversity)
+        k = max(n, diversity["pool"]) if diversity else n
+
+        # rows are pre-normalized, so the index scores are cosine similarities
+        queries = latent_spaces[valid] / norms[valid, None]
+        if candidates is None:
+            matches = self.latent_index.search_many(queries, k)
         else:
-            top_n_indices = np.argpartition(valid_similarities, -n)[-n:]
-            
-        # Sort the top n by similarity score (descending)
-        top_n_indices = top_n_indices[np.argsort(valid_similarities[top_n_indices])[::-1]]
-        
-        # Return results as list of dictionaries
-        return [{"score": valid_similarities[idx], "metadata": valid_metadata[idx]} for idx in top_n_indices]
+            matches = self.latent_index.search_candidates(queries, k, candidates)
+
+        for i, (top_n_indices, cosine_similarities) in zip(valid, matches):
+            if diversity:
+                top_n_indices, cosine_similarities = self.diversify(top_n_indices, cosine_similarities, n, diversity)
+            # only the top n need checking against the minimum score
+            keep = cosine_similarities >= (-np.inf if min_score is None else min_score)
+            results[i] = [
+                {"id": int(idx), "score": float(score), "metadata": self.latent_store[idx]}
+                for idx, score in zip(top_n_indices[keep], cosine_similarities[keep])
+            ]
+
+        return results
+
+    # Find similar latent spaces to a given latent space
+    def get_similiar_latent_space(self, latent_space, n, filters=None, min_score=None, diversity=None):
+        return self.get_similiar_latent_spaces([latent_space], n, filters, min_score, diversity)[0]
+
+    # Names the artifact version, index, catalog, filters and re-ranking answering searches, so cached results
+    # never outlive any of them
+    def cache_namespace(self, filters=None, diversity=None):
+        index = self.latent_index
+        options = json.dumps({"filters": filters or {}, "diversity": parse_diversity(diversity)}, sort_keys=True)
+        return f"{self.version}:{index.kind}:{json.dumps(index.params, sort_keys=True)}:{len(self.latent_store)}:{options}"
+
+    # Recommends n songs for each of a batch of user inputs: one encoder call and one batched search for the
+    # profiles that are not in the result cache. The cache holds the top n, min_score is applied after it.
+    def recommend_many(self, profiles, n, filters=None, min_score=None, diversity=None):
+        cache = self.result_cache
+        if cache is None or not profiles:
+            return self.get_similiar_latent_spaces(self.generate_latent_spaces(profiles), n, filters, min_score, diversity)
+
+        inputs = self.prepare_model_inputs(profiles)
+        keys = cache.keys(inputs, n, self.cache_namespace(filters, diversity))
+        results = cache.get_many(keys)
+
+        first_rows = {}
+        for row, key in enumerate(keys):
+            first_rows.setdefault(key, row)
+        missing = [key for key in first_rows if key not in results]
+        if missing:
+            rows = [first_rows[key] for key in missing]
+            latent_spaces = self.encoder_model.predict([array[rows] for array in inputs])
+            computed = dict(zip(missing, self.get_similiar_latent_spaces(latent_spaces, n, filters, diversity=diversity)))
+            cache.set_many(computed)
+            results.update(computed)
+
+        return [[dict(song) for song in results[key] if min_score is None or song["score"] >= min_score] for key in keys]
+
+    # Recommends n songs for one user input
+    def recommend(self, data, n, filters=None, min_score=None, diversity=None):
+        return self.recommend_many([data], n, filters, min_score, diversity)[0]
+
+    # Summary of the scores of a list of recommendations, reported with API responses to help pick a min_score
+    def score_distribution(self, results):
+        scores = np.array([song["score"] for song in results], dtype=np.float64)
+        if len(scores) == 0:
+            return {"count": 0}
+        return {
+            "count": len(scores),
+            "min": float(scores.min()),
+            "max": float(scores.max()),
+            "mean": float(scores.mean()),
+            "p50": float(np.percentile(scores, 50)),
+            "p90": float(np.percentile(scores, 90)),
+        }
 
     # Helper function, used to determine the cosine similiarity between two arrays
     def get_cosine_similiarity(self, x, y):
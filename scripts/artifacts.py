@@ -0,0 +1,229 @@
+'''
+Downloads the serving artifacts (models, latent store, vocabularies) from the GitHub release into a local cache.
+
+Every artifact is described by a manifest entry: its path inside the cache directory and, when known, its size
+and SHA-256. Downloads stream into "<path>.part" and are only renamed into place once the size and hash check
+out, so an interrupted download is never mistaken for a valid file; the next fetch resumes the .part file with
+an HTTP Range request. Artifacts are fetched concurrently, and a lock file per artifact keeps several worker
+processes from downloading the same file at once.
+
+The sizes and sha256 of the release are read from artifact-manifest.json at the project root (or
+ARTIFACT_MANIFEST). An artifact without a sha256 there is still served, with a warning, once its size (or the
+Content-Length of its download) checks out; ARTIFACT_REQUIRE_SHA256=1 refuses it instead.
+
+Configuration:
+    ARTIFACT_CACHE_DIR       cache directory, default /tmp
+    ARTIFACT_BASE_URL        where artifacts are downloaded from, default the v1.0.0 GitHub release
+    ARTIFACT_MANIFEST        JSON file of {key: {"size": ..., "sha256": ...}} entries merged into MANIFEST,
+                             default artifact-manifest.json
+    ARTIFACT_REQUIRE_SHA256  1 to refuse artifacts that have no sha256 in the manifest
+
+Write the manifest for a release from local files with:
+    python scripts/artifacts.py manifest .. > artifact-manifest.json
+'''
+import sys
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+try:
+    import fcntl
+except ImportError: # no cross-process locking on Windows
+    fcntl = None
+
+RELEASE_URL = 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0'
+RELEASE_MANIFEST = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'artifact-manifest.json'))
+
+# artifact key -> path inside the cache directory (the release file name is the path's base name)
+MANIFEST = {
+    'latent_space_lookup': {'path': 'data/latent-space-lookup.csv'},
+    'latent_store': {'path': 'data/latent-store.bin'},
+    'song_neighbors': {'path': 'data/song-neighbors.npy'},
+    'artist_json': {'path': 'data/artist-json.json'},
+    'genre_json': {'path': 'data/genre-json.json'},
+    'emotion_json': {'path': 'data/emotion-json.json'},
+    'normalization_params': {'path': 'data/normalization-params.json'},
+    'autoencoder_model': {'path': 'models/autoencoder-model.keras'},
+    'encoder_model': {'path': 'models/encoder-model.keras'},
+    'encoder_weights': {'path': 'models/encoder-weights.npz'},
+}
+
+class ArtifactError(Exception):
+    pass
+
+# Returns the SHA-256 hex digest of a file
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# MANIFEST with the entries of a JSON manifest file merged in
+def load_manifest(path=None):
+    manifest = {key: dict(entry) for key, entry in MANIFEST.items()}
+    if path:
+        with open(path) as json_file:
+            for key, entry in json.load(json_file).items():
+                manifest.setdefault(key, {}).update(entry)
+    return manifest
+
+# The manifest servers verify against: ARTIFACT_MANIFEST, else the release manifest committed with the code
+def default_manifest():
+    path = os.environ.get('ARTIFACT_MANIFEST') or RELEASE_MANIFEST
+    return load_manifest(path if os.path.exists(path) else None)
+
+# offline: fetch only verifies the local files and raises ArtifactError instead of downloading (bundles.py)
+# require_sha256: refuse artifacts without a sha256 in the manifest, default ARTIFACT_REQUIRE_SHA256
+class ArtifactManager():
+    def __init__(self, cache_dir=None, base_url=None, manifest=None, max_workers=6, timeout=300, chunk_size=1 << 20, offline=False,
+                 require_sha256=None):
+        self.cache_dir = cache_dir or os.environ.get('ARTIFACT_CACHE_DIR', '/tmp')
+        self.base_url = (base_url or os.environ.get('ARTIFACT_BASE_URL', RELEASE_URL)).rstrip('/')
+        self.manifest = manifest or default_manifest()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.offline = offline
+        self.require_sha256 = os.environ.get('ARTIFACT_REQUIRE_SHA256', '0') == '1' if require_sha256 is None else require_sha256
+        self.locks = {key: threading.Lock() for key in self.manifest}
+        self.warned = set() # keys already warned about a missing sha256
+
+    def local_path(self, key):
+        return os.path.join(self.cache_dir, self.manifest[key]['path'])
+
+    def url(self, key):
+        entry = self.manifest[key]
+        return entry.get('url') or f"{self.base_url}/{os.path.basename(entry['path'])}"
+
+    # True if the cached file matches the manifest. A verified hash is remembered in a "<path>.sha256" file
+    # so large artifacts are not re-hashed on every cold start.
+    def is_valid(self, key):
+        path = self.local_path(key)
+        entry = self.manifest[key]
+        if not os.path.exists(path):
+            return False
+        if entry.get('size') is not None and os.path.getsize(path) != entry['size']:
+            return False
+        if entry.get('sha256'):
+            try:
+                with open(path + '.sha256') as f:
+                    if f.read().strip() == entry['sha256'] and os.path.getmtime(path + '.sha256') >= os.path.getmtime(path):
+                        return True
+            except OSError:
+                pass
+            if sha256_file(path) != entry['sha256']:
+                return False
+            with open(path + '.sha256', 'w') as f:
+                f.write(entry['sha256'])
+        return True
+
+    # Returns the local path of an artifact, downloading it first if it is missing or invalid
+    def fetch(self, key):
+        if key not in self.manifest:
+            raise ArtifactError(f"Unknown artifact {key}")
+        if not self.manifest[key].get('sha256'):
+            if self.require_sha256:
+                raise ArtifactError(f"The manifest has no sha256 for {key}, add it to artifact-manifest.json "
+                                    f"(python scripts/artifacts.py manifest) or unset ARTIFACT_REQUIRE_SHA256")
+            if key not in self.warned:
+                self.warned.add(key)
+                print(f"WARNING: the manifest has no sha256 for {key}, it is only checked against its "
+                      f"{'size' if self.manifest[key].get('size') is not None else 'Content-Length'}. Add the release's "
+                      f"hashes to artifact-manifest.json (python scripts/artifacts.py manifest)")
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self.locks[key], open(path + '.lock', 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.is_valid(key):
+                return path
+            if self.offline:
+                raise ArtifactError(f"{key} at {path} is missing or does not match the manifest")
+            if os.path.exists(path):
+                print(f"Cached {key} at {path} does not match the manifest, downloading it again")
+                os.remove(path)
+            self.download(key)
+        return path
+
+    # Fetches several artifacts concurrently, returns {key: local path or the exception that stopped it}
+    def fetch_all(self, keys):
+        def fetch(key):
+            try:
+                return self.fetch(key)
+            except Exception as e:
+                return e
+
+        keys = list(keys)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(keys)))) as pool:
+            return dict(zip(keys, pool.map(fetch, keys)))
+
+    # Downloads into "<path>.part", resuming it if a previous download was interrupted, and renames it into
+    # place once it is complete and verified
+    def download(self, key, retry=True):
+        path = self.local_path(key)
+        part_path = path + '.part'
+        entry = self.manifest[key]
+        url = self.url(key)
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        print(f"Downloading {key} from {url} to {path}" + (f" (resuming at byte {offset})" if offset else ""))
+
+        with requests.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if response.status_code == 416 and retry:
+                # the partial file is not a prefix the server can continue, start over
+                os.remove(part_path)
+                return self.download(key, retry=False)
+            response.raise_for_status()
+
+            if offset and response.status_code != 206:
+                offset = 0 # the server ignored the range and is sending the whole file
+            expected_size = entry.get('size')
+            if expected_size is None and 'Content-Length' in response.headers:
+                expected_size = offset + int(response.headers['Content-Length'])
+
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            raise ArtifactError(f"Download of {key} is incomplete: {size} of {expected_size} bytes")
+        if size == 0:
+            raise ArtifactError(f"Download of {key} is empty")
+        if entry.get('sha256'):
+            digest = sha256_file(part_path)
+            if digest != entry['sha256']:
+                os.remove(part_path)
+                raise ArtifactError(f"Download of {key} has sha256 {digest}, expected {entry['sha256']}")
+            with open(path + '.sha256', 'w') as f:
+                f.write(digest)
+
+        os.replace(part_path, path)
+        print(f"Successfully downloaded {path} ({size} bytes)")
+        return path
+
+# Builds manifest entries (size and sha256) for the artifacts found under a project directory
+def build_manifest(root):
+    manifest = {}
+    for key, entry in MANIFEST.items():
+        path = os.path.join(root, entry['path'])
+        if os.path.exists(path):
+            manifest[key] = {'path': entry['path'], 'size': os.path.getsize(path), 'sha256': sha256_file(path)}
+    return manifest
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'fetch'
+    if command == 'manifest':
+        print(json.dumps(build_manifest(sys.argv[2] if len(sys.argv) > 2 else '..'), indent=4))
+    elif command == 'fetch':
+        # warm the cache, e.g. during a container build
+        for key, result in ArtifactManager().fetch_all(sys.argv[2:] or list(MANIFEST)).items():
+            print(f"{key}: {result}")
+    else:
+        print(f"Unknown command {command}, expected manifest or fetch")
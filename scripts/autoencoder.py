@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import tensorflow as tf
 from tensorflow.keras.layers import Embedding
@@ -7,15 +8,64 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from visualize import plot_training_history, visualize_latent_space
 from models import save_model
+from data import load_columnar
 
 print("Tensorflow Version: ", tf.__version__)
 print("Physical GPU Devices:", tf.config.list_physical_devices('GPU'))
 if not tf.config.list_physical_devices('GPU'):
     print("WARNING: No GPU detected, training on CPU")
 
-# load the pre-processed data
+# The GPU when there is one, otherwise the CPU
+def default_device():
+    return '/GPU:0' if tf.config.list_physical_devices('GPU') else '/CPU:0'
+
+# Sets up the device, thread pools and precision policy for training, and returns the device to train on. It
+# must run before TensorFlow executes its first op (thread pools cannot change afterwards).
+#   device: "cpu", "gpu", or None for the GPU when there is one
+#   intra_op_threads: threads a single op (a matmul) is split over, on CPU every core by default
+#   inter_op_threads: independent ops run at once, on CPU 2 by default (TensorFlow's default of every core
+#       oversubscribes the cores the intra-op pool already uses)
+#   mixed_precision: compute in bfloat16 (CPU) or float16 (GPU) and keep float32 weights
+def configure_training(device=None, intra_op_threads=None, inter_op_threads=None, mixed_precision=False):
+    device = device or ("gpu" if default_device() == '/GPU:0' else "cpu")
+    if device == "cpu":
+        # hide any GPU so every op, including the ones Keras places itself, runs on the CPU
+        tf.config.set_visible_devices([], 'GPU')
+        intra_op_threads = intra_op_threads or os.cpu_count()
+        inter_op_threads = inter_op_threads or 2
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy("mixed_bfloat16" if device == "cpu" else "mixed_float16")
+
+    print(f"Training on {device} with {tf.config.threading.get_intra_op_parallelism_threads() or 'default'} intra-op and "
+          f"{tf.config.threading.get_inter_op_parallelism_threads() or 'default'} inter-op threads, "
+          f"{tf.keras.mixed_precision.global_policy().name} precision")
+    return "/CPU:0" if device == "cpu" else "/GPU:0"
+
+# The training configuration from the environment:
+#   TRAIN_DEVICE (cpu or gpu), TRAIN_INTRA_OP_THREADS, TRAIN_INTER_OP_THREADS, TRAIN_MIXED_PRECISION=1,
+#   TRAIN_JIT_COMPILE=1 (XLA compiled train steps), TRAIN_BATCH_SIZE (default 16384)
+def training_config_from_env():
+    def int_env(name):
+        return int(os.environ[name]) if os.environ.get(name) else None
+    return {
+        "device": os.environ.get('TRAIN_DEVICE') or None,
+        "intra_op_threads": int_env('TRAIN_INTRA_OP_THREADS'),
+        "inter_op_threads": int_env('TRAIN_INTER_OP_THREADS'),
+        "mixed_precision": os.environ.get('TRAIN_MIXED_PRECISION', '0') == '1',
+    }, os.environ.get('TRAIN_JIT_COMPILE', '0') == '1', int_env('TRAIN_BATCH_SIZE') or 16384
+
+# load the pre-processed data, from the columnar output of `python data.py stream` when it is newer than the csv
 def load_preprocessed_data():
-    df = pd.read_csv("../data/pre-processed-data.csv", delimiter=",", encoding="utf-8")
+    columnar = "../data/pre-processed/columns.json"
+    csv_path = "../data/pre-processed-data.csv"
+    if os.path.exists(columnar) and (not os.path.exists(csv_path) or os.path.getmtime(columnar) > os.path.getmtime(csv_path)):
+        df = load_columnar(os.path.dirname(columnar))
+    else:
+        df = pd.read_csv(csv_path, delimiter=",", encoding="utf-8")
 
     embedding_columns = ['Artist_IDS', 'Genre_IDS', 'Emotion_IDS']
     embedding_data = df[embedding_columns]
@@ -58,8 +108,9 @@ def prepare_data(df, embedding_data):
     return num_cols, train_data, val_data, test_data
 
 # buidl the autoenc
+# jit_compile compiles the train step with XLA, fusing the dense layers and the loss into fewer kernels
 def build_autoencoder(num_features, num_artists, num_genres, num_emotions, embedding_dim_artist=100, 
-    embedding_dim_genre=50, embedding_dim_emotion=25, latent_dim=20):
+    embedding_dim_genre=50, embedding_dim_emotion=25, latent_dim=20, jit_compile=False):
 
     # Define inputs
     input_numerical = layers.Input(shape=(num_features,), name="numerical_input")
@@ -83,45 +134,66 @@ def build_autoencoder(num_features, num_artists, num_genres, num_emotions, embed
     # Encoder
     encoder = layers.Dense(64, activation="relu")(concat_inputs)
     encoder = layers.Dropout(.15)(encoder)
-    encoder = layers.Dense(latent_dim, activation=None, name="latent_vector")(encoder)
+    # the latent vector and the reconstruction stay float32 under a mixed precision policy
+    encoder = layers.Dense(latent_dim, activation=None, name="latent_vector", dtype="float32")(encoder)
 
     # Decoder
     decoder = layers.Dense(64, activation="relu")(encoder)
     decoder = layers.Dropout(.15)(decoder)
-    decoder = layers.Dense(num_features + embedding_dim_artist + embedding_dim_genre + embedding_dim_emotion, activation="sigmoid", name="reconstructed_output")(decoder)
+    decoder = layers.Dense(num_features + embedding_dim_artist + embedding_dim_genre + embedding_dim_emotion, activation="sigmoid", name="reconstructed_output", dtype="float32")(decoder)
 
     # Models
     autoencoder = Model(inputs=[input_numerical, input_artist, input_genre, input_emotion], outputs=decoder)
     encoder_model = Model(inputs=[input_numerical, input_artist, input_genre, input_emotion], outputs=encoder)
 
     # Compile
-    autoencoder.compile(optimizer="adam", loss="mse", metrics=["mse"])
+    autoencoder.compile(optimizer="adam", loss="mse", metrics=["mse"], jit_compile=jit_compile)
 
     return autoencoder, encoder_model
 
-# trains the autoencoder on our traing and test data
-def train_autoencoder(autoencoder, num_cols, train_data, val_data, test_data, epochs=20, batch_size=256):
+# the embedding layers whose outputs the decoder reconstructs, in input order after the numerical features
+EMBEDDING_LAYERS = ["artist_embedding", "genre_embedding", "emotion_embedding"]
+INPUT_NAMES = ["numerical_input", "artist_input", "genre_input", "emotion_input"]
+
+# Streams (inputs, reconstruction target) batches of data (the four arrays of prepare_data). The target of
+# every batch, the numerical features followed by the artist, genre and emotion embeddings, is gathered inside
+# the input pipeline from the embedding weights as they are at that step, instead of materializing a
+# ~195 column target for every row with the weights as they were before training. Batches are assembled on
+# parallel map calls and prefetched while the previous step runs.
+def make_dataset(autoencoder, data, batch_size, shuffle=False, seed=42):
+    num, artist, genre, emotion = data
+    columns = [tf.constant(np.asarray(num, dtype=np.float32))] + [tf.constant(np.asarray(ids, dtype=np.int32)) for ids in (artist, genre, emotion)]
+    embeddings = [autoencoder.get_layer(name).embeddings for name in EMBEDDING_LAYERS]
+
+    def load_batch(rows):
+        batch = [tf.gather(column, rows) for column in columns]
+        target = tf.concat([batch[0]] + [tf.gather(weights, ids) for weights, ids in zip(embeddings, batch[1:])], axis=1)
+        inputs = {name: values if name == "numerical_input" else tf.reshape(values, [-1, 1]) for name, values in zip(INPUT_NAMES, batch)}
+        return inputs, target
+
+    if shuffle:
+        # a new permutation of the row ids every epoch. Permuting them in one op keeps the steps as fast as
+        # without shuffling, a shuffle buffer over every row halved them.
+        n_rows = len(num)
+        rows = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).take(1).map(
+            lambda epoch_seed: tf.random.experimental.stateless_shuffle(tf.range(n_rows, dtype=tf.int64), seed=tf.stack([epoch_seed, 0]))).unbatch()
+    else:
+        rows = tf.data.Dataset.range(len(num))
+    return rows.batch(batch_size).map(load_batch, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
 
-    train_num, train_artist, train_genre, train_emotion = train_data
-    val_num, val_artist, val_genre, val_emotion = val_data
+# trains the autoencoder on our traing and test data
+def train_autoencoder(autoencoder, num_cols, train_data, val_data, test_data, epochs=20, batch_size=256, device=None):
 
-    print("Training on device:", tf.test.gpu_device_name() or "CPU")
+    device = device or default_device()
+    print("Training on device:", device)
     print(f"Training with batch size={batch_size}, epochs={epochs}")
     
-    with tf.device('/GPU:0'):
+    with tf.device(device):
         history = autoencoder.fit(
-            x=[train_num, train_artist, train_genre, train_emotion],
-            y=np.concatenate([train_num, 
-                              autoencoder.get_layer("artist_embedding")(train_artist), 
-                              autoencoder.get_layer("genre_embedding")(train_genre), 
-                              autoencoder.get_layer("emotion_embedding")(train_emotion)], axis=1),
-            validation_data=([val_num, val_artist, val_genre, val_emotion], 
-                             np.concatenate([val_num, 
-                                            autoencoder.get_layer("artist_embedding")(val_artist), 
-                                            autoencoder.get_layer("genre_embedding")(val_genre), 
-                                            autoencoder.get_layer("emotion_embedding")(val_emotion)], axis=1)),
+            make_dataset(autoencoder, train_data, batch_size, shuffle=True),
+            validation_data=make_dataset(autoencoder, val_data, batch_size),
             epochs=epochs,
-            batch_size=batch_size,
+            shuffle=False, # make_dataset shuffles
             verbose=1,
             callbacks=[tf.keras.callbacks.EarlyStopping(patience=3, restore_best_weights=True)]
         )
@@ -129,7 +201,7 @@ def train_autoencoder(autoencoder, num_cols, train_data, val_data, test_data, ep
     return history
 
 # Tests the autoencoder with the test data
-def evaluate_autoencoder(autoencoder, test_data, batch_size=256):
+def evaluate_autoencoder(autoencoder, test_data, batch_size=256, device=None):
     test_num, test_artist, test_genre, test_emotion = test_data
 
     test_target = np.concatenate([test_num,
@@ -137,15 +209,11 @@ def evaluate_autoencoder(autoencoder, test_data, batch_size=256):
                                   autoencoder.get_layer("genre_embedding")(test_genre),
                                   autoencoder.get_layer("emotion_embedding")(test_emotion)], axis=1)
     
-    with tf.device("/GPU:0"):
-        test_loss = autoencoder.evaluate(
-            x=[test_num, test_artist, test_genre, test_emotion],
-            y=[test_target],
-            batch_size=batch_size,
-            verbose=0
-        )
+    with tf.device(device or default_device()):
+        test_dataset = make_dataset(autoencoder, test_data, batch_size)
+        test_loss = autoencoder.evaluate(test_dataset, verbose=0)
 
-        predictions = autoencoder.predict([test_num, test_artist, test_genre, test_emotion])
+        predictions = autoencoder.predict(test_dataset.map(lambda inputs, target: inputs), verbose=0)
 
     return test_loss, predictions, test_target
 
@@ -154,7 +222,10 @@ if __name__ == "__main__":
 
     # number of input features
     num_features = 17
-    batch_size = 16384
+
+    # device, threads and precision (TRAIN_* environment variables), set before TensorFlow runs anything
+    config, jit_compile, batch_size = training_config_from_env()
+    device = configure_training(**config)
 
     # load pre-processed data
     df, embedding_data = load_preprocessed_data()
@@ -166,13 +237,13 @@ if __name__ == "__main__":
     num_artists, num_genres, num_emotions = get_training_data_stats(df)
 
     # build, train, and evaluate the autoencoder
-    autoencoder, encoder_model = build_autoencoder(num_features=num_features, num_artists=num_artists,num_emotions=num_emotions, num_genres=num_genres)
+    autoencoder, encoder_model = build_autoencoder(num_features=num_features, num_artists=num_artists,num_emotions=num_emotions, num_genres=num_genres, jit_compile=jit_compile)
     
     print(autoencoder.summary())
 
-    history = train_autoencoder(autoencoder, num_cols, train_data, val_data, test_data, epochs=60, batch_size=batch_size)
+    history = train_autoencoder(autoencoder, num_cols, train_data, val_data, test_data, epochs=60, batch_size=batch_size, device=device)
 
-    test_loss, predictions, test_target = evaluate_autoencoder(autoencoder, test_data, batch_size=batch_size)
+    test_loss, predictions, test_target = evaluate_autoencoder(autoencoder, test_data, batch_size=batch_size, device=device)
 
     # Visualize the results
     #visualize_latent_space(encoder_model, test_data, method="tsne", save_path="../visualizations/training/latent-space.png")
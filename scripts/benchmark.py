@@ -0,0 +1,636 @@
+'''
+Benchmarks for the recommendation search path. Uses synthetic latent vectors so no downloaded artifacts are needed.
+
+    python scripts/benchmark.py [query_latency] [cold_start] [memory] [index_recall] [pq] [batch_search] [encoder] [neighbors] [filtered_search] [rerank] [shard_scaling] [shared_memory] [preprocess_scaling]
+        [training_pipeline] [training_configs]
+'''
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import gc
+import csv
+import json
+import tempfile
+import contextlib
+import tracemalloc
+import numpy as np
+from scripts.Recommender import Recommender
+from scripts.latent_store import LatentStore, convert_csv_to_latent_store, normalize_rows, write_latent_store
+from scripts.latent_index import create_index
+from scripts.encoder_inference import NumpyEncoder, extract_encoder_weights, save_encoder_weights, load_encoder_weights
+from scripts.neighbors import compute_neighbors
+from scripts.vocabulary import Vocabulary
+
+# Creates synthetic latent vectors and metadata columns shaped like latent-space-lookup.csv
+def make_synthetic_catalog(n_songs, latent_dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n_songs, latent_dim)).astype(np.float32)
+    metadata = {
+        "artist": [f"artist {i % 5000}" for i in range(n_songs)],
+        "genre": [f"genre {i % 100}" for i in range(n_songs)],
+        "song": [f"song {i}" for i in range(n_songs)],
+    }
+    return vectors, metadata
+
+# The tuple-keyed lookup table the Recommender used to build from the CSV
+def legacy_latent_dict(vectors, metadata):
+    return {
+        tuple(float(v) for v in vector): {name: values[i] for name, values in metadata.items()}
+        for i, vector in enumerate(vectors)
+    }
+
+# Creates normalized latent vectors drawn from a mixture of gaussians, closer to the clustered shape of the
+# real latent space than uniform noise (approximate indexes rely on that structure)
+def make_clustered_vectors(n_songs, latent_dim, n_clusters=200, spread=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, latent_dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_songs)] + spread * rng.standard_normal((n_songs, latent_dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+# Builds a Recommender around an in-memory latent store and an exact index over it, without downloading any
+# models or data
+def make_benchmark_recommender(store):
+    Recommender.latent_store = store
+    Recommender.latent_index = create_index("brute_force").build(store.vectors)
+    return Recommender.__new__(Recommender)
+
+# The search as it was before the latent matrix was precomputed (rebuilds the matrix and norms on every call)
+def legacy_similiar_latent_space(latent_dict, latent_space, n):
+    latent_space = np.array(latent_space, dtype=np.float32)
+    latent_keys = np.array([list(map(float, key)) for key in latent_dict.keys()], dtype=np.float32)
+    metadata_list = list(latent_dict.values())
+
+    cosine_similarities = np.dot(latent_keys, latent_space) / (np.linalg.norm(latent_space) * np.linalg.norm(latent_keys, axis=1))
+
+    valid_indices = np.where(cosine_similarities > 0.9)[0]
+    valid_similarities = cosine_similarities[valid_indices]
+    valid_metadata = [metadata_list[i] for i in valid_indices]
+
+    if len(valid_indices) <= n:
+        top_n_indices = np.arange(len(valid_indices))
+    else:
+        top_n_indices = np.argpartition(valid_similarities, -n)[-n:]
+    top_n_indices = top_n_indices[np.argsort(valid_similarities[top_n_indices])[::-1]]
+
+    return [{"score": valid_similarities[idx], "metadata": valid_metadata[idx]} for idx in top_n_indices]
+
+# Returns (mean, p50, p99) latency in milliseconds of calling fn once per query
+def time_queries(fn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return timings.mean(), np.percentile(timings, 50), np.percentile(timings, 99)
+
+# Per-query latency of get_similiar_latent_space before and after precomputing the normalized latent matrix
+def benchmark_query_latency(n_songs=200000, latent_dim=20, n_queries=20, n=15):
+    print(f"Building synthetic catalog of {n_songs} songs ({latent_dim}D)...")
+    vectors, metadata = make_synthetic_catalog(n_songs, latent_dim)
+    latent_dict = legacy_latent_dict(vectors, metadata)
+
+    start = time.perf_counter()
+    recommender = make_benchmark_recommender(LatentStore.from_arrays(vectors, metadata))
+    print(f"One-time latent matrix build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    queries = list(rng.standard_normal((n_queries, latent_dim)).astype(np.float32))
+
+    legacy = time_queries(lambda q: legacy_similiar_latent_space(latent_dict, q, n), queries)
+    current = time_queries(lambda q: recommender.get_similiar_latent_space(q, n), queries)
+
+    print(f"{'':<12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'before':<12}{legacy[0]:>10.2f}{legacy[1]:>10.2f}{legacy[2]:>10.2f}")
+    print(f"{'after':<12}{current[0]:>10.2f}{current[1]:>10.2f}{current[2]:>10.2f}")
+    print(f"Speedup: {legacy[0] / current[0]:.1f}x")
+
+# Startup cost of parsing latent-space-lookup.csv versus memory mapping the binary latent store
+def benchmark_cold_start(n_songs=200000, latent_dim=20):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "latent-space-lookup.csv")
+        store_path = os.path.join(tmp_dir, "latent-store.bin")
+
+        rng = np.random.default_rng(0)
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Artist(s)", "Genre", "song"] + [f"latent_{i}" for i in range(latent_dim)])
+            for i, vector in enumerate(rng.standard_normal((n_songs, latent_dim))):
+                writer.writerow([f"artist {i % 5000}", f"genre {i % 100}", f"song {i}"] + [f"{v:.6f}" for v in vector])
+
+        start = time.perf_counter()
+        with open(csv_path, "r", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            headers = next(reader)
+            latent_indices = [i for i, header in enumerate(headers) if header.startswith("latent_")]
+            latent_dict = {
+                tuple(float(row[i]) for i in latent_indices): {"artist": row[headers.index("Artist(s)")], "genre": row[headers.index("Genre")], "song": row[headers.index("song")]}
+                for row in reader
+            }
+        np.array(list(latent_dict.keys()), dtype=np.float32)
+        csv_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        convert_csv_to_latent_store(csv_path, store_path)
+        convert_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = LatentStore.load(store_path)
+        store.vectors @ np.ones(latent_dim, dtype=np.float32) # touch every page once
+        store_seconds = time.perf_counter() - start
+
+        print(f"CSV parse + matrix build:  {csv_seconds * 1000:>10.1f} ms ({os.path.getsize(csv_path)} bytes)")
+        print(f"One-time conversion:       {convert_seconds * 1000:>10.1f} ms")
+        print(f"Latent store memmap:       {store_seconds * 1000:>10.1f} ms ({os.path.getsize(store_path)} bytes)")
+
+# Resident memory of the tuple-keyed lookup table versus the id-indexed columnar latent store
+def benchmark_memory(n_songs=200000, latent_dim=20):
+    vectors, metadata = make_synthetic_catalog(n_songs, latent_dim)
+    # duplicate a slice of the catalog, as songs with identical features do in the real dataset
+    vectors[1::10] = vectors[::10][:len(vectors[1::10])]
+
+    tracemalloc.start()
+    latent_dict = legacy_latent_dict(vectors, metadata)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    store = LatentStore.from_arrays(vectors, metadata)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"Tuple-keyed dict: {dict_bytes / 2**20:>8.1f} MiB, {len(latent_dict)} of {n_songs} songs retrievable")
+    print(f"Latent store:     {store_bytes / 2**20:>8.1f} MiB, {len(store)} of {n_songs} songs retrievable")
+
+# Recall@k and latency of each index against the exact scan, over a sweep of its search time parameter
+def benchmark_index_recall(n_songs=50000, latent_dim=20, n_queries=200, k=15):
+    vectors = make_clustered_vectors(n_songs + n_queries, latent_dim)
+    vectors, queries = vectors[:n_songs], vectors[n_songs:]
+
+    exact = create_index("brute_force").build(vectors)
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    exact_ms = time_queries(lambda q: exact.search(q, k), queries)[0]
+    print(f"{'index':<28}{'build s':>10}{'recall@' + str(k):>12}{'mean ms':>10}")
+    print(f"{'brute_force':<28}{0.0:>10.1f}{1.0:>12.3f}{exact_ms:>10.3f}")
+
+    sweeps = [
+        ("ivf", {"n_lists": 256}, "n_probe", [1, 4, 8, 16, 32]),
+        ("hnsw", {"M": 16, "ef_construction": 100}, "ef_search", [16, 32, 64, 128]),
+    ]
+    for kind, build_params, search_param, values in sweeps:
+        start = time.perf_counter()
+        index = create_index(kind, **build_params).build(vectors)
+        build_seconds = time.perf_counter() - start
+
+        for value in values:
+            index.tune(**{search_param: value})
+            recall = np.mean([len(truth[i] & set(index.search(q, k)[0].tolist())) / k for i, q in enumerate(queries)])
+            mean_ms = time_queries(lambda q: index.search(q, k), queries)[0]
+            print(f"{kind + ' ' + search_param + '=' + str(value):<28}{build_seconds:>10.1f}{recall:>12.3f}{mean_ms:>10.3f}")
+
+# Memory footprint and recall@k of product-quantized vectors against the float32 exact scan
+def benchmark_pq(n_songs=200000, latent_dim=20, n_queries=200, k=15):
+    vectors = make_clustered_vectors(n_songs + n_queries, latent_dim)
+    vectors, queries = vectors[:n_songs], vectors[n_songs:]
+
+    exact = create_index("brute_force").build(vectors)
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    exact_ms = time_queries(lambda q: exact.search(q, k), queries)[0]
+    print(f"{'index':<32}{'MiB':>8}{'bytes/song':>12}{'recall@' + str(k):>12}{'mean ms':>10}")
+    print(f"{'float32':<32}{vectors.nbytes / 2**20:>8.1f}{vectors.nbytes / n_songs:>12.1f}{1.0:>12.3f}{exact_ms:>10.3f}")
+
+    for n_subspaces in [4, 8, 10]:
+        index = create_index("pq", n_subspaces=n_subspaces).build(vectors)
+        for rerank in [0, 100, 500]:
+            index.tune(rerank=rerank)
+            recall = np.mean([len(truth[i] & set(index.search(q, k)[0].tolist())) / k for i, q in enumerate(queries)])
+            mean_ms = time_queries(lambda q: index.search(q, k), queries)[0]
+            print(f"{'pq m=' + str(n_subspaces) + ' rerank=' + str(rerank):<32}{index.nbytes() / 2**20:>8.1f}"
+                  f"{index.nbytes() / n_songs:>12.1f}{recall:>12.3f}{mean_ms:>10.3f}")
+
+# Searching a batch of profiles one query at a time versus one batched matrix-matrix search
+def benchmark_batch_search(n_songs=200000, latent_dim=20, batch_size=256, n=15):
+    vectors = make_clustered_vectors(n_songs + batch_size, latent_dim)
+    recommender = make_benchmark_recommender(LatentStore.from_arrays(vectors[:n_songs], {"song": [""] * n_songs}))
+    queries = vectors[n_songs:]
+
+    start = time.perf_counter()
+    looped = [recommender.get_similiar_latent_space(q, n) for q in queries]
+    loop_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    batched = recommender.get_similiar_latent_spaces(queries, n)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    same = all([r["id"] for r in a] == [r["id"] for r in b] for a, b in zip(looped, batched))
+    print(f"{batch_size} queries over {n_songs} songs (identical results: {same})")
+    print(f"one at a time: {loop_ms:>10.1f} ms ({loop_ms / batch_size:.3f} ms/query)")
+    print(f"batched:       {batch_ms:>10.1f} ms ({batch_ms / batch_size:.3f} ms/query)")
+
+# Single-sample and batch latency of Keras predict() versus the NumPy encoder, on a freshly built encoder
+def benchmark_encoder(n_artists=20000, n_genres=1000, n_emotions=20, n_queries=200, batch_size=256):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from autoencoder import build_autoencoder
+
+    _, keras_encoder = build_autoencoder(num_features=17, num_artists=n_artists, num_genres=n_genres, num_emotions=n_emotions)
+    numpy_encoder = NumpyEncoder(extract_encoder_weights(keras_encoder))
+
+    rng = np.random.default_rng(0)
+    def make_inputs(size):
+        return [rng.random((size, 17)).astype(np.float32), rng.integers(0, n_artists, size),
+                rng.integers(0, n_genres, size), rng.integers(0, n_emotions, size)]
+
+    singles = [make_inputs(1) for _ in range(n_queries)]
+    keras_single = time_queries(lambda inputs: keras_encoder.predict(inputs, verbose=0), singles)
+    numpy_single = time_queries(numpy_encoder.predict, singles)
+
+    batches = [make_inputs(batch_size) for _ in range(20)]
+    keras_batch = time_queries(lambda inputs: keras_encoder.predict(inputs, batch_size=batch_size, verbose=0), batches)
+    numpy_batch = time_queries(numpy_encoder.predict, batches)
+
+    max_diff = max(float(np.max(np.abs(keras_encoder.predict(inputs, verbose=0) - numpy_encoder.predict(inputs)))) for inputs in batches)
+    print(f"max |keras - numpy| latent difference: {max_diff:.2e}")
+    print(f"{'':<24}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, timing in [("keras predict (1)", keras_single), ("numpy (1)", numpy_single),
+                         (f"keras predict ({batch_size})", keras_batch), (f"numpy ({batch_size})", numpy_batch)]:
+        print(f"{name:<24}{timing[0]:>10.3f}{timing[1]:>10.3f}{timing[2]:>10.3f}")
+
+# Offline all-pairs kNN time on one core versus every core, and the latency of a precomputed "more like this"
+# lookup versus searching for the song's vector
+def benchmark_neighbors(n_songs=50000, latent_dim=20, k=50, n_queries=200):
+    vectors = make_clustered_vectors(n_songs, latent_dim)
+    for n_jobs in sorted({1, os.cpu_count()}):
+        start = time.perf_counter()
+        neighbors = compute_neighbors(vectors, k, n_jobs=n_jobs)
+        print(f"all-pairs top-{k} over {n_songs} songs, {n_jobs} thread(s): {time.perf_counter() - start:>8.2f} s")
+    print(f"neighbours file: {neighbors.nbytes / 2**20:.1f} MB ({neighbors.itemsize} bytes per song)")
+
+    recommender = make_benchmark_recommender(LatentStore.from_arrays(vectors, {"song": [""] * n_songs}))
+    song_ids = np.random.default_rng(0).integers(0, n_songs, n_queries)
+
+    Recommender.song_neighbors = None
+    searched = time_queries(lambda song_id: recommender.get_similar_songs(song_id, 15), song_ids)
+    expected = [[r["id"] for r in recommender.get_similar_songs(song_id, 15)] for song_id in song_ids]
+    Recommender.song_neighbors = neighbors
+    lookup = time_queries(lambda song_id: recommender.get_similar_songs(song_id, 15), song_ids)
+    found = [[r["id"] for r in recommender.get_similar_songs(song_id, 15)] for song_id in song_ids]
+    Recommender.song_neighbors = None
+
+    recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(expected, found)])
+    print(f"recall@15 of the float16 lists against a search: {recall:.3f}")
+    print(f"{'':<24}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, timing in [("search", searched), ("precomputed lookup", lookup)]:
+        print(f"{name:<24}{timing[0]:>10.3f}{timing[1]:>10.3f}{timing[2]:>10.3f}")
+
+# Latency of a filtered search over the candidate set versus scanning every song and post-filtering the top
+# results, for filters of decreasing selectivity
+def benchmark_filtered_search(n_songs=200000, latent_dim=20, n_queries=100, n=15):
+    vectors = make_clustered_vectors(n_songs + n_queries, latent_dim)
+    rng = np.random.default_rng(0)
+    genres = [f"genre {i}" for i in rng.zipf(1.5, n_songs) % 500]
+    tempo = rng.uniform(0, 1, n_songs)
+    store = LatentStore.from_arrays(vectors[:n_songs], {"genre": genres}, {"Tempo": tempo})
+    recommender = make_benchmark_recommender(store)
+    Recommender.normalized_params = {"Tempo": {"min": 0, "max": 1}}
+    queries = vectors[n_songs:]
+
+    print(f"{'filter':<36}{'matches':>10}{'post-filter ms':>16}{'found':>8}{'filtered ms':>14}{'found':>8}")
+    for filters in [{"genre": "genre 1"}, {"genre": "genre 3"}, {"genre": "genre 40"}, {"tempo": {"min": 0.5, "max": 0.51}},
+                    {"genre": "genre 1", "tempo": {"min": 0.2, "max": 0.3}}]:
+        rows = recommender.filter_rows(filters)
+        mask = np.zeros(n_songs, dtype=bool)
+        mask[rows] = True
+
+        # the old approach: search the whole catalog, then drop the songs that do not match
+        post_found = []
+        def post_filter(query):
+            ids, _ = Recommender.latent_index.search(query, n)
+            post_found.append(int(mask[ids].sum()))
+        post_ms = time_queries(post_filter, queries)[0]
+
+        filtered_found = []
+        def filtered(query):
+            ids, _ = Recommender.latent_index.search_candidates(query[None, :], n, rows)[0]
+            filtered_found.append(len(ids))
+        filtered_ms = time_queries(filtered, queries)[0]
+
+        print(f"{str(filters):<36}{len(rows):>10}{post_ms:>16.3f}{np.mean(post_found):>8.1f}{filtered_ms:>14.3f}{np.mean(filtered_found):>8.1f}")
+
+# Latency of MMR and per-artist cap re-ranking for several pool sizes, and how much they diversify the list.
+# The budget is a couple of milliseconds per query on top of the search.
+def benchmark_rerank(n_songs=200000, latent_dim=20, n_queries=100, n=15):
+    vectors = make_clustered_vectors(n_songs + n_queries, latent_dim)
+    # artists are cells of nearby songs, so plain top-n tends to repeat them
+    cells = np.round(vectors[:n_songs, :4] * 4).astype(np.int64)
+    artists = [f"artist {cell}" for cell in np.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)]
+    store = LatentStore.from_arrays(vectors[:n_songs], {"artist": artists})
+    recommender = make_benchmark_recommender(store)
+    queries = vectors[n_songs:]
+
+    def distinct_artists(results):
+        return np.mean([len({song["metadata"]["artist"] for song in songs}) for songs in results])
+
+    print(f"{'diversity':<52}{'search+rerank ms':>18}{'rerank ms':>11}{'artists':>9}{'mean score':>12}")
+    base = time_queries(lambda q: recommender.get_similiar_latent_space(q, n), queries)[0]
+    plain = [recommender.get_similiar_latent_space(q, n) for q in queries]
+    print(f"{'none':<52}{base:>18.3f}{0:>11.3f}{distinct_artists(plain):>9.1f}{np.mean([s['score'] for l in plain for s in l]):>12.4f}")
+    for diversity in [{"lambda": 0.3, "pool": 100}, {"lambda": 0.3, "pool": 300}, {"lambda": 0.3, "pool": 1000},
+                      {"max_per_artist": 2, "pool": 300}, {"lambda": 0.3, "max_per_artist": 2, "pool": 300}]:
+        pool_ms = time_queries(lambda q: Recommender.latent_index.search(q, diversity["pool"]), queries)[0]
+        total_ms = time_queries(lambda q: recommender.get_similiar_latent_space(q, n, diversity=diversity), queries)[0]
+        results = [recommender.get_similiar_latent_space(q, n, diversity=diversity) for q in queries]
+        print(f"{str(diversity):<52}{total_ms:>18.3f}{total_ms - pool_ms:>11.3f}{distinct_artists(results):>9.1f}"
+              f"{np.mean([s['score'] for l in results for s in l]):>12.4f}")
+
+# Normalized random latent vectors generated in chunks, for catalogs too large for make_clustered_vectors
+def make_large_vectors(n_songs, latent_dim, chunk_size=1000000, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((n_songs, latent_dim), dtype=np.float32)
+    for start in range(0, n_songs, chunk_size):
+        end = min(start + chunk_size, n_songs)
+        vectors[start:end] = normalize_rows(rng.standard_normal((end - start, latent_dim), dtype=np.float32))
+    return vectors
+
+# Exact search latency with the latent matrix split into 1 to cpu_count shards on a thread pool, for a single
+# query and a batch of queries, on catalogs from 100k to 10M songs
+def benchmark_shard_scaling(sizes=(100000, 1000000, 10000000), latent_dim=20, n_queries=20, batch_size=64, k=15):
+    shard_counts = sorted({1, 2, 4, 8, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+    print(f"{os.cpu_count()} cores")
+    print(f"{'songs':>10}{'shards':>8}{'query ms':>12}{'speedup':>9}{'batch ms':>12}{'speedup':>9}")
+    for n_songs in sizes:
+        vectors = make_large_vectors(n_songs, latent_dim)
+        queries = make_large_vectors(n_queries, latent_dim, seed=1)
+        batches = [make_large_vectors(batch_size, latent_dim, seed=seed) for seed in range(2, 5)]
+        baseline = None
+        for n_shards in shard_counts:
+            index = create_index("brute_force", n_shards=n_shards).build(vectors)
+            index.search(queries[0], k) # start the thread pool
+            single = time_queries(lambda q: index.search(q, k), queries)[0]
+            batch = time_queries(lambda b: index.search_many(b, k), batches)[0]
+            baseline = baseline or (single, batch)
+            print(f"{n_songs:>10}{len(index.shards()):>8}{single:>12.3f}{baseline[0] / single:>8.2f}x{batch:>12.3f}{baseline[1] / batch:>8.2f}x")
+        del vectors
+
+# Rss, Pss and private (Uss) memory of a process in MB, from /proc (Linux only)
+def process_memory(pid="self"):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "uss": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+# Total memory of forked serving workers that each load the artifacts themselves (as gunicorn workers did)
+# versus loading them once in the parent before forking (gunicorn.conf.py)
+def benchmark_shared_memory(n_songs=500000, latent_dim=20, n_artists=200000, worker_counts=(1, 2, 4, 8), n_batches=20, batch_size=32):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store_path = os.path.join(tmpdir, "latent-store.bin")
+        write_latent_store(store_path, make_clustered_vectors(n_songs, latent_dim), {"song": [f"song {i}" for i in range(n_songs)]})
+        artist_path = os.path.join(tmpdir, "artist-json.json")
+        with open(artist_path, "w") as f:
+            json.dump({f"artist {i}": i for i in range(n_artists)}, f)
+        rng = np.random.default_rng(0)
+        weights_path = save_encoder_weights(os.path.join(tmpdir, "encoder-weights.npz"), {
+            "artist_embedding": rng.standard_normal((n_artists, 100), dtype=np.float32),
+            "genre_embedding": rng.standard_normal((1000, 50), dtype=np.float32),
+            "emotion_embedding": rng.standard_normal((20, 25), dtype=np.float32),
+            "hidden_kernel": rng.standard_normal((17 + 175, 64), dtype=np.float32),
+            "hidden_bias": np.zeros(64, dtype=np.float32),
+            "latent_kernel": rng.standard_normal((64, latent_dim), dtype=np.float32),
+            "latent_bias": np.zeros(latent_dim, dtype=np.float32),
+        })
+        profiles = [[{"tempo": int(t), "artist": f"artist {a}"} for t, a in zip(rng.integers(0, 200, batch_size), rng.integers(0, n_artists, batch_size))]
+                    for _ in range(n_batches)]
+
+        def load(vocabulary):
+            Recommender.latent_store = LatentStore.load(store_path)
+            Recommender.latent_index = create_index("brute_force").build(Recommender.latent_store.vectors)
+            Recommender.encoder_model = NumpyEncoder(load_encoder_weights(weights_path))
+            with open(artist_path) as f:
+                artists = json.load(f)
+            Recommender.age_dict = {"artist": Vocabulary.from_dict(artists) if vocabulary else artists, "genre": {}, "emotion": {}}
+            Recommender.normalized_params = {}
+            Recommender.result_cache = None
+
+        def run_workers(n_workers, preload, vocabulary):
+            if preload:
+                load(vocabulary)
+                gc.collect()
+                gc.freeze()
+            stats_read, stats_write = os.pipe()
+            done_read, done_write = os.pipe()
+            pids = []
+            for _ in range(n_workers):
+                pid = os.fork()
+                if pid == 0:
+                    os.close(stats_read)
+                    os.close(done_write)
+                    if not preload:
+                        load(vocabulary)
+                    recommender = Recommender.__new__(Recommender)
+                    for batch in profiles:
+                        recommender.recommend_many(batch, 10)
+                    os.write(stats_write, (json.dumps(process_memory()) + "\n").encode())
+                    os.close(stats_write)
+                    os.read(done_read, 1) # stay alive until the parent has measured itself
+                    os._exit(0)
+                pids.append(pid)
+            os.close(stats_write)
+            os.close(done_read)
+            with os.fdopen(stats_read) as f:
+                workers = [json.loads(line) for line in f]
+            parent = process_memory()
+            os.close(done_write)
+            for pid in pids:
+                os.waitpid(pid, 0)
+            if preload:
+                gc.unfreeze()
+                Recommender.latent_store = Recommender.latent_index = Recommender.encoder_model = None
+                Recommender.age_dict = {}
+            return parent["pss"] + sum(w["pss"] for w in workers), np.mean([w["uss"] for w in workers])
+
+        print(f"{n_songs} songs, {n_artists} artists (PSS counts each shared page once across processes)")
+        print(f"{'mode':<40}{'workers':>8}{'total PSS MB':>14}{'private MB/worker':>19}")
+        for name, preload, vocabulary in [("load per worker, dict vocabularies", False, False),
+                                          ("preload before fork, dict vocabularies", True, False),
+                                          ("preload before fork, Vocabulary", True, True)]:
+            for n_workers in worker_counts:
+                total_pss, uss = run_workers(n_workers, preload, vocabulary)
+                print(f"{name:<40}{n_workers:>8}{total_pss:>14.1f}{uss:>19.1f}")
+
+# Writes a csv shaped like spotify_dataset.csv (same columns, quoted multi-line lyrics, a few missing values)
+def make_raw_dataset(path, n_rows, n_artists=20000, seed=0):
+    import pandas as pd
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from scripts.data import get_num_features, get_good_for_features
+
+    rng = np.random.default_rng(seed)
+    artists = np.array([f"Artist {i}" for i in range(n_artists)])
+    words = np.array(["love", "night", "baby", "dance", "heart", "\"yeah\"", "fire", "rain,", "home", "\n"])
+    columns = {
+        "Artist(s)": np.where(rng.random(n_rows) < 0.3,
+                              np.char.add(np.char.add(artists[rng.integers(0, n_artists, n_rows)], ", "), artists[rng.integers(0, n_artists, n_rows)]),
+                              artists[rng.integers(0, n_artists, n_rows)]),
+        "song": [f"song {i}" for i in range(n_rows)],
+        "text": [" ".join(words[rng.integers(0, len(words), 200)]) for _ in range(n_rows)],
+        "Length": "03:47",
+        "emotion": rng.choice(["joy", "sadness", "anger", "love", "fear", "surprise"], n_rows),
+        "Genre": rng.choice(["hip hop", "pop", "rock,pop", "jazz", "edm", "country"], n_rows),
+        "Album": "album",
+        "Release Date": "2019-01-01",
+        "Key": "D min",
+        "Loudness (db)": "-6.2db",
+        "Time signature": "4/4",
+        "Explicit": rng.choice(["Yes", "No"], n_rows),
+    }
+    for feature in get_num_features():
+        columns[feature] = rng.integers(60, 200, n_rows) if feature == "Tempo" else rng.integers(0, 100, n_rows)
+    for feature in get_good_for_features():
+        columns[feature] = rng.integers(0, 2, n_rows)
+    for k in (1, 2, 3):
+        columns[f"Similar Artist {k}"] = artists[rng.integers(0, n_artists, n_rows)]
+        columns[f"Similar Song {k}"] = "song"
+        columns[f"Similarity Score {k}"] = rng.random(n_rows)
+
+    df = pd.DataFrame(columns)
+    df.loc[rng.random(n_rows) < 0.01, "text"] = np.nan
+    df.to_csv(path, index=False)
+
+# Streaming pre-processing time with 1 to cpu_count worker processes on a synthetic raw csv, checking that
+# every worker count produces the same vocabularies and columns
+def benchmark_preprocess_scaling(n_rows=300000, chunk_mb=16):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from scripts.data import preprocess_streaming, load_columnar
+
+    worker_counts = sorted({1, 2, 4, 8, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "spotify_dataset.csv")
+        make_raw_dataset(csv_path, n_rows)
+        print(f"{os.cpu_count()} cores, {n_rows} rows, {os.path.getsize(csv_path) / 2**20:.0f} MB csv, {chunk_mb} MB chunks")
+        print(f"{'workers':>8}{'seconds':>10}{'speedup':>9}{'identical':>11}")
+        baseline = None
+        for n_jobs in worker_counts:
+            out_dir = os.path.join(tmp, f"pre-processed-{n_jobs}")
+            start = time.perf_counter()
+            stats = preprocess_streaming(csv_path, tmp, out_dir, chunk_bytes=chunk_mb * 2**20, n_jobs=n_jobs, verbose=False)
+            elapsed = time.perf_counter() - start
+            output = load_columnar(out_dir)
+            if baseline is None:
+                baseline = (elapsed, stats, output)
+            identical = all(stats[v] == baseline[1][v] for v in ("artists", "genres", "emotions")) and output.equals(baseline[2])
+            print(f"{n_jobs:>8}{elapsed:>10.2f}{baseline[0] / elapsed:>8.2f}x{str(identical):>11}")
+
+# Pre-processed training arrays shaped like prepare_data's (17 normalized features and artist/genre/emotion ids)
+def make_training_data(n_rows, n_artists, n_genres=1000, n_emotions=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.random((n_rows, 17)), rng.integers(0, n_artists, n_rows), rng.integers(0, n_genres, n_rows), rng.integers(0, n_emotions, n_rows)]
+
+# A random sample of the pre-processed training rows (the columnar output of `python data.py stream`), or
+# synthetic rows when there is none
+def load_training_sample(n_rows, n_artists=50000, seed=0):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from scripts.data import open_columnar, ID_COLUMNS
+
+    columnar_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "pre-processed")
+    if not os.path.exists(os.path.join(columnar_dir, "columns.json")):
+        return make_training_data(n_rows, n_artists, seed=seed), "synthetic"
+    columns, _ = open_columnar(columnar_dir)
+    n_total = len(columns[ID_COLUMNS[0]])
+    rows = np.sort(np.random.default_rng(seed).choice(n_total, min(n_rows, n_total), replace=False))
+    numerical = np.column_stack([column[rows] for name, column in columns.items() if name not in ID_COLUMNS])
+    return [numerical] + [np.asarray(columns[name][rows]) for name in ID_COLUMNS], "pre-processed"
+
+# Trains a fresh autoencoder for a few epochs in this process, feeding it either the targets materialized up
+# front (as train_autoencoder used to) or the tf.data pipeline, after configure_training(**config) when a
+# config is given. Returns the epoch times in seconds, steps/s after the first epoch, the process's peak RSS
+# and the last epoch's loss.
+def train_epochs(n_rows, epochs, batch_size, pipeline="tf.data", config=None, jit_compile=False, n_artists=50000):
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import resource
+    import tensorflow as tf
+    from autoencoder import build_autoencoder, make_dataset, configure_training
+
+    device = configure_training(**config) if config is not None else None
+    data, _ = load_training_sample(n_rows, n_artists)
+    n_ids = [int(ids.max()) + 1 for ids in data[1:]]
+    epoch_times = []
+    timer = tf.keras.callbacks.LambdaCallback(on_epoch_begin=lambda epoch, logs: epoch_times.append(time.perf_counter()),
+                                              on_epoch_end=lambda epoch, logs: epoch_times.append(time.perf_counter() - epoch_times.pop()))
+    with tf.device(device) if device else contextlib.nullcontext():
+        autoencoder, _ = build_autoencoder(num_features=data[0].shape[1], num_artists=n_ids[0], num_genres=n_ids[1], num_emotions=n_ids[2], jit_compile=jit_compile)
+        if pipeline == "materialized":
+            target = np.concatenate([data[0]] + [autoencoder.get_layer(name)(ids) for name, ids in
+                                                 zip(["artist_embedding", "genre_embedding", "emotion_embedding"], data[1:])], axis=1)
+            history = autoencoder.fit(x=data, y=target, epochs=epochs, batch_size=batch_size, verbose=0, callbacks=[timer])
+        else:
+            history = autoencoder.fit(make_dataset(autoencoder, data, batch_size, shuffle=True), epochs=epochs, shuffle=False, verbose=0, callbacks=[timer])
+
+    steps = (len(data[0]) + batch_size - 1) // batch_size
+    return {
+        "epoch_times": epoch_times,
+        "steps_per_second": steps / np.mean(epoch_times[1:] or epoch_times),
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "loss": history.history["loss"][-1],
+    }
+
+# Runs train_epochs in a new process: TensorFlow does not survive a fork, its thread pools and precision policy
+# are fixed once it has started, and the peak memory is then the run's own
+def train_epochs_in_process(*args, **kwargs):
+    import multiprocessing
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(train_epochs, args, kwargs)
+
+# Autoencoder training throughput and peak memory with the targets materialized up front versus computed per
+# batch in the tf.data pipeline (autoencoder.make_dataset)
+def benchmark_training_pipeline(n_rows=500000, n_artists=50000, epochs=3, batch_size=16384):
+    print(f"{n_rows} rows, {n_artists} artists, batch size {batch_size}, {epochs} epochs (steps/s excludes the first)")
+    print(f"{'pipeline':<14}{'steps/s':>10}{'peak RSS MB':>13}")
+    for pipeline in ["materialized", "tf.data"]:
+        result = train_epochs_in_process(n_rows, epochs, batch_size, pipeline, n_artists=n_artists)
+        print(f"{pipeline:<14}{result['steps_per_second']:>10.2f}{result['peak_mb']:>13.0f}")
+
+# Epoch time of CPU training configurations (autoencoder.configure_training and XLA compiled train steps) on a
+# sample of the pre-processed data, each in a new process. The first epoch includes tracing and compilation,
+# the others are summarized by their median (single epochs are easily slowed down by other processes).
+def benchmark_training_configs(n_rows=200000, epochs=5, batch_size=16384):
+    configs = [
+        ("stock", None, False),
+        ("cpu threads", {"device": "cpu"}, False),
+        ("cpu threads + XLA", {"device": "cpu"}, True),
+        ("cpu threads + XLA + bfloat16", {"device": "cpu", "mixed_precision": True}, True),
+    ]
+    print(f"{os.cpu_count()} cores, {n_rows} {load_training_sample(1)[1]} rows, batch size {batch_size}, {epochs} epochs")
+    print(f"{'config':<30}{'first epoch s':>14}{'epoch s':>9}{'rows/s':>10}{'speedup':>9}{'loss':>9}")
+    baseline = None
+    for name, config, jit_compile in configs:
+        result = train_epochs_in_process(n_rows, epochs, batch_size, config=config, jit_compile=jit_compile)
+        epoch_seconds = np.median(result["epoch_times"][1:] or result["epoch_times"])
+        baseline = baseline or epoch_seconds
+        print(f"{name:<30}{result['epoch_times'][0]:>14.2f}{epoch_seconds:>9.2f}{n_rows / epoch_seconds:>10.0f}"
+              f"{baseline / epoch_seconds:>8.2f}x{result['loss']:>9.4f}")
+
+BENCHMARKS = {
+    "query_latency": benchmark_query_latency,
+    "cold_start": benchmark_cold_start,
+    "memory": benchmark_memory,
+    "index_recall": benchmark_index_recall,
+    "pq": benchmark_pq,
+    "batch_search": benchmark_batch_search,
+    "encoder": benchmark_encoder,
+    "neighbors": benchmark_neighbors,
+    "filtered_search": benchmark_filtered_search,
+    "rerank": benchmark_rerank,
+    "shard_scaling": benchmark_shard_scaling,
+    "shared_memory": benchmark_shared_memory,
+    "preprocess_scaling": benchmark_preprocess_scaling,
+    "training_pipeline": benchmark_training_pipeline,
+    "training_configs": benchmark_training_configs,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"=== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,136 @@
+'''
+Versioned artifact bundles, so the API can switch to a new encoder, vocabularies and latent store without a
+restart (see api/hot_swap.py).
+
+A bundle is an immutable directory <BUNDLE_DIR>/<version>/ laid out like the artifact cache (data/, models/),
+holding everything one version of the recommender serves from: the encoder weights, the artist/genre/emotion
+vocabularies, the normalization params, the latent store and, optionally, the song neighbours. bundle.json
+records the size and sha256 of every file; a bundle is loaded offline and only if every file matches. The
+ACTIVE file names the version servers load on start and converge to.
+
+    python scripts/bundles.py create <version> [source_dir]   copy the artifacts of source_dir (default the artifact cache)
+    python scripts/bundles.py list
+    python scripts/bundles.py activate <version>
+
+Configuration:
+    BUNDLE_DIR  directory of the bundles, bundles are disabled when it is not set
+'''
+import sys
+import os
+import re
+import json
+import time
+import shutil
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.artifacts import ArtifactManager, ArtifactError, MANIFEST, build_manifest, load_manifest
+from scripts.segments import resolve_base, compacted_neighbors
+
+# artifacts every bundle holds, and the ones it may leave out (similar songs are then searched)
+BUNDLE_ARTIFACTS = ['encoder_weights', 'latent_store', 'artist_json', 'genre_json', 'emotion_json', 'normalization_params']
+OPTIONAL_ARTIFACTS = ['song_neighbors']
+
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+def bundles_root(bundles_dir=None):
+    return bundles_dir or os.environ.get('BUNDLE_DIR')
+
+def bundle_dir(version, bundles_dir=None):
+    if not VERSION_PATTERN.match(str(version)):
+        raise ValueError(f"Invalid bundle version {version!r}")
+    return os.path.join(bundles_root(bundles_dir), version)
+
+# Copies the artifacts of a cache or project directory into a new bundle. The files are copied into a temporary
+# directory that is renamed into place once bundle.json is written, so a bundle is never seen half copied.
+def create_bundle(version, source_dir=None, bundles_dir=None):
+    source_dir = source_dir or os.environ.get('ARTIFACT_CACHE_DIR', '/tmp')
+    path = bundle_dir(version, bundles_dir)
+    if os.path.exists(path):
+        raise ValueError(f"Bundle {version} already exists, bundles are immutable")
+
+    missing = [key for key in BUNDLE_ARTIFACTS if not os.path.exists(os.path.join(source_dir, MANIFEST[key]['path']))]
+    if missing:
+        raise ArtifactError(f"{source_dir} has no {', '.join(missing)}")
+    # a compacted base and its neighbours are bundled in place of the published ones
+    store_path = os.path.join(source_dir, MANIFEST['latent_store']['path'])
+    base_path, segments = resolve_base(store_path)
+    if segments['deltas']:
+        raise ValueError(f"{store_path} has delta segments, compact them first (python scripts/segments.py compact)")
+    sources = {'latent_store': base_path, 'song_neighbors': compacted_neighbors(store_path)}
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        for key in BUNDLE_ARTIFACTS + OPTIONAL_ARTIFACTS:
+            source = sources.get(key) or os.path.join(source_dir, MANIFEST[key]['path'])
+            if os.path.exists(source):
+                os.makedirs(os.path.dirname(os.path.join(tmp_path, MANIFEST[key]['path'])), exist_ok=True)
+                shutil.copyfile(source, os.path.join(tmp_path, MANIFEST[key]['path']))
+
+        bundle = {"version": version, "created_at": time.time(), "artifacts": build_manifest(tmp_path)}
+        with open(os.path.join(tmp_path, "bundle.json"), "w") as f:
+            json.dump(bundle, f, indent=4)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    print(f"Created bundle {version} in {path}")
+    return path
+
+def read_bundle(version, bundles_dir=None):
+    with open(os.path.join(bundle_dir(version, bundles_dir), "bundle.json")) as f:
+        return json.load(f)
+
+# Versions of the complete bundles, oldest first
+def list_bundles(bundles_dir=None):
+    root = bundles_root(bundles_dir)
+    if not root or not os.path.isdir(root):
+        return []
+    bundles = []
+    for name in os.listdir(root):
+        if VERSION_PATTERN.match(name) and os.path.exists(os.path.join(root, name, "bundle.json")):
+            bundles.append((read_bundle(name, root)["created_at"], name))
+    return [name for _, name in sorted(bundles)]
+
+# An offline ArtifactManager over a bundle: fetch returns the bundle's files once they match bundle.json, and
+# never downloads
+def bundle_artifacts(version, bundles_dir=None):
+    bundle = read_bundle(version, bundles_dir)
+    manifest = load_manifest()
+    for key, entry in bundle["artifacts"].items():
+        manifest.setdefault(key, {}).update(entry)
+    return ArtifactManager(cache_dir=bundle_dir(version, bundles_dir), manifest=manifest, offline=True)
+
+# The version named by the ACTIVE file, or None
+def active_version(bundles_dir=None):
+    root = bundles_root(bundles_dir)
+    if not root:
+        return None
+    try:
+        with open(os.path.join(root, "ACTIVE")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def set_active_version(version, bundles_dir=None):
+    if not os.path.exists(os.path.join(bundle_dir(version, bundles_dir), "bundle.json")):
+        raise ValueError(f"Unknown bundle {version}")
+    path = os.path.join(bundles_root(bundles_dir), "ACTIVE")
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    if not bundles_root():
+        print("Set BUNDLE_DIR to the directory of the bundles")
+    elif len(sys.argv) > 2 and sys.argv[1] == "create":
+        create_bundle(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == "list":
+        active = active_version()
+        for version in list_bundles():
+            print(f"{version}{' (active)' if version == active else ''}")
+    elif len(sys.argv) > 2 and sys.argv[1] == "activate":
+        set_active_version(sys.argv[2])
+        print(f"Activated {sys.argv[2]}, servers polling BUNDLE_DIR switch to it, or POST /admin/reload")
+    else:
+        print(__doc__)
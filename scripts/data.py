@@ -1,7 +1,13 @@
 import pandas as pd
+import numpy as np
 from pprint import pprint
+import sys
+import os
+import io
+import multiprocessing
 import time
 import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 def load_data(p_col_names: bool, max_rows: int):
     data = pd.read_csv("../data/spotify_dataset.csv", nrows=max_rows)
@@ -110,8 +116,318 @@ def get_num_features():
         "Tempo",
     ]
 
+def get_good_for_features():
+    return [
+        "Good for Party",
+        "Good for Work/Study",
+        "Good for Relaxation/Meditation",
+        "Good for Exercise",
+        "Good for Running",
+        "Good for Yoga/Stretching",
+        "Good for Driving",
+        "Good for Social Gatherings",
+        "Good for Morning Routine",
+    ]
+
+# columns that are not used for training, removed before saving the pre-processed data
+DROPPED_COLUMNS = ["text", "Length", "Album", "Release Date", "Key", "Loudness (db)", "Time signature", "Explicit", "Good for Yoga/Stretching", "Good for Relaxation/Meditation", "Similar Artist 1", "Similar Song 1", "Similarity Score 1", "Similar Artist 2", "Similar Song 2", "Similarity Score 2", "Similar Artist 3", "Similar Song 3", "Similarity Score 3", "Artist(s)", "song", "emotion", "Genre"]
+ID_COLUMNS = ["Artist_IDS", "Genre_IDS", "Emotion_IDS"]
+# text columns kept next to the training columns of the streaming output, for the latent space mapping
+TEXT_COLUMNS = ["Artist(s)", "song", "Genre", "emotion"]
+MEDITATION = "Good For Meditation/Stretching"
+
+# ---------------------------------------------------------------------------------------------------------
+# Streaming pre-processing: two chunked passes over the raw csv with bounded memory. The csv is split into byte
+# ranges on record boundaries and every range is parsed on its own, by a process pool when n_jobs > 1. The first
+# pass collects per range partials (row count, min/max of the numerical features, first-seen vocabularies) that
+# are merged in file order, the second normalizes and id-encodes every range and writes it into its slice of a
+# columnar output directory. The ids, normalization and json/counts files are identical to the in-memory
+# pipeline above for any number of workers.
+# ---------------------------------------------------------------------------------------------------------
+
+# Explicit read schema: every column is read (dropna still checks all of them, like load_data), numerical
+# features as float64 and everything else as text, so ranges never infer different dtypes
+def csv_schema(csv_path):
+    columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    numeric = set(get_num_features() + get_good_for_features())
+    return columns, {column: ("float64" if column in numeric else str) for column in columns}
+
+# Splits the csv into byte ranges of about chunk_bytes that start and end on record boundaries, stopping after
+# max_rows records. A newline ends a record only outside quotes, after an even number of '"' bytes (fields with
+# quotes, commas or newlines are quoted and their quotes doubled, as pandas and the csv module write them).
+def split_csv(csv_path, chunk_bytes=32 * 2**20, max_rows=None, block_bytes=16 * 2**20):
+    record_ends = []
+    n_ends = 0
+    parity = 0
+    offset = 0
+    with open(csv_path, "rb") as f:
+        while max_rows is None or n_ends <= max_rows:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            data = np.frombuffer(block, dtype=np.uint8)
+            # a uint8 running count wraps at 256, which keeps its parity
+            quotes = np.cumsum(data == ord('"'), dtype=np.uint8)
+            newlines = np.flatnonzero(data == ord("\n"))
+            ends = newlines[((quotes[newlines] + parity) & 1) == 0] + offset + 1
+            record_ends.append(ends)
+            n_ends += len(ends)
+            parity = (parity + int(quotes[-1])) & 1
+            offset += len(block)
+        else:
+            offset = None
+
+    ends = np.concatenate(record_ends) if record_ends else np.zeros(0, dtype=np.int64)
+    # the last record may have no trailing newline
+    if offset is not None and (len(ends) == 0 or ends[-1] < offset):
+        ends = np.append(ends, offset)
+    header_end, ends = int(ends[0]), ends[1:]
+    if max_rows is not None:
+        ends = ends[:max_rows]
+
+    ranges = []
+    start = header_end
+    while len(ends) and start < ends[-1]:
+        i = min(np.searchsorted(ends, start + chunk_bytes), len(ends) - 1)
+        ranges.append((start, int(ends[i])))
+        start = int(ends[i])
+    return ranges
+
+def read_range(csv_path, start, end, columns, dtype):
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), names=columns, header=None, dtype=dtype).dropna()
+
+# Same key as process_non_num_features: first comma separated item, stripped and lowercased
+def first_item(series):
+    return series.str.split(",", n=1).str[0].str.strip().str.lower()
+
+def add_meditation(chunk):
+    chunk[MEDITATION] = chunk["Good for Relaxation/Meditation"] + chunk["Good for Yoga/Stretching"]
+    return chunk
+
+# Pass 1 for a single chunk: row count, per feature min/max, the values of each vocabulary in the order they
+# first appear in the chunk and the utf-8 size of each text column
+def scan_chunk(chunk):
+    chunk = add_meditation(chunk)
+    features = get_num_features() + [MEDITATION]
+    return {
+        "rows": len(chunk),
+        "min": chunk[features].min().to_dict(),
+        "max": chunk[features].max().to_dict(),
+        "artists": [key for key in pd.unique(first_item(chunk["Artist(s)"])) if key],
+        "genres": [key for key in pd.unique(first_item(chunk["Genre"])) if key],
+        "emotions": [key for key in pd.unique(chunk["emotion"]) if key],
+        "text_bytes": {column: int(chunk[column].str.encode("utf-8").str.len().sum()) for column in TEXT_COLUMNS},
+    }
+
+# Merges chunk partials in file order, so the vocabularies get the same first-seen ids as one pass would
+def merge_partials(partials):
+    stats = {"rows": 0, "min": {}, "max": {}, "artists": {}, "genres": {}, "emotions": {}}
+    for partial in partials:
+        stats["rows"] += partial["rows"]
+        if partial["rows"] == 0:
+            continue
+        for feature, value in partial["min"].items():
+            stats["min"][feature] = min(stats["min"].get(feature, value), value)
+        for feature, value in partial["max"].items():
+            stats["max"][feature] = max(stats["max"].get(feature, value), value)
+        for vocabulary in ("artists", "genres", "emotions"):
+            mapping = stats[vocabulary]
+            for key in partial[vocabulary]:
+                if key not in mapping:
+                    mapping[key] = len(mapping)
+    return stats
+
+# Pass 2 for a single chunk: the training columns in output order plus the text columns
+def transform_chunk(chunk, stats, lookups):
+    chunk = add_meditation(chunk)
+    for feature in get_num_features() + [MEDITATION]:
+        x_min, x_max = stats["min"][feature], stats["max"][feature]
+        if x_max == x_min:
+            chunk[feature] = 0.0
+        else:
+            chunk[feature] = (chunk[feature] - x_min) / (x_max - x_min)
+
+    # ids are positions in the first-seen vocabularies, unknown keys map to 0 like mapping.get(key, 0)
+    for id_column, column in zip(ID_COLUMNS, ["Artist(s)", "Genre", "emotion"]):
+        codes = lookups[id_column].get_indexer(first_item(chunk[column]))
+        chunk[id_column] = np.where(codes < 0, 0, codes).astype(np.int32)
+    return chunk
+
+def vocabulary_lookups(stats):
+    return {id_column: pd.Index(list(stats[vocabulary]))
+            for id_column, vocabulary in zip(ID_COLUMNS, ["artists", "genres", "emotions"])}
+
+def output_columns(columns):
+    return [column for column in columns if column not in DROPPED_COLUMNS] + [MEDITATION] + ID_COLUMNS
+
+# Writes the normalization params, vocabularies and counts exactly like the in-memory pipeline
+def save_preprocessing_stats(stats, data_dir):
+    features = get_num_features() + [MEDITATION]
+    normalized_params = {feature: {"min": int(stats["min"][feature]), "max": int(stats["max"][feature])} for feature in features}
+    with open(os.path.join(data_dir, "normalization-params.json"), "w") as json_file:
+        json.dump(normalized_params, json_file, indent=4)
+
+    for vocabulary, file_name in [("artists", "artist-json.json"), ("genres", "genre-json.json"), ("emotions", "emotion-json.json")]:
+        with open(os.path.join(data_dir, file_name), "w") as json_file:
+            json.dump(stats[vocabulary], json_file, indent=4)
+
+    counts_df = pd.DataFrame({
+        'Category': ['Artists', 'Genres', 'Emotions'],
+        'Count': [len(stats["artists"]), len(stats["genres"]), len(stats["emotions"])]
+    })
+    counts_df.to_csv(os.path.join(data_dir, "counts.csv"), index=False)
+
+# Columnar output: one .npy file per training column (memory mappable) and an offsets .npy plus a utf-8 bytes
+# file per text column, described by columns.json which is written last. Sizes are known after pass 1, so
+# create() preallocates every file and each range is written into its own rows and bytes, from any process.
+class ColumnarWriter():
+    def __init__(self, out_dir, columns, text_columns):
+        self.out_dir = out_dir
+        self.columns = columns
+        self.text_columns = text_columns
+        self.meta = {
+            "rows": None,
+            "columns": [{"name": column, "file": f"col-{i}.npy"} for i, column in enumerate(columns)],
+            "text_columns": [{"name": column, "offsets": f"text-{i}.offsets.npy", "data": f"text-{i}.bytes"}
+                             for i, column in enumerate(text_columns)],
+        }
+
+    def path(self, file_name):
+        return os.path.join(self.out_dir, file_name)
+
+    def create(self, n_rows, text_bytes):
+        os.makedirs(self.out_dir, exist_ok=True)
+        # an interrupted run must not look complete
+        if os.path.exists(self.path("columns.json")):
+            os.remove(self.path("columns.json"))
+        self.meta["rows"] = n_rows
+
+        for column in self.meta["columns"]:
+            dtype = np.int32 if column["name"] in ID_COLUMNS else np.float64
+            np.lib.format.open_memmap(self.path(column["file"]), mode="w+", dtype=dtype, shape=(n_rows,)).flush()
+        for column in self.meta["text_columns"]:
+            np.lib.format.open_memmap(self.path(column["offsets"]), mode="w+", dtype=np.int64, shape=(n_rows + 1,)).flush()
+            with open(self.path(column["data"]), "wb") as f:
+                f.truncate(text_bytes[column["name"]])
+
+    # Writes a transformed chunk at row row_start, its text columns at the byte offsets text_starts
+    def write(self, chunk, row_start, text_starts):
+        row_end = row_start + len(chunk)
+        for column in self.meta["columns"]:
+            array = np.load(self.path(column["file"]), mmap_mode="r+")
+            array[row_start:row_end] = chunk[column["name"]].to_numpy()
+            array.flush()
+
+        for column in self.meta["text_columns"]:
+            encoded = [value.encode("utf-8") for value in chunk[column["name"]]]
+            sizes = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+            offsets = np.load(self.path(column["offsets"]), mmap_mode="r+")
+            offsets[row_start + 1:row_end + 1] = text_starts[column["name"]] + np.cumsum(sizes)
+            offsets.flush()
+            with open(self.path(column["data"]), "r+b") as f:
+                f.seek(text_starts[column["name"]])
+                f.write(b"".join(encoded))
+        return row_end
+
+    def close(self):
+        with open(self.path("columns.json"), "w") as json_file:
+            json.dump(self.meta, json_file, indent=4)
+
+# Opens a columnar output directory: the training columns as {name: memory mapped array} (in output order)
+# and the text columns as {name: StringTable}
+def open_columnar(out_dir):
+    from scripts.latent_store import StringTable
+    with open(os.path.join(out_dir, "columns.json")) as json_file:
+        meta = json.load(json_file)
+    columns = {column["name"]: np.load(os.path.join(out_dir, column["file"]), mmap_mode="r") for column in meta["columns"]}
+
+    tables = {}
+    for column in meta["text_columns"]:
+        offsets = np.load(os.path.join(out_dir, column["offsets"]), mmap_mode="r")
+        path = os.path.join(out_dir, column["data"])
+        data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+        tables[column["name"]] = StringTable(offsets, data)
+    return columns, tables
+
+# Loads a columnar output directory as a DataFrame of the training columns, plus the text columns if asked
+def load_columnar(out_dir, text=False):
+    columns, tables = open_columnar(out_dir)
+    df = pd.DataFrame(columns)
+    return (df, tables) if text else df
+
+# State shared by the range tasks of a pass, set once per worker process instead of pickled with every task
+worker_context = {}
+
+def init_worker(context):
+    worker_context.clear()
+    worker_context.update(context)
+
+def scan_range(task):
+    start, end = task
+    return scan_chunk(read_range(worker_context["csv_path"], start, end, worker_context["columns"], worker_context["dtype"]))
+
+def transform_range(task):
+    start, end, row_start, text_starts = task
+    chunk = read_range(worker_context["csv_path"], start, end, worker_context["columns"], worker_context["dtype"])
+    chunk = transform_chunk(chunk, worker_context["stats"], worker_context["lookups"])
+    return worker_context["writer"].write(chunk, row_start, text_starts) - row_start
+
+# Runs fn over the tasks in order, in this process or a process pool; results keep the order of the tasks
+def map_ranges(fn, tasks, context, n_jobs):
+    if n_jobs == 1:
+        init_worker(context)
+        return [fn(task) for task in tasks]
+    with multiprocessing.Pool(n_jobs, initializer=init_worker, initargs=(context,)) as pool:
+        return pool.map(fn, tasks, chunksize=1)
+
+def peak_memory_mb():
+    import resource # Unix only, so data.py still imports on Windows
+    # ru_maxrss is in kilobytes on linux; children covers the pool workers
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def preprocess_streaming(csv_path="../data/spotify_dataset.csv", data_dir="../data", out_dir="../data/pre-processed",
+                         max_rows=None, chunk_bytes=32 * 2**20, n_jobs=None, verbose=True):
+    n_jobs = n_jobs or os.cpu_count()
+    start = time.time()
+    columns, dtype = csv_schema(csv_path)
+    ranges = split_csv(csv_path, chunk_bytes, max_rows)
+    context = {"csv_path": csv_path, "columns": columns, "dtype": dtype}
+
+    partials = map_ranges(scan_range, ranges, context, n_jobs)
+    stats = merge_partials(partials)
+    save_preprocessing_stats(stats, data_dir)
+    scanned = time.time()
+    if verbose:
+        print(f"pass 1 (stats, vocabularies): {stats['rows']} rows, {len(ranges)} chunks, {n_jobs} workers in {scanned - start:.2f} s, peak memory {peak_memory_mb():.0f} MB")
+
+    # every range writes to the rows and text bytes that follow the ranges before it
+    row_starts = np.cumsum([0] + [partial["rows"] for partial in partials])
+    text_starts = {column: np.cumsum([0] + [partial["text_bytes"][column] for partial in partials]) for column in TEXT_COLUMNS}
+    writer = ColumnarWriter(out_dir, output_columns(columns), TEXT_COLUMNS)
+    writer.create(stats["rows"], {column: int(starts[-1]) for column, starts in text_starts.items()})
+
+    tasks = [(start_byte, end_byte, int(row_starts[i]), {column: int(text_starts[column][i]) for column in TEXT_COLUMNS})
+             for i, (start_byte, end_byte) in enumerate(ranges)]
+    context.update({"stats": {"min": stats["min"], "max": stats["max"]}, "lookups": vocabulary_lookups(stats), "writer": writer})
+    written = map_ranges(transform_range, tasks, context, n_jobs)
+    if written != [partial["rows"] for partial in partials]:
+        raise RuntimeError("Pass 2 read different rows than pass 1")
+    writer.close()
+    end = time.time()
+    if verbose:
+        print(f"pass 2 (transform, write): {stats['rows']} rows in {end - scanned:.2f} s, peak memory {peak_memory_mb():.0f} MB")
+        print(f"🟢 Pre-Processed {stats['rows']} rows of data in {end - start:.2f} seconds, peak memory {peak_memory_mb():.0f} MB")
+    return stats
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "stream":
+    # python data.py stream [n_jobs] [chunk_mb]
+    preprocess_streaming(n_jobs=int(sys.argv[2]) if len(sys.argv) > 2 else None,
+                         chunk_bytes=int(float(sys.argv[3]) * 2**20) if len(sys.argv) > 3 else 32 * 2**20)
 
-if __name__ == "__main__":
+elif __name__ == "__main__":
     start = time.time()
     n_rows = 10000000
     pd.set_option('display.max_rows', None)  
@@ -126,7 +442,7 @@ if __name__ == "__main__":
     data, artist_count, genre_count, emotion_count = process_non_num_features(data)
 
     # filter out all data that we do not need
-    data = data.drop(columns=["text", "Length", "Album", "Release Date", "Key", "Loudness (db)", "Time signature", "Explicit", "Good for Yoga/Stretching", "Good for Relaxation/Meditation", "Similar Artist 1", "Similar Song 1", "Similarity Score 1", "Similar Artist 2", "Similar Song 2", "Similarity Score 2", "Similar Artist 3", "Similar Song 3", "Similarity Score 3", "Artist(s)", "song", "emotion", "Genre"])
+    data = data.drop(columns=DROPPED_COLUMNS)
     
     # save pre-processed data to a csv file
     data.to_csv("../data/pre-processed-data.csv", index=False)
@@ -0,0 +1,78 @@
+'''
+Pure NumPy inference for the encoder built in autoencoder.build_autoencoder, so serving does not need
+TensorFlow. The encoder is three embedding lookups, a concatenation and two dense layers (dropout is a no-op
+at inference), which is a couple of small matmuls per batch.
+
+Export the weights of a trained encoder once with:
+    python scripts/encoder_inference.py ../models/encoder-model.keras ../models/encoder-weights.npz
+'''
+import sys
+import os
+import numpy as np
+
+WEIGHT_NAMES = [
+    "artist_embedding",
+    "genre_embedding",
+    "emotion_embedding",
+    "hidden_kernel",
+    "hidden_bias",
+    "latent_kernel",
+    "latent_bias",
+]
+
+# Pulls the encoder weights out of a Keras encoder model
+def extract_encoder_weights(encoder_model):
+    dense_layers = [layer for layer in encoder_model.layers if type(layer).__name__ == "Dense"]
+    if len(dense_layers) != 2:
+        raise ValueError(f"Expected the encoder to have 2 dense layers, found {len(dense_layers)}")
+    hidden, latent = dense_layers
+
+    weights = {
+        "artist_embedding": encoder_model.get_layer("artist_embedding").get_weights()[0],
+        "genre_embedding": encoder_model.get_layer("genre_embedding").get_weights()[0],
+        "emotion_embedding": encoder_model.get_layer("emotion_embedding").get_weights()[0],
+    }
+    weights["hidden_kernel"], weights["hidden_bias"] = hidden.get_weights()
+    weights["latent_kernel"], weights["latent_bias"] = latent.get_weights()
+    return {name: np.ascontiguousarray(value, dtype=np.float32) for name, value in weights.items()}
+
+def save_encoder_weights(path, weights):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **{name: weights[name] for name in WEIGHT_NAMES})
+    os.replace(tmp_path, path)
+    return path
+
+def load_encoder_weights(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in WEIGHT_NAMES}
+
+class NumpyEncoder():
+    def __init__(self, weights):
+        for name in WEIGHT_NAMES:
+            setattr(self, name, np.ascontiguousarray(weights[name], dtype=np.float32))
+
+    @property
+    def latent_dim(self):
+        return self.latent_bias.shape[0]
+
+    # Same inputs as the Keras encoder: [numerical (B, 17), artist ids, genre ids, emotion ids]
+    def predict(self, inputs):
+        num_data, artist, genre, emotion = inputs
+        concat_inputs = np.concatenate([
+            np.asarray(num_data, dtype=np.float32),
+            self.artist_embedding[np.asarray(artist).reshape(-1)],
+            self.genre_embedding[np.asarray(genre).reshape(-1)],
+            self.emotion_embedding[np.asarray(emotion).reshape(-1)],
+        ], axis=1)
+        hidden = np.maximum(concat_inputs @ self.hidden_kernel + self.hidden_bias, 0.0)
+        return hidden @ self.latent_kernel + self.latent_bias
+
+if __name__ == "__main__":
+    import tensorflow as tf
+
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "../models/encoder-model.keras"
+    weights_path = sys.argv[2] if len(sys.argv) > 2 else "../models/encoder-weights.npz"
+    save_encoder_weights(weights_path, extract_encoder_weights(tf.keras.models.load_model(model_path)))
+    print(f"Wrote {weights_path} ({os.path.getsize(weights_path)} bytes)")
@@ -0,0 +1,641 @@
+'''
+Nearest-neighbour indexes over the L2-normalized latent vectors of the latent store. All scores are cosine
+similarities (dot products of normalized vectors), higher is better.
+
+    brute_force  exact scan of every song, optionally split into shards scored on a thread pool
+    ivf          inverted file: k-means coarse quantizer, only the n_probe closest lists are scanned
+    hnsw         hierarchical navigable small world graph, beam search of width ef_search
+    pq           product quantization: 1 byte per sub-space per song, scored with lookup tables
+
+Every index has build(vectors), search(query, k) -> (ids, scores) sorted by descending score, save(path) and
+load(path, vectors). Indexes only store their own structure; the vectors always come from the latent store.
+
+Indexes are saved as latent-index-<kind>.npz next to the latent store. The Recommender builds missing ivf and
+pq indexes when it loads, but hnsw takes minutes to build in Python, so it is only built offline:
+
+    python scripts/latent_index.py build hnsw [store_path] ['{"M": 16, "ef_construction": 100}']
+
+store_path defaults to the latent store in the artifact cache (ARTIFACT_CACHE_DIR).
+'''
+import sys
+import os
+import copy
+import json
+import heapq
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Indices of the k largest scores, sorted descending
+def top_k_indices(scores, k):
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        top = np.argpartition(scores, -k)[-k:]
+    else:
+        top = np.arange(scores.shape[0])
+    return top[np.argsort(scores[top])[::-1]]
+
+# Lloyd's k-means, returns (n_clusters, dim) float32 centroids. Spherical k-means keeps centroids unit length
+# and assigns by cosine similarity, otherwise points are assigned to the closest centroid by euclidean distance.
+def kmeans(sample, n_clusters, n_iter, rng, spherical=False):
+    n_clusters = min(n_clusters, len(sample))
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].astype(np.float32)
+
+    for _ in range(n_iter):
+        assignments = assign_clusters(sample, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # re-seed empty clusters with random samples so every cluster stays in use
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        counts[empty] = 1
+
+        if spherical:
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        else:
+            centroids = (sums / counts[:, None]).astype(np.float32)
+
+    return centroids
+
+# Index of the closest centroid for every vector, computed in chunks to bound memory
+def assign_clusters(vectors, centroids, spherical=False, chunk_size=65536):
+    # argmin ||x - c||^2 == argmax x.c - ||c||^2 / 2
+    offsets = 0.0 if spherical else 0.5 * np.sum(centroids * centroids, axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        assignments[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T - offsets, axis=1)
+    return assignments
+
+# A random sample of up to size rows, in row order
+def sample_rows(vectors, size, rng):
+    return np.asarray(vectors[np.sort(rng.choice(len(vectors), min(size, len(vectors)), replace=False))], dtype=np.float32)
+
+# Top k columns of every row of a (B, N) score matrix, sorted descending. The k-th largest score of an evenly
+# strided sample of each row is a lower bound on the row's k-th largest score, so a single comparison pass
+# against it leaves only a few candidates per row to rank instead of partitioning all N columns.
+def top_k_rows(scores, k):
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64), np.zeros((scores.shape[0], 0), dtype=scores.dtype)
+
+    stride = max(1, n // max(k, int(np.sqrt(k * n))))
+    if stride == 1:
+        top = np.argpartition(scores, -k, axis=1)[:, -k:] if k < n else np.broadcast_to(np.arange(n), scores.shape)
+    else:
+        bounds = np.partition(scores[:, ::stride], -k, axis=1)[:, -k]
+        rows, cols = np.divmod(np.flatnonzero(scores >= bounds[:, None]), n)
+        splits = np.searchsorted(rows, np.arange(1, scores.shape[0]))
+        top = np.stack([row_cols[top_k_indices(row_scores, k)] for row_cols, row_scores
+                        in zip(np.split(cols, splits), np.split(scores[rows, cols], splits))])
+
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+class LatentIndex():
+    kind = None
+    search_params = () # params that can be changed on a built index without rebuilding it
+
+    def __init__(self, **params):
+        self.params = params
+        self.vectors = None
+
+    # True if the index was built with the given build params
+    def matches(self, **params):
+        return all(self.params.get(key) == value for key, value in params.items() if key not in self.search_params)
+
+    # Updates the search time params of a built index
+    def tune(self, **params):
+        for key, value in params.items():
+            if key in self.search_params:
+                self.params[key] = value
+                setattr(self, key, value)
+        return self
+
+    # The index with other search time params: a copy sharing the built data, so one Recommender can search a
+    # shared index differently without retuning it for the others (self when nothing changes)
+    def tuned(self, **params):
+        params = {key: value for key, value in params.items() if key in self.search_params and self.params.get(key) != value}
+        if not params:
+            return self
+        index = copy.copy(self)
+        index.params = dict(self.params)
+        return index.tune(**params)
+
+    def build(self, vectors):
+        self.vectors = vectors
+        return self
+
+    def search(self, query, k):
+        raise NotImplementedError
+
+    # Searches a (B, dim) batch of queries, returns one (ids, scores) pair per query
+    def search_many(self, queries, k):
+        return [self.search(query, k) for query in queries]
+
+    # Exact search restricted to a sorted array of candidate row ids, for filtered queries. Only the candidates
+    # are scored (in chunks that bound the score matrix), so the more selective the filter the faster the search.
+    # Broad filters score every song and keep the candidates' columns instead, which is cheaper than gathering
+    # their rows.
+    def search_candidates(self, queries, k, candidates, max_scores=2**25, dense_fraction=0.25):
+        candidates = np.asarray(candidates, dtype=np.int64)
+        if len(candidates) == 0 or k <= 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+
+        if len(candidates) > dense_fraction * self.vectors.shape[0]:
+            block = max(1, max_scores // self.vectors.shape[0])
+            results = []
+            for start in range(0, len(queries), block):
+                top, top_scores = top_k_rows(np.take(queries[start:start + block] @ self.vectors.T, candidates, axis=1), k)
+                results.extend(zip(candidates[top], top_scores))
+            return results
+
+        chunk = max(k, max_scores // max(len(queries), 1))
+        ids, scores = [], []
+        for start in range(0, len(candidates), chunk):
+            rows = candidates[start:start + chunk]
+            top, top_scores = top_k_rows(queries @ np.take(self.vectors, rows, axis=0).T, k)
+            ids.append(rows[top])
+            scores.append(top_scores)
+
+        ids, scores = np.concatenate(ids, axis=1), np.concatenate(scores, axis=1)
+        if len(candidates) > chunk:
+            top, scores = top_k_rows(scores, k)
+            ids = np.take_along_axis(ids, top, axis=1)
+        return list(zip(ids, scores))
+
+    # Arrays that describe the built index, saved alongside the params
+    def state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, kind=self.kind, params=json.dumps(self.params), count=len(self.vectors), **self.state())
+        return path
+
+    @classmethod
+    def load(cls, path, vectors):
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["kind"]) != cls.kind:
+                raise ValueError(f"{path} holds a {data['kind']} index, not {cls.kind}")
+            if int(data["count"]) != len(vectors):
+                raise ValueError(f"{path} was built for {int(data['count'])} vectors, the store has {len(vectors)}")
+            index = cls(**json.loads(str(data["params"])))
+            index.vectors = vectors
+            index.set_state({key: data[key] for key in data.files if key not in ("kind", "params", "count")})
+        return index
+
+# Exact search: one matrix-vector product over every song. With n_shards > 1 the latent matrix is split into
+# contiguous shards that are scored and partitioned concurrently on a thread pool (BLAS and the partitions
+# release the GIL), and the per-shard top k are merged. Give each worker process about cores / workers shards;
+# OpenBLAS threads inside each shard can be limited with OPENBLAS_NUM_THREADS.
+class BruteForceIndex(LatentIndex):
+    kind = "brute_force"
+    search_params = ("n_shards", "min_shard_size")
+
+    def __init__(self, n_shards=1, min_shard_size=16384):
+        super().__init__(n_shards=n_shards, min_shard_size=min_shard_size)
+        self.n_shards = n_shards
+        self.min_shard_size = min_shard_size
+        self.pool = None
+        self.pool_size = 0
+        self.pool_pid = None
+
+    # [start, end) row ranges of the shards, fewer than n_shards for catalogs too small to be worth splitting
+    def shards(self):
+        n = self.vectors.shape[0]
+        count = max(1, min(self.n_shards, n // max(self.min_shard_size, 1)))
+        bounds = np.linspace(0, n, count + 1).astype(np.int64)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # Runs fn on every shard on the thread pool (created per process, threads do not survive a fork)
+    def map_shards(self, fn, shards):
+        if self.pool is None or self.pool_pid != os.getpid() or self.pool_size < len(shards):
+            self.pool = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="latent-shard")
+            self.pool_size, self.pool_pid = len(shards), os.getpid()
+        return list(self.pool.map(fn, shards))
+
+    def search(self, query, k):
+        shards = self.shards()
+        if len(shards) == 1:
+            scores = self.vectors @ query
+            top = top_k_indices(scores, k)
+            return top, scores[top]
+
+        def shard_top(shard):
+            start, end = shard
+            scores = self.vectors[start:end] @ query
+            top = top_k_indices(scores, k)
+            return scores[top], top + start
+
+        # every shard's list is sorted, a heap merge of them yields the overall top k
+        merged = list(islice(heapq.merge(*[zip(scores.tolist(), ids.tolist()) for scores, ids in self.map_shards(shard_top, shards)], reverse=True), k))
+        return np.array([idx for _, idx in merged], dtype=np.int64), np.array([score for score, _ in merged], dtype=np.float32)
+
+    # Scores blocks of queries with one matrix-matrix product each, bounding the (block, N) score matrix. With
+    # shards, each shard scores its slice of the block and the per-shard top k are merged in one partition.
+    def search_many(self, queries, k, max_scores=2**25):
+        n = self.vectors.shape[0]
+        block = max(1, max_scores // max(n, 1))
+        shards = self.shards()
+        results = []
+        for start in range(0, len(queries), block):
+            block_queries = queries[start:start + block]
+            if len(shards) == 1:
+                top, top_scores = top_k_rows(block_queries @ self.vectors.T, k)
+            else:
+                def shard_top(shard):
+                    top, top_scores = top_k_rows(block_queries @ self.vectors[shard[0]:shard[1]].T, k)
+                    return top + shard[0], top_scores
+                parts = self.map_shards(shard_top, shards)
+                ids = np.concatenate([ids for ids, _ in parts], axis=1)
+                top, top_scores = top_k_rows(np.concatenate([scores for _, scores in parts], axis=1), k)
+                top = np.take_along_axis(ids, top, axis=1)
+            results.extend(zip(top, top_scores))
+        return results
+
+# Inverted file index. Songs are bucketed by their closest k-means centroid, and a query only scores the songs
+# in its n_probe closest buckets. Raise n_probe for recall, lower it for latency.
+class IVFIndex(LatentIndex):
+    kind = "ivf"
+    search_params = ("n_probe",)
+
+    def __init__(self, n_lists=1024, n_probe=16, train_size=100000, n_iter=10, seed=0):
+        super().__init__(n_lists=n_lists, n_probe=n_probe, train_size=train_size, n_iter=n_iter, seed=seed)
+        self.n_probe = n_probe
+        self.centroids = None
+        self.list_ids = None
+        self.list_offsets = None
+
+    def build(self, vectors):
+        self.vectors = vectors
+        rng = np.random.default_rng(self.params["seed"])
+        sample = sample_rows(vectors, self.params["train_size"], rng)
+        self.centroids = kmeans(sample, self.params["n_lists"], self.params["n_iter"], rng, spherical=True)
+        assignments = assign_clusters(vectors, self.centroids, spherical=True)
+        self.list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        self.list_offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=len(self.centroids)), out=self.list_offsets[1:])
+        return self
+
+    def search(self, query, k):
+        probe = top_k_indices(self.centroids @ query, self.n_probe)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probe])
+        scores = self.vectors[candidates] @ query
+        top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def state(self):
+        return {"centroids": self.centroids, "list_ids": self.list_ids, "list_offsets": self.list_offsets}
+
+    def set_state(self, state):
+        self.centroids = state["centroids"]
+        self.list_ids = state["list_ids"]
+        self.list_offsets = state["list_offsets"]
+
+# Hierarchical navigable small world graph. Each song links to its M closest neighbours (2M on the bottom
+# layer), and a query descends the layers greedily then beam searches the bottom layer. ef_construction
+# trades build time for graph quality, ef_search trades latency for recall.
+class HNSWIndex(LatentIndex):
+    kind = "hnsw"
+    search_params = ("ef_search",)
+
+    def __init__(self, M=16, ef_construction=100, ef_search=64, seed=0):
+        super().__init__(M=M, ef_construction=ef_construction, ef_search=ef_search, seed=seed)
+        self.M = M
+        self.ef_search = ef_search
+        self.neighbors = None # (N, 2M) bottom layer adjacency, padded with -1
+        self.degrees = None
+        self.upper_layers = [] # layer 1.. : {node: [neighbors]}
+        self.entry_point = -1
+
+    def get_neighbors(self, node, layer):
+        if layer == 0:
+            return self.neighbors[node, :self.degrees[node]].tolist()
+        return self.upper_layers[layer - 1].get(node, [])
+
+    def set_neighbors(self, node, layer, neighbors):
+        if layer == 0:
+            self.neighbors[node, :len(neighbors)] = neighbors
+            self.neighbors[node, len(neighbors):] = -1
+            self.degrees[node] = len(neighbors)
+        else:
+            self.upper_layers[layer - 1][node] = list(neighbors)
+
+    # Beam search of one layer, returns up to ef (score, node) pairs
+    def search_layer(self, query, entry_points, ef, layer):
+        visited = set(entry_points)
+        scores = (self.vectors[entry_points] @ query).tolist()
+        candidates = [(-s, node) for s, node in zip(scores, entry_points)]
+        results = [(s, node) for s, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+
+            unvisited = [n for n in self.get_neighbors(node, layer) if n not in visited]
+            if not unvisited:
+                continue
+            visited.update(unvisited)
+
+            for s, n in zip((self.vectors[unvisited] @ query).tolist(), unvisited):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return results
+
+    # Picks up to m neighbours from (score, node) candidates, skipping candidates that are closer to an already
+    # selected neighbour than to the base node. This keeps links spread across clusters so the graph stays
+    # connected, then fills any remaining slots with the closest skipped candidates.
+    def select_neighbors(self, candidates, m):
+        candidates = sorted(candidates, reverse=True)
+        if len(candidates) <= m:
+            return [n for _, n in candidates]
+
+        nodes = [n for _, n in candidates]
+        candidate_vectors = self.vectors[nodes]
+        pairwise = candidate_vectors @ candidate_vectors.T
+        selected, skipped = [], []
+        for i, (score, node) in enumerate(candidates):
+            if not selected or pairwise[i, selected].max() < score:
+                selected.append(i)
+                if len(selected) == m:
+                    break
+            else:
+                skipped.append(i)
+        selected += skipped[:m - len(selected)]
+        return [nodes[i] for i in selected]
+
+    def insert(self, node, level):
+        query = self.vectors[node]
+        top_layer = len(self.upper_layers)
+        if self.entry_point < 0:
+            self.upper_layers.extend({node: []} for _ in range(level))
+            self.entry_point = node
+            return
+
+        entry = [self.entry_point]
+        for layer in range(top_layer, level, -1):
+            entry = [max(self.search_layer(query, entry, 1, layer))[1]]
+
+        for layer in range(min(level, top_layer), -1, -1):
+            found = self.search_layer(query, entry, self.params["ef_construction"], layer)
+            max_degree = 2 * self.M if layer == 0 else self.M
+            self.set_neighbors(node, layer, self.select_neighbors(found, self.M))
+
+            for neighbor in self.get_neighbors(node, layer):
+                links = self.get_neighbors(neighbor, layer) + [node]
+                if len(links) > max_degree:
+                    link_scores = (self.vectors[links] @ self.vectors[neighbor]).tolist()
+                    links = self.select_neighbors(list(zip(link_scores, links)), max_degree)
+                self.set_neighbors(neighbor, layer, links)
+
+            entry = [n for _, n in found]
+
+        if level > top_layer:
+            self.upper_layers.extend({node: []} for _ in range(level - top_layer))
+            self.entry_point = node
+
+    def build(self, vectors):
+        self.vectors = vectors
+        n = len(vectors)
+        rng = np.random.default_rng(self.params["seed"])
+        levels = np.floor(-np.log(1.0 - rng.random(n)) / np.log(self.M)).astype(np.int64)
+
+        self.neighbors = np.full((n, 2 * self.M), -1, dtype=np.int32)
+        self.degrees = np.zeros(n, dtype=np.int32)
+        self.upper_layers = []
+        self.entry_point = -1
+        for node in range(n):
+            self.insert(node, int(levels[node]))
+        return self
+
+    def search(self, query, k):
+        if self.entry_point < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        entry = [self.entry_point]
+        for layer in range(len(self.upper_layers), 0, -1):
+            entry = [max(self.search_layer(query, entry, 1, layer))[1]]
+
+        found = heapq.nlargest(k, self.search_layer(query, entry, max(self.ef_search, k), 0))
+        ids = np.array([n for _, n in found], dtype=np.int64)
+        scores = np.array([s for s, _ in found], dtype=np.float32)
+        return ids, scores
+
+    def state(self):
+        state = {"neighbors": self.neighbors, "degrees": self.degrees, "entry_point": np.int64(self.entry_point)}
+        for i, layer in enumerate(self.upper_layers):
+            nodes = np.array(sorted(layer), dtype=np.int64)
+            links = np.full((len(nodes), self.M), -1, dtype=np.int32)
+            for row, node in enumerate(nodes):
+                links[row, :len(layer[node])] = layer[node]
+            state[f"layer_{i + 1}_nodes"] = nodes
+            state[f"layer_{i + 1}_links"] = links
+        return state
+
+    def set_state(self, state):
+        self.neighbors = state["neighbors"]
+        self.degrees = state["degrees"]
+        self.entry_point = int(state["entry_point"])
+        self.upper_layers = []
+        while f"layer_{len(self.upper_layers) + 1}_nodes" in state:
+            i = len(self.upper_layers) + 1
+            nodes, links = state[f"layer_{i}_nodes"], state[f"layer_{i}_links"]
+            self.upper_layers.append({int(node): [int(n) for n in row if n >= 0] for node, row in zip(nodes, links)})
+
+# Product quantization. Each vector is split into n_subspaces chunks and every chunk is replaced by the id of its
+# closest of n_centroids (<= 256) codebook entries, so a song costs n_subspaces bytes instead of 4 * dim. Queries
+# are scored with asymmetric distance computation: one (n_subspaces, n_centroids) table of query.codeword
+# products, summed over each song's codes. With rerank > 0 the best rerank candidates are re-scored exactly
+# against the float32 vectors, which only touches those rows of the memory mapped store.
+class PQIndex(LatentIndex):
+    kind = "pq"
+    search_params = ("rerank",)
+
+    def __init__(self, n_subspaces=8, n_centroids=256, rerank=0, train_size=100000, n_iter=15, seed=0):
+        if n_centroids > 256:
+            raise ValueError("PQ codes are one byte, n_centroids must be <= 256")
+        super().__init__(n_subspaces=n_subspaces, n_centroids=n_centroids, rerank=rerank, train_size=train_size, n_iter=n_iter, seed=seed)
+        self.rerank = rerank
+        self.bounds = None # (n_subspaces + 1,) dimension boundaries of the sub-spaces
+        self.codebooks = None # (n_subspaces, n_centroids, max sub-space dim), zero padded
+        self.codes = None # (n_subspaces, N) uint8, one contiguous row per sub-space
+
+    def build(self, vectors):
+        self.vectors = vectors
+        dim = vectors.shape[1]
+        n_subspaces = min(self.params["n_subspaces"], dim)
+        rng = np.random.default_rng(self.params["seed"])
+
+        # sub-spaces are as even as the latent dimension allows (20 dims / 8 -> 3,3,3,3,2,2,2,2)
+        self.bounds = np.cumsum([0] + [len(chunk) for chunk in np.array_split(np.arange(dim), n_subspaces)]).astype(np.int64)
+        sub_dim = int(np.max(np.diff(self.bounds)))
+        self.codebooks = np.zeros((n_subspaces, self.params["n_centroids"], sub_dim), dtype=np.float32)
+
+        sample = sample_rows(vectors, self.params["train_size"], rng)
+        for j in range(n_subspaces):
+            start, end = self.bounds[j], self.bounds[j + 1]
+            centroids = kmeans(sample[:, start:end], self.params["n_centroids"], self.params["n_iter"], rng)
+            # catalogs smaller than n_centroids repeat the first codeword, which is never chosen over the original
+            self.codebooks[j, :, :end - start] = centroids[0]
+            self.codebooks[j, :len(centroids), :end - start] = centroids
+
+        self.codes = np.empty((n_subspaces, len(vectors)), dtype=np.uint8)
+        for j in range(n_subspaces):
+            start, end = self.bounds[j], self.bounds[j + 1]
+            self.codes[j] = assign_clusters(vectors[:, start:end], self.codebooks[j, :, :end - start])
+        return self
+
+    # Approximate cosine similarity of the query to every song
+    def score(self, query):
+        scores = np.zeros(self.codes.shape[1], dtype=np.float32)
+        for j in range(self.codes.shape[0]):
+            start, end = self.bounds[j], self.bounds[j + 1]
+            table = self.codebooks[j, :, :end - start] @ query[start:end]
+            scores += np.take(table, self.codes[j])
+        return scores
+
+    def search(self, query, k):
+        scores = self.score(query)
+        if self.rerank <= 0:
+            top = top_k_indices(scores, k)
+            return top, scores[top]
+
+        candidates = np.sort(top_k_indices(scores, max(self.rerank, k)))
+        exact = np.asarray(self.vectors[candidates]) @ query
+        top = top_k_indices(exact, k)
+        return candidates[top], exact[top]
+
+    # Bytes held in memory by the index (the float32 vectors stay on disk)
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes + self.bounds.nbytes
+
+    def state(self):
+        return {"bounds": self.bounds, "codebooks": self.codebooks, "codes": self.codes}
+
+    def set_state(self, state):
+        self.bounds = state["bounds"]
+        self.codebooks = state["codebooks"]
+        self.codes = state["codes"]
+
+# Searches a SegmentedStore: the base index over the base segment plus an exact scan of every delta segment,
+# with their results merged into global row ids. Build params and tuning are the base index's.
+class SegmentedIndex():
+    def __init__(self, base, store):
+        self.base = base
+        self.starts = store.starts
+        self.indexes = [base] + [BruteForceIndex().build(segment.vectors) for segment in store.segments[1:]]
+
+    @property
+    def kind(self):
+        return self.base.kind
+
+    @property
+    def params(self):
+        return self.base.params
+
+    def matches(self, **params):
+        return self.base.matches(**params)
+
+    def tune(self, **params):
+        self.base.tune(**params)
+        return self
+
+    def tuned(self, **params):
+        base = self.base.tuned(**params)
+        if base is self.base:
+            return self
+        index = copy.copy(self)
+        index.base, index.indexes = base, [base] + self.indexes[1:]
+        return index
+
+    # Top k of each query over the (start, per query (ids, scores)) results of the searched segments
+    def merge(self, parts, k, n_queries):
+        results = []
+        for q in range(n_queries):
+            ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [np.asarray(part[q][0], dtype=np.int64) + start for start, part in parts])
+            scores = np.concatenate([np.zeros(0, dtype=np.float32)] + [np.asarray(part[q][1], dtype=np.float32) for _, part in parts])
+            top = top_k_indices(scores, k)
+            results.append((ids[top], scores[top]))
+        return results
+
+    def search(self, query, k):
+        return self.search_many(np.asarray(query, dtype=np.float32)[None, :], k)[0]
+
+    def search_many(self, queries, k):
+        return self.merge([(start, index.search_many(queries, k)) for index, start in zip(self.indexes, self.starts)], k, len(queries))
+
+    def search_candidates(self, queries, k, candidates, **params):
+        candidates = np.asarray(candidates, dtype=np.int64)
+        parts = []
+        for index, start, end in zip(self.indexes, self.starts[:-1], self.starts[1:]):
+            low, high = np.searchsorted(candidates, [start, end])
+            if high > low:
+                parts.append((start, index.search_candidates(queries, k, candidates[low:high] - start, **params)))
+        return self.merge(parts, k, len(queries))
+
+INDEXES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFIndex.kind: IVFIndex,
+    HNSWIndex.kind: HNSWIndex,
+    PQIndex.kind: PQIndex,
+}
+
+def create_index(kind, **params):
+    if kind not in INDEXES:
+        raise ValueError(f"Unknown index {kind}, expected one of {', '.join(INDEXES)}")
+    return INDEXES[kind](**params)
+
+# indexes too slow to build while a server is loading, see the build command below
+OFFLINE_INDEXES = ["hnsw"]
+
+def index_path(store_path, kind):
+    return os.path.join(os.path.dirname(os.path.abspath(store_path)), f"latent-index-{kind}.npz")
+
+# Loads a saved index of any kind, attached to the given latent vectors
+def load_index(path, vectors):
+    with np.load(path, allow_pickle=False) as data:
+        kind = str(data["kind"])
+    return INDEXES[kind].load(path, vectors)
+
+# Builds an index over a latent store (the compacted base replacing it, if any, see segments.py) and saves it
+# next to that store, where the Recommender loads it from
+def build_index_file(kind, store_path=None, params=None):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from scripts.artifacts import ArtifactManager
+    from scripts.latent_store import LatentStore
+    from scripts.segments import resolve_base
+
+    store_path = resolve_base(store_path or ArtifactManager().fetch('latent_store'))[0]
+    vectors = LatentStore.load(store_path).vectors
+    print(f"Building {kind} index over {len(vectors)} songs...")
+    index = create_index(kind, **(params or {})).build(vectors)
+    path = index_path(store_path, kind)
+    index.save(path)
+    print(f"Saved {path}")
+    return path
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "build":
+        build_index_file(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None, json.loads(sys.argv[4]) if len(sys.argv) > 4 else None)
+    else:
+        print(__doc__)
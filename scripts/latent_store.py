@@ -0,0 +1,512 @@
+'''
+Compact binary format for the latent space lookup table, replacing latent-space-lookup.csv at serve time.
+
+A store is a single file:
+    magic (8 bytes) | header length (uint64) | JSON header | float32 vector block | string tables
+
+Songs are identified by their integer row id. The vector block is a contiguous (count, dim) float32 matrix of
+L2-normalized latent vectors. Metadata is stored column by column: free-text columns (song) are offset-indexed
+string tables, (count + 1) int64 offsets into a block of utf-8 bytes, and low-cardinality columns (artist, genre)
+are dictionary encoded as int32 codes into a string table of unique values. Every section starts on a 64 byte
+boundary so the file can be np.memmap'ed directly, which makes loading near-instant and lets gunicorn workers
+share the same pages through the OS page cache.
+
+Filter columns are only used to restrict searches and are not returned as metadata. Categorical columns (and
+the artist and genre metadata columns) carry an inverted index, the row ids of each value, and numeric columns
+are stored sorted alongside the row id of each sorted value, so a value or range filter is a couple of binary
+searches and a slice.
+
+Convert an existing CSV with:
+    python scripts/latent_store.py ../data/latent-space-lookup.csv ../data/latent-store.bin
+'''
+import sys
+import os
+import csv
+import json
+import numpy as np
+
+MAGIC = b"LATSTOR1"
+ALIGNMENT = 64
+
+# store column name -> column name in latent-space-lookup.csv
+METADATA_COLUMNS = {
+    "artist": "Artist(s)",
+    "genre": "Genre",
+    "song": "song",
+}
+
+# columns with few distinct values, stored as codes into a table of unique values
+CATEGORY_COLUMNS = {"artist", "genre"}
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# L2-normalizes each row of a latent matrix (zero rows are left as zeros)
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+# An offset-indexed table of utf-8 strings, decoded lazily one row at a time
+class StringTable():
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [str(s).encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    # One table holding the rows of every table in order
+    @classmethod
+    def concat(cls, tables):
+        offsets, data, base = [np.zeros(1, dtype=np.int64)], [], 0
+        for table in tables:
+            end = int(table.offsets[-1])
+            offsets.append(np.asarray(table.offsets[1:], dtype=np.int64) + base)
+            data.append(np.asarray(table.data[:end], dtype=np.uint8))
+            base += end
+        return cls(np.concatenate(offsets), np.concatenate(data) if data else np.zeros(0, dtype=np.uint8))
+
+    # Decodes rows start to end with a single copy of their bytes
+    def strings(self, start, end):
+        base = int(self.offsets[start])
+        blob = self.data[base:int(self.offsets[end])].tobytes()
+        bounds = (np.asarray(self.offsets[start:end + 1]) - base).tolist()
+        return [blob[a:b].decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+
+# Inverted index of a code column: row ids grouped by code, rows of code c are order[starts[c]:starts[c + 1]]
+def build_postings(codes, n_values):
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    starts = np.zeros(n_values + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=n_values), out=starts[1:])
+    return order, starts
+
+# A dictionary encoded column: one int32 code per row into a table of unique values, plus the inverted index
+# from each code to its rows (built on first use for stores written without one)
+class CategoryColumn():
+    def __init__(self, codes, values, order=None, starts=None):
+        self.codes = codes
+        self.values = values
+        self.order = order
+        self.starts = starts
+        self.groups = {} # normalize fn -> {normalized value: codes}, see codes_by
+        self.group_ids = {} # normalize fn -> group id of every code, see group_ids_by
+
+    @classmethod
+    def from_strings(cls, strings):
+        values, codes = np.unique(np.asarray([str(s) for s in strings], dtype=object), return_inverse=True)
+        codes = codes.astype(np.int32).reshape(-1)
+        return cls(codes, StringTable.from_strings(values), *build_postings(codes, len(values)))
+
+    # Same column as from_strings, built from a StringTable a chunk at a time so only the unique values are
+    # held as Python strings
+    @classmethod
+    def from_table(cls, table, chunk_size=100000):
+        first_codes = {}
+        codes = np.empty(len(table), dtype=np.int32)
+        for start in range(0, len(table), chunk_size):
+            end = min(start + chunk_size, len(table))
+            codes[start:end] = [first_codes.setdefault(value, len(first_codes)) for value in table.strings(start, end)]
+
+        # renumber the first-seen codes in sorted value order, like np.unique
+        values = np.array(list(first_codes), dtype=object)
+        order = np.argsort(values, kind="stable")
+        rank = np.empty(len(values), dtype=np.int32)
+        rank[order] = np.arange(len(values), dtype=np.int32)
+        codes = rank[codes]
+        return cls(codes, StringTable.from_strings(values[order]), *build_postings(codes, len(values)))
+
+    # Same column as from_strings over the rows of every column in order
+    @classmethod
+    def concat(cls, columns):
+        column_values = [column.values.strings(0, len(column.values)) for column in columns]
+        values = sorted(set().union(*column_values))
+        new_codes = {value: code for code, value in enumerate(values)}
+        codes = np.concatenate([np.array([new_codes[value] for value in old_values], dtype=np.int32)[np.asarray(column.codes)]
+                                for column, old_values in zip(columns, column_values)]).astype(np.int32)
+        return cls(codes, StringTable.from_strings(values), *build_postings(codes, len(values)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        return self.values[self.codes[idx]]
+
+    # Groups the codes of the unique values by normalize(value), built once per normalize function
+    def codes_by(self, normalize):
+        if normalize not in self.groups:
+            groups = {}
+            for code in range(len(self.values)):
+                groups.setdefault(normalize(self.values[code]), []).append(code)
+            self.groups[normalize] = groups
+        return self.groups[normalize]
+
+    # Numbers the groups of codes_by(normalize), returns the group id of every code
+    def group_ids_by(self, normalize):
+        if normalize not in self.group_ids:
+            group_ids = np.zeros(len(self.values), dtype=np.int32)
+            for group, codes in enumerate(self.codes_by(normalize).values()):
+                group_ids[codes] = group
+            self.group_ids[normalize] = group_ids
+        return self.group_ids[normalize]
+
+    # Sorted row ids of the rows whose normalize(value) equals normalize(w) for any w in wanted
+    def rows_matching(self, wanted, normalize):
+        groups = self.codes_by(normalize)
+        return self.rows_for_codes([code for value in wanted for code in groups.get(normalize(value), [])])
+
+    # Group id of the rows ids, rows whose values normalize the same share a group
+    def group_ids_of(self, ids, normalize):
+        return self.group_ids_by(normalize)[np.asarray(self.codes[ids])]
+
+    # Sorted row ids of every row holding one of the given codes
+    def rows_for_codes(self, codes):
+        if self.order is None:
+            self.order, self.starts = build_postings(np.asarray(self.codes), len(self.values))
+        rows = [self.order[self.starts[code]:self.starts[code + 1]] for code in codes]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int32)
+
+# A numeric column kept sorted, with the row id of every sorted value
+class NumericColumn():
+    def __init__(self, sorted_values, order):
+        self.sorted_values = sorted_values
+        self.order = order
+
+    @classmethod
+    def from_values(cls, values):
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        order = np.argsort(values, kind="stable").astype(np.int32)
+        return cls(values[order], order)
+
+    def __len__(self):
+        return len(self.order)
+
+    # The values in row order
+    def values(self):
+        values = np.empty(len(self.order), dtype=np.float32)
+        values[np.asarray(self.order)] = self.sorted_values
+        return values
+
+    # Sorted row ids of every row with low <= value <= high (None leaves a side open)
+    def rows_between(self, low=None, high=None):
+        start = 0 if low is None else np.searchsorted(self.sorted_values, low, side="left")
+        end = len(self.order) if high is None else np.searchsorted(self.sorted_values, high, side="right")
+        return np.sort(self.order[start:end])
+
+class LatentStore():
+    def __init__(self, vectors, columns, filters=None):
+        self.vectors = vectors
+        self.columns = columns
+        self.filters = filters or {}
+
+    # Builds an in-memory store from latent vectors, their metadata columns ({name: list of strings or a
+    # StringTable}) and optional filter columns ({name: list of strings or a StringTable for categories, or
+    # numbers}). normalized=True keeps vectors as they are (e.g. a memory map of already normalized rows).
+    @classmethod
+    def from_arrays(cls, vectors, metadata, filters=None, normalized=False):
+        vectors = vectors if normalized else normalize_rows(vectors)
+        columns = {}
+        for name, values in metadata.items():
+            if name in CATEGORY_COLUMNS:
+                columns[name] = CategoryColumn.from_table(values) if isinstance(values, StringTable) else CategoryColumn.from_strings(values)
+            else:
+                columns[name] = values if isinstance(values, StringTable) else StringTable.from_strings(values)
+            if len(columns[name]) != vectors.shape[0]:
+                raise ValueError(f"Column {name} has {len(columns[name])} rows, expected {vectors.shape[0]}")
+
+        filter_columns = {}
+        for name, values in (filters or {}).items():
+            if isinstance(values, StringTable):
+                filter_columns[name] = CategoryColumn.from_table(values)
+            elif np.asarray(values).dtype.kind in "biuf":
+                filter_columns[name] = NumericColumn.from_values(values)
+            else:
+                filter_columns[name] = CategoryColumn.from_strings(values)
+            if len(filter_columns[name]) != vectors.shape[0]:
+                raise ValueError(f"Filter column {name} has {len(filter_columns[name])} rows, expected {vectors.shape[0]}")
+        return cls(vectors, columns, filter_columns)
+
+    # One store holding the rows of every store in order (they must have the same columns)
+    @classmethod
+    def concat(cls, stores):
+        def concat_columns(columns):
+            if isinstance(columns[0], NumericColumn):
+                return NumericColumn.from_values(np.concatenate([column.values() for column in columns]))
+            if isinstance(columns[0], CategoryColumn):
+                return CategoryColumn.concat(columns)
+            return StringTable.concat(columns)
+
+        for store in stores[1:]:
+            if set(store.columns) != set(stores[0].columns) or set(store.filters) != set(stores[0].filters):
+                raise ValueError("Stores with different columns cannot be concatenated")
+        vectors = np.concatenate([np.asarray(store.vectors) for store in stores])
+        columns = {name: concat_columns([store.columns[name] for store in stores]) for name in stores[0].columns}
+        filters = {name: concat_columns([store.filters[name] for store in stores]) for name in stores[0].filters}
+        return cls(vectors, columns, filters)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    # Returns the metadata dict for a row, in the same shape the recommender has always returned
+    def __getitem__(self, idx):
+        return {name: column[idx] for name, column in self.columns.items()}
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    # The column a filter on name runs against: a filter column, or a categorical metadata column
+    def filter_column(self, name):
+        if name in self.filters:
+            return self.filters[name]
+        if isinstance(self.columns.get(name), CategoryColumn):
+            return self.columns[name]
+        return None
+
+    # Memory maps a store file read-only
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a latent store file")
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        count, dim = header["count"], header["dim"]
+        vectors = np.memmap(path, dtype=np.float32, mode="r", offset=header["vectors_offset"], shape=(count, dim))
+
+        def load_table(section, length):
+            offsets = np.memmap(path, dtype=np.int64, mode="r", offset=section["offsets_offset"], shape=(length + 1,))
+            if section["data_length"]:
+                data = np.memmap(path, dtype=np.uint8, mode="r", offset=section["data_offset"], shape=(section["data_length"],))
+            else:
+                data = np.zeros(0, dtype=np.uint8)
+            return StringTable(offsets, data)
+
+        def load_column(section):
+            if section["type"] == "numeric":
+                return NumericColumn(np.memmap(path, dtype=np.float32, mode="r", offset=section["sorted_offset"], shape=(count,)),
+                                     np.memmap(path, dtype=np.int32, mode="r", offset=section["order_offset"], shape=(count,)))
+            if section["type"] == "category":
+                codes = np.memmap(path, dtype=np.int32, mode="r", offset=section["codes_offset"], shape=(count,))
+                n_values = section["values"]["count"]
+                column = CategoryColumn(codes, load_table(section["values"], n_values))
+                if "order_offset" in section: # stores written before filtering have no inverted index
+                    column.order = np.memmap(path, dtype=np.int32, mode="r", offset=section["order_offset"], shape=(count,))
+                    column.starts = np.memmap(path, dtype=np.int64, mode="r", offset=section["starts_offset"], shape=(n_values + 1,))
+                return column
+            return load_table(section, count)
+
+        columns = {name: load_column(section) for name, section in header["columns"].items()}
+        filters = {name: load_column(section) for name, section in header.get("filters", {}).items()}
+        return cls(vectors, columns, filters)
+
+# Writes latent vectors, their metadata columns ({name: list of strings}) and optional filter columns to a
+# store file
+def write_latent_store(path, vectors, metadata, filters=None, normalized=False):
+    return save_latent_store(path, LatentStore.from_arrays(vectors, metadata, filters, normalized))
+
+# Writes a LatentStore to a store file, replacing any existing file atomically
+def save_latent_store(path, store):
+    count, dim = store.vectors.shape
+
+    # lay out every section before writing so the header can record absolute offsets
+    sections = [] # (offset, array) in file order
+    def layout(offset):
+        sections.clear()
+        header = {"count": count, "dim": dim, "normalized": True, "columns": {}, "filters": {}}
+
+        def place(array):
+            nonlocal offset
+            offset = _align(offset)
+            sections.append((offset, array))
+            start, offset = offset, offset + array.nbytes
+            return start
+
+        def place_table(table):
+            return {"offsets_offset": place(table.offsets), "data_offset": place(table.data), "data_length": int(table.data.nbytes)}
+
+        def place_column(column):
+            if isinstance(column, NumericColumn):
+                return {"type": "numeric", "sorted_offset": place(column.sorted_values), "order_offset": place(column.order)}
+            if isinstance(column, CategoryColumn):
+                section = {"type": "category", "codes_offset": place(column.codes)}
+                section["values"] = {"count": len(column.values), **place_table(column.values)}
+                section["order_offset"] = place(column.order)
+                section["starts_offset"] = place(column.starts)
+                return section
+            return {"type": "strings", **place_table(column)}
+
+        header["vectors_offset"] = place(store.vectors)
+        for name, column in store.columns.items():
+            header["columns"][name] = place_column(column)
+        for name, column in store.filters.items():
+            header["filters"][name] = place_column(column)
+        return header
+
+    header_bytes = b""
+    while True:
+        header = layout(len(MAGIC) + 8 + len(header_bytes))
+        encoded = json.dumps(header).encode("utf-8")
+        done = len(encoded) == len(header_bytes)
+        header_bytes = encoded
+        if done:
+            break
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for offset, array in sections:
+            f.write(b"\0" * (offset - f.tell()))
+            # written straight from the (possibly memory mapped) array, without a bytes copy
+            f.write(memoryview(np.ascontiguousarray(array).reshape(-1)).cast("B"))
+
+    os.replace(tmp_path, path)
+    return path
+
+# The vectors of a SegmentedStore, indexable by global row id like one (count, dim) matrix
+class SegmentedVectors():
+    def __init__(self, store):
+        self.store = store
+
+    @property
+    def shape(self):
+        return (len(self.store), self.store.dim)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, idx):
+        segment, local = self.store.locate(idx)
+        return self.store.segments[segment].vectors[local]
+
+    # Gathers rows by global id, np.take(vectors, ids, axis=0) calls this
+    def take(self, ids, axis=0, out=None, mode="raise"):
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.empty((len(ids), self.store.dim), dtype=np.float32) if out is None else out
+        segments = np.searchsorted(self.store.starts, ids, side="right") - 1
+        for segment in np.unique(segments):
+            mask = segments == segment
+            rows[mask] = np.take(self.store.segments[segment].vectors, ids[mask] - self.store.starts[segment], axis=0)
+        return rows
+
+# A filter column of a SegmentedStore: answers with global row ids by asking the same column of every segment
+class SegmentedColumn():
+    def __init__(self, columns, starts):
+        self.columns = columns
+        self.starts = starts
+        self.group_maps = {} # normalize fn -> per segment array of code -> global group id
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def concat_rows(self, parts):
+        return np.concatenate([np.asarray(rows, dtype=np.int64) + start for rows, start in zip(parts, self.starts)])
+
+    def rows_matching(self, wanted, normalize):
+        return self.concat_rows([column.rows_matching(wanted, normalize) for column in self.columns])
+
+    def rows_between(self, low=None, high=None):
+        return self.concat_rows([column.rows_between(low, high) for column in self.columns])
+
+    # Groups are numbered across segments, so the same normalized value has one group id in every segment
+    def group_ids_of(self, ids, normalize):
+        if normalize not in self.group_maps:
+            groups = {}
+            maps = []
+            for column in self.columns:
+                group_of_code = np.zeros(len(column.values), dtype=np.int32)
+                for key, codes in column.codes_by(normalize).items():
+                    group_of_code[codes] = groups.setdefault(key, len(groups))
+                maps.append(group_of_code)
+            self.group_maps[normalize] = maps
+
+        ids = np.asarray(ids, dtype=np.int64)
+        group_ids = np.empty(len(ids), dtype=np.int32)
+        segments = np.searchsorted(self.starts, ids, side="right") - 1
+        for segment in np.unique(segments):
+            mask = segments == segment
+            column = self.columns[segment]
+            group_ids[mask] = self.group_maps[normalize][segment][np.asarray(column.codes[ids[mask] - self.starts[segment]])]
+        return group_ids
+
+# A base store followed by append-only delta stores (see segments.py), used like one store whose row ids run
+# through the base and then every delta in order
+class SegmentedStore():
+    def __init__(self, segments):
+        self.segments = segments
+        self.starts = np.cumsum([0] + [len(segment) for segment in segments])
+        self.vectors = SegmentedVectors(self)
+        self.filter_columns = {}
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    # (segment, row within the segment) of a global row id
+    def locate(self, idx):
+        segment = int(np.searchsorted(self.starts, idx, side="right") - 1)
+        return segment, idx - int(self.starts[segment])
+
+    def __getitem__(self, idx):
+        segment, local = self.locate(idx)
+        return self.segments[segment][local]
+
+    @property
+    def dim(self):
+        return self.segments[0].dim
+
+    def filter_column(self, name):
+        if name not in self.filter_columns:
+            columns = [segment.filter_column(name) for segment in self.segments]
+            self.filter_columns[name] = None if any(column is None for column in columns) else SegmentedColumn(columns, self.starts)
+        return self.filter_columns[name]
+
+# Converts latent-space-lookup.csv into a store file in a single streaming pass over the CSV
+def convert_csv_to_latent_store(csv_path, store_path, chunk_size=100000):
+    vector_chunks = []
+    metadata = {name: [] for name in METADATA_COLUMNS}
+
+    with open(csv_path, "r", encoding="utf-8") as file:
+        csv_reader = csv.reader(file)
+        headers = next(csv_reader)
+        latent_indices = [i for i, header in enumerate(headers) if header.startswith("latent_")]
+        metadata_indices = {name: headers.index(col) for name, col in METADATA_COLUMNS.items()}
+
+        chunk = []
+        for row in csv_reader:
+            chunk.append([row[i] for i in latent_indices])
+            for name, i in metadata_indices.items():
+                metadata[name].append(row[i])
+            if len(chunk) == chunk_size:
+                vector_chunks.append(np.array(chunk, dtype=np.float32))
+                chunk = []
+        if chunk:
+            vector_chunks.append(np.array(chunk, dtype=np.float32))
+
+    if vector_chunks:
+        vectors = np.vstack(vector_chunks)
+    else:
+        vectors = np.zeros((0, len(latent_indices)), dtype=np.float32)
+    return write_latent_store(store_path, vectors, metadata)
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "../data/latent-space-lookup.csv"
+    store_path = sys.argv[2] if len(sys.argv) > 2 else "../data/latent-store.bin"
+    convert_csv_to_latent_store(csv_path, store_path)
+    print(f"Wrote {store_path} ({os.path.getsize(store_path)} bytes)")
@@ -2,16 +2,7 @@ import tensorflow as tf
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import requests
-import shutil
-
-# Function to download file from URL
-def download_file(url, local_path):
-    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-    with requests.get(url, stream=True) as r:
-        with open(local_path, 'wb') as f:
-            shutil.copyfileobj(r.raw, f)
-    return local_path
+from scripts.artifacts import ArtifactManager
 
 # Save the full model after training it
 def save_model(autoencoder, encoding_model):
@@ -21,32 +12,25 @@ def save_model(autoencoder, encoding_model):
 
     return True
 
+# Download a model into the artifact cache if not present
+def ensure_model_file(key):
+    return ArtifactManager().fetch(key)
+
 # Load and return the saved model from previous training session 
 def load_saved_model():
-    # Define GitHub Release URLs for models (replace with actual URLs)
-    github_urls = {
-        'autoencoder_model': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/autoencoder-model.keras',
-        'encoder_model': 'https://github.com/cerredz/Song-Reccomendation-System/releases/download/v1.0.0/encoder-model.keras'
-    }
-    
-    # Define local temporary paths for serverless environment
-    local_paths = {
-        'autoencoder_model': os.path.join('/tmp', 'models', 'autoencoder-model.keras'),
-        'encoder_model': os.path.join('/tmp', 'models', 'encoder-model.keras')
-    }
-    
-    # Download models if not present
-    for key in github_urls:
-        local_path = local_paths.get(key)
-        if not os.path.exists(local_path):
-            url = github_urls.get(key)
-            print(f'Downloading {key} from {url} to {local_path}')
-            download_file(url, local_path)
-
-    # Load models from local paths
-    autoencoder = tf.keras.models.load_model(local_paths['autoencoder_model'])
-    encoder_model = tf.keras.models.load_model(local_paths['encoder_model'])
+    # fetch both models concurrently, then load them from the cache
+    paths = ArtifactManager().fetch_all(['autoencoder_model', 'encoder_model'])
+    for path in paths.values():
+        if isinstance(path, Exception):
+            raise path
+
+    autoencoder = tf.keras.models.load_model(paths['autoencoder_model'])
+    encoder_model = tf.keras.models.load_model(paths['encoder_model'])
 
     encoder_model.compile(optimizer='adam', loss='mse', metrics=['mse'])
 
     return autoencoder, encoder_model
+
+# Serve mode: download and load only the encoder, uncompiled since it is only used for inference
+def load_encoder_model():
+    return tf.keras.models.load_model(ensure_model_file('encoder_model'), compile=False)
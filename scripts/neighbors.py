@@ -0,0 +1,81 @@
+'''
+Precomputed "more like this" lists: the top k most similar songs of every song in the latent store.
+
+The all-pairs kNN is a blocked matrix multiply. Each block of rows is scored against the whole catalog with
+one (block, N) matrix product, sized so a block's score matrix stays under max_scores floats, and blocks run
+concurrently on a thread pool (the matrix products and partitions release the GIL). A song is never its own
+neighbour.
+
+The result is one .npy file of N records, each holding k int32 song ids and their float16 cosine
+similarities, best first. It is memory mapped at serve time, so looking up a song's neighbours is one array
+index.
+
+Run it after Latent-Space-Mapping.py (which calls it) or on an existing store with:
+    python scripts/neighbors.py ../data/latent-store.bin ../data/song-neighbors.npy 50
+'''
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scripts.latent_store import LatentStore
+from scripts.latent_index import top_k_rows
+
+# Record dtype of a neighbours file holding k neighbours per song
+def neighbors_dtype(k):
+    return np.dtype([("ids", "<i4", (k,)), ("scores", "<f2", (k,))])
+
+# Top k neighbours (ids, scores) of rows [start, end) of a normalized latent matrix, excluding each row itself
+def block_neighbors(vectors, start, end, k):
+    scores = vectors[start:end] @ vectors.T
+    scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+    return top_k_rows(scores, k)
+
+# Computes the top k neighbours of every row of a normalized latent matrix, returns a record array of
+# neighbors_dtype(k). Catalogs with fewer than k + 1 songs are padded with id -1 and score -inf.
+def compute_neighbors(vectors, k=50, max_scores=2**24, n_jobs=None):
+    n = vectors.shape[0]
+    neighbors = np.zeros(n, dtype=neighbors_dtype(k))
+    neighbors["ids"] = -1
+    neighbors["scores"] = -np.inf
+    found = min(k, n - 1)
+    if found <= 0:
+        return neighbors
+
+    block = max(1, max_scores // n)
+    def run(start):
+        end = min(start + block, n)
+        ids, scores = block_neighbors(vectors, start, end, found)
+        neighbors["ids"][start:end, :found] = ids
+        neighbors["scores"][start:end, :found] = scores
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        list(pool.map(run, range(0, n, block)))
+    return neighbors
+
+def save_neighbors(path, neighbors):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, neighbors)
+    os.replace(tmp_path, path)
+    return path
+
+# Memory maps a neighbours file read-only
+def load_neighbors(path):
+    neighbors = np.load(path, mmap_mode="r", allow_pickle=False)
+    if neighbors.dtype.names != ("ids", "scores"):
+        raise ValueError(f"{path} is not a song neighbours file")
+    return neighbors
+
+# Computes and saves the neighbours of every song in a latent store file
+def build_neighbors_file(store_path, neighbors_path, k=50, n_jobs=None):
+    store = LatentStore.load(store_path)
+    return save_neighbors(neighbors_path, compute_neighbors(np.asarray(store.vectors), k, n_jobs=n_jobs))
+
+if __name__ == "__main__":
+    store_path = sys.argv[1] if len(sys.argv) > 1 else "../data/latent-store.bin"
+    neighbors_path = sys.argv[2] if len(sys.argv) > 2 else "../data/song-neighbors.npy"
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    build_neighbors_file(store_path, neighbors_path, k)
+    print(f"Wrote {neighbors_path} ({os.path.getsize(neighbors_path)} bytes)")
@@ -0,0 +1,72 @@
+'''
+Diversity re-ranking of a candidate pool, so a recommendation list is not five songs by the same artist.
+
+The index retrieves a pool of the most similar songs (a few hundred), then maximal marginal relevance picks
+the list one song at a time, trading the song's similarity to the query against its similarity to the songs
+already picked:
+
+    mmr = (1 - lambda) * similarity(query, song) - lambda * max similarity(song, picked songs)
+
+lambda = 0 is plain top-n by similarity, higher values spread the list across the latent space. A per-artist
+cap can be applied on its own or together with MMR. Everything runs on the (pool, pool) similarity matrix of
+the candidates, so a list of n songs costs one small matrix product and n vector passes over the pool.
+'''
+import numpy as np
+
+DEFAULT_POOL = 200
+
+# Picks up to n positions from a candidate pool. relevance is the (P,) similarity of each candidate to the
+# query, vectors their (P, dim) normalized latent vectors and groups an optional (P,) array of artist ids,
+# of which at most max_per_group are picked. Returns positions into the pool in pick order.
+def mmr_select(relevance, vectors, n, mmr_lambda=0.5, groups=None, max_per_group=None):
+    relevance = np.asarray(relevance, dtype=np.float32)
+    pool = len(relevance)
+    n = min(n, pool)
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    similarity = vectors @ vectors.T if mmr_lambda > 0 else None
+    max_similarity = np.full(pool, -1.0, dtype=np.float32) # to the picked songs, cosines are never below -1
+    available = np.ones(pool, dtype=bool)
+    if groups is not None and max_per_group is not None:
+        group_ids, groups = np.unique(groups, return_inverse=True)
+        group_counts = np.zeros(len(group_ids), dtype=np.int64)
+
+    selected = []
+    for _ in range(n):
+        scores = (1 - mmr_lambda) * relevance - mmr_lambda * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not available[best]:
+            break
+        selected.append(best)
+        available[best] = False
+        if similarity is not None:
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+        if groups is not None and max_per_group is not None:
+            group_counts[groups[best]] += 1
+            if group_counts[groups[best]] >= max_per_group:
+                available[groups == groups[best]] = False
+    return np.array(selected, dtype=np.int64)
+
+# Validates a request's diversity options, returns {"lambda", "max_per_artist", "pool"} or None when they are
+# off. Raises ValueError for invalid options.
+def parse_diversity(options):
+    if not options:
+        return None
+    if not isinstance(options, dict) or not set(options) <= {"lambda", "max_per_artist", "pool"}:
+        raise ValueError('diversity must look like {"lambda": 0.5, "max_per_artist": 2, "pool": 200}')
+
+    mmr_lambda = options.get("lambda", 0.0)
+    if isinstance(mmr_lambda, bool) or not isinstance(mmr_lambda, (int, float)) or not 0 <= mmr_lambda <= 1:
+        raise ValueError("diversity lambda must be a number between 0 and 1")
+    max_per_artist = options.get("max_per_artist")
+    if max_per_artist is not None and (isinstance(max_per_artist, bool) or not isinstance(max_per_artist, int) or max_per_artist < 1):
+        raise ValueError("diversity max_per_artist must be a positive integer")
+    pool = options.get("pool", DEFAULT_POOL)
+    if isinstance(pool, bool) or not isinstance(pool, int) or pool < 1:
+        raise ValueError("diversity pool must be a positive integer")
+
+    if mmr_lambda == 0 and max_per_artist is None:
+        return None
+    return {"lambda": float(mmr_lambda), "max_per_artist": max_per_artist, "pool": pool}
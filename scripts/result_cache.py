@@ -0,0 +1,194 @@
+'''
+Result cache for recommendations. Many requests are the same slider presets and popular artist/genre combos,
+so the recommendations for a profile are cached under a key built from its quantized normalized features, its
+artist/genre/emotion ids, n and the index that answered it. Entries are evicted least recently used once the
+cache is full and expire after a TTL.
+
+Two backends:
+    memory  per-process LRU (default)
+    disk    SQLite file shared by every worker on the machine, so gunicorn workers share hits. Point it at
+            /dev/shm to keep it in shared memory.
+
+Configuration (all optional):
+    RESULT_CACHE            memory, disk or off, default memory
+    RESULT_CACHE_SIZE       max entries, default 4096
+    RESULT_CACHE_TTL        seconds an entry stays valid, default 3600
+    RESULT_CACHE_PATH       SQLite file of the disk backend, default /dev/shm/recommend-cache.sqlite3
+                            (or the temp directory when /dev/shm does not exist)
+    RESULT_CACHE_PRECISION  quantization step of the normalized features, default 0.001
+'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Per-process LRU of encoded results
+class MemoryBackend():
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (expires, value)
+        self.lock = threading.Lock()
+
+    # Returns {key: value} for the keys that are cached and not expired
+    def get_many(self, keys, now):
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    # Stores {key: value}, returns the number of entries evicted to make room
+    def set_many(self, items, expires):
+        evicted = 0
+        with self.lock:
+            for key, value in items.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# LRU in a SQLite file, shared by every process that opens the same path
+class SqliteBackend():
+    name = "disk"
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)")
+        self.connection().execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    # One connection per thread and process (connections must not cross a fork)
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, keys, now):
+        if not keys:
+            return {}
+        conn = self.connection()
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(f"SELECT key, value FROM results WHERE key IN ({placeholders}) AND expires > ?", (*keys, now)).fetchall()
+        if rows:
+            conn.executemany("UPDATE results SET used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+        return dict(rows)
+
+    def set_many(self, items, expires):
+        if not items:
+            return 0
+        conn = self.connection()
+        now = time.time()
+        conn.executemany("INSERT OR REPLACE INTO results (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                         [(key, value, expires, now) for key, value in items.items()])
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (excess,))
+        return excess
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        self.connection().execute("DELETE FROM results")
+
+class ResultCache():
+    def __init__(self, backend, ttl=3600, precision=1e-3):
+        self.backend = backend
+        self.ttl = ttl
+        self.precision = precision
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # One key per profile: the normalized features rounded to the cache precision, the artist, genre and
+    # emotion ids, n and a namespace naming the index and catalog that produced the results
+    def keys(self, inputs, n, namespace=""):
+        num_data, artist, genre, emotion = inputs
+        quantized = np.round(np.asarray(num_data, dtype=np.float64) / self.precision).astype(np.int64)
+        ids = np.stack([np.asarray(artist).reshape(-1), np.asarray(genre).reshape(-1), np.asarray(emotion).reshape(-1)], axis=1).astype(np.int64)
+        prefix = f"{namespace}|{n}|".encode("utf-8")
+        return [
+            hashlib.blake2b(prefix + row_ids.tobytes() + row.tobytes(), digest_size=16).hexdigest()
+            for row_ids, row in zip(ids, quantized)
+        ]
+
+    # Returns {key: results} for the cached keys
+    def get_many(self, keys):
+        found = self.backend.get_many(list(dict.fromkeys(keys)), time.time())
+        with self.lock:
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return {key: json.loads(value) for key, value in found.items()}
+
+    # Caches {key: results}, results must be JSON serializable
+    def set_many(self, items):
+        evicted = self.backend.set_many({key: json.dumps(value) for key, value in items.items()}, time.time() + self.ttl)
+        with self.lock:
+            self.evictions += evicted
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "pid": os.getpid(),
+            "entries": len(self.backend),
+            "max_entries": self.backend.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+def default_cache_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "recommend-cache.sqlite3")
+
+# Builds the cache configured by the RESULT_CACHE* environment variables, None when it is turned off
+def create_result_cache():
+    kind = os.environ.get("RESULT_CACHE", "memory")
+    if kind == "off":
+        return None
+    max_entries = int(os.environ.get("RESULT_CACHE_SIZE", 4096))
+    if kind == "memory":
+        backend = MemoryBackend(max_entries)
+    elif kind == "disk":
+        backend = SqliteBackend(os.environ.get("RESULT_CACHE_PATH") or default_cache_path(), max_entries)
+    else:
+        raise ValueError(f"Unknown RESULT_CACHE {kind}, expected memory, disk or off")
+    return ResultCache(backend, ttl=float(os.environ.get("RESULT_CACHE_TTL", 3600)), precision=float(os.environ.get("RESULT_CACHE_PRECISION", 1e-3)))
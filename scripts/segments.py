@@ -0,0 +1,201 @@
+'''
+Append-only segments for the latent store, so new songs can be added without re-running the preprocessing and
+the latent mapping over the whole catalog.
+
+The published latent-store.bin is the base segment. `add` encodes a csv of new songs (same columns as
+spotify_dataset.csv) with the frozen vocabularies, normalization params and encoder weights the base was built
+with, and writes them as a small delta store in latent-deltas/ next to the base. The Recommender loads the base
+plus every delta listed in latent-deltas/segments.json: new songs get the ids after the base's and the deltas
+before them, and are searched with an exact scan next to the base index. `compact` merges every segment into a
+new versioned base (latent-deltas/base-<generation>.bin) offline and rebuilds the song neighbour lists over it,
+which only cover the base. The published store in the artifact cache is never rewritten (its manifest sha256
+would no longer match and the next fetch would download it again); the compacted base replaces it for as long
+as that file is unchanged, a new release supersedes the compactions and deltas of the old one.
+
+Artists and genres that are not in the frozen vocabularies get id 0, as unknown values always have, and the
+numerical features are normalized with the published (integer) min/max. Retrain to give them their own ids.
+
+    python scripts/segments.py add new-songs.csv [store_path]
+    python scripts/segments.py compact [store_path]
+
+store_path defaults to the latent store in the artifact cache (ARTIFACT_CACHE_DIR).
+'''
+import sys
+import os
+import json
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pandas as pd
+from scripts.artifacts import ArtifactManager
+from scripts.latent_store import LatentStore, SegmentedStore, write_latent_store, save_latent_store, METADATA_COLUMNS
+from scripts.encoder_inference import NumpyEncoder, extract_encoder_weights, save_encoder_weights, load_encoder_weights
+
+def deltas_dir(store_path):
+    return os.path.join(os.path.dirname(os.path.abspath(store_path)), "latent-deltas")
+
+# The deltas appended to a base store. base_rows is the size of the base they were appended to, so deltas are
+# never applied twice to a base that already contains them (e.g. after a compaction or a new release). After a
+# compaction it also names the compacted base and neighbours, their generation and the release store they were
+# compacted from.
+def read_manifest(store_path):
+    try:
+        with open(os.path.join(deltas_dir(store_path), "segments.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"base_rows": None, "deltas": []}
+
+def write_manifest(store_path, manifest):
+    path = os.path.join(deltas_dir(store_path), "segments.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+# Size and modification time of the published store, to notice a new release replacing it
+def release_stamp(store_path):
+    stat = os.stat(store_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# The base the deltas are appended to and the manifest of its segments: the latest compacted base while the
+# published store it was compacted from is unchanged, otherwise the published store
+def resolve_base(store_path):
+    manifest = read_manifest(store_path)
+    if not manifest.get("base"):
+        return store_path, manifest
+    if manifest.get("release") != release_stamp(store_path):
+        print(f"Ignoring the compacted base {manifest['base']} and its deltas, {store_path} has changed since")
+        return store_path, {"base_rows": None, "deltas": [], "generation": manifest.get("generation", 0)}
+    return os.path.join(deltas_dir(store_path), manifest["base"]), manifest
+
+# The song neighbours rebuilt by the latest compaction, None when the published ones apply
+def compacted_neighbors(store_path):
+    base_path, manifest = resolve_base(store_path)
+    if base_path == store_path or not manifest.get("neighbors"):
+        return None
+    return os.path.join(deltas_dir(store_path), manifest["neighbors"])
+
+# Memory maps the base store and its deltas: a LatentStore when there are none, otherwise a SegmentedStore
+def load_segmented_store(store_path):
+    base_path, manifest = resolve_base(store_path)
+    base = LatentStore.load(base_path)
+    if not manifest["deltas"]:
+        return base
+    if manifest["base_rows"] != len(base):
+        print(f"Ignoring {len(manifest['deltas'])} delta segments appended to a {manifest['base_rows']} song base, the base has {len(base)} songs")
+        return base
+    deltas = [LatentStore.load(os.path.join(deltas_dir(store_path), name)) for name in manifest["deltas"]]
+    return SegmentedStore([base] + deltas)
+
+def load_encoder(artifacts):
+    try:
+        return NumpyEncoder(load_encoder_weights(artifacts.fetch('encoder_weights')))
+    except Exception as e:
+        print(f"Encoder weights unavailable, extracting them from the Keras model: {e}")
+        from scripts.models import load_encoder_model
+        weights = extract_encoder_weights(load_encoder_model())
+        save_encoder_weights(artifacts.local_path('encoder_weights'), weights)
+        return NumpyEncoder(weights)
+
+# A frozen name -> id vocabulary with the get_indexer lookup transform_chunk uses (-1 for unknown names)
+class VocabularyLookup():
+    def __init__(self, mapping):
+        self.index = pd.Index(list(mapping))
+        self.ids = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+
+    def get_indexer(self, keys):
+        positions = self.index.get_indexer(keys)
+        return np.where(positions < 0, -1, self.ids[positions])
+
+# Pre-processes raw songs like data.py, but with the published vocabularies and normalization params
+def preprocess_new_songs(csv_path, artifacts):
+    # the preprocessing code is only imported when adding songs, not by every server loading the Recommender
+    from scripts.data import csv_schema, transform_chunk, output_columns, ID_COLUMNS
+    columns, dtype = csv_schema(csv_path)
+    songs = pd.read_csv(csv_path, dtype=dtype).dropna()
+
+    with open(artifacts.fetch('normalization_params')) as f:
+        params = json.load(f)
+    stats = {"min": {feature: p["min"] for feature, p in params.items()}, "max": {feature: p["max"] for feature, p in params.items()}}
+
+    lookups = {}
+    for id_column, key in zip(ID_COLUMNS, ['artist_json', 'genre_json', 'emotion_json']):
+        with open(artifacts.fetch(key)) as f:
+            lookups[id_column] = VocabularyLookup(json.load(f))
+
+    songs = transform_chunk(songs, stats, lookups)
+    numerical_columns = [column for column in output_columns(columns) if column not in ID_COLUMNS]
+    return songs, numerical_columns
+
+# Encodes the songs of csv_path and appends them to the store as a new delta segment, returns its path
+def add_songs(csv_path, store_path=None):
+    from scripts.data import ID_COLUMNS
+    artifacts = ArtifactManager()
+    store_path = store_path or artifacts.fetch('latent_store')
+    base_path, manifest = resolve_base(store_path)
+    base = LatentStore.load(base_path)
+
+    songs, numerical_columns = preprocess_new_songs(csv_path, artifacts)
+    if len(songs) == 0:
+        print(f"No complete rows in {csv_path}")
+        return None
+    inputs = [songs[numerical_columns].to_numpy(dtype=np.float32)] + [songs[column].to_numpy(dtype=np.int32) for column in ID_COLUMNS]
+    latents = load_encoder(artifacts).predict(inputs)
+
+    # the metadata and filter columns of the base (Latent-Space-Mapping.py writes the emotion and the
+    # normalized numerical features as filters)
+    metadata = {name: songs[column].astype(str).tolist() for name, column in METADATA_COLUMNS.items()}
+    filters = {"emotion": songs["emotion"].astype(str).tolist()}
+    filters.update({column: songs[column].to_numpy(dtype=np.float32) for column in numerical_columns})
+    filters = {name: values for name, values in filters.items() if name in base.filters}
+
+    if manifest["base_rows"] != len(base):
+        manifest = {**manifest, "base_rows": len(base), "deltas": []}
+    name = f"delta-{len(manifest['deltas']) + 1:05d}.bin"
+    path = write_latent_store(os.path.join(deltas_dir(store_path), name), latents, metadata, filters)
+    manifest["deltas"].append(name)
+    write_manifest(store_path, manifest)
+
+    first_id = len(base) + sum(len(LatentStore.load(os.path.join(deltas_dir(store_path), delta))) for delta in manifest["deltas"][:-1])
+    print(f"Added {len(songs)} songs as {name}, ids {first_id} to {first_id + len(songs) - 1}")
+    return path
+
+# Merges the base and its deltas into the next generation of the base, with song neighbours rebuilt over it,
+# returns the path of the new base
+def compact(store_path=None):
+    from scripts.neighbors import build_neighbors_file
+    artifacts = ArtifactManager()
+    store_path = store_path or artifacts.fetch('latent_store')
+
+    base_path, manifest = resolve_base(store_path)
+    store = load_segmented_store(store_path)
+    if not isinstance(store, SegmentedStore):
+        print("No delta segments to compact")
+        return base_path
+
+    generation = manifest.get("generation", 0) + 1
+    base_name, neighbors_name = f"base-{generation:05d}.bin", f"song-neighbors-{generation:05d}.npy"
+    merged = LatentStore.concat(store.segments)
+    save_latent_store(os.path.join(deltas_dir(store_path), base_name), merged)
+    build_neighbors_file(os.path.join(deltas_dir(store_path), base_name), os.path.join(deltas_dir(store_path), neighbors_name))
+    # the new base already holds the deltas, they are ignored from here on even if removing them fails
+    write_manifest(store_path, {"base": base_name, "neighbors": neighbors_name, "generation": generation,
+                                "release": release_stamp(store_path), "base_rows": len(merged), "deltas": []})
+
+    # the previous generation, its deltas and the indexes saved for it (built again offline for the new base)
+    old_files = list(manifest["deltas"])
+    if base_path != store_path:
+        old_files += [manifest["base"], manifest.get("neighbors")]
+    old_files += [name for name in os.listdir(deltas_dir(store_path)) if name.startswith("latent-index-")]
+    for name in old_files:
+        if name and os.path.exists(os.path.join(deltas_dir(store_path), name)):
+            os.remove(os.path.join(deltas_dir(store_path), name))
+    print(f"Compacted {len(store.segments)} segments into {os.path.join(deltas_dir(store_path), base_name)} ({len(merged)} songs)")
+    return os.path.join(deltas_dir(store_path), base_name)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "add":
+        add_songs(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        print(__doc__)
@@ -0,0 +1,42 @@
+'''
+Compact read-only replacement for the artist/genre/emotion JSON dicts (name -> id used in training).
+
+A Python dict of a few hundred thousand strings costs tens of megabytes per process, and because every lookup
+touches reference counts its pages are gradually copied into each forked worker. A Vocabulary keeps only two
+NumPy arrays, the sorted 64-bit hashes of the names and their ids, so it is a few bytes per name and stays
+shared between workers forked after it is loaded. Lookups hash the name and binary search the hashes.
+'''
+import hashlib
+import numpy as np
+
+def hash_key(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest(), "little")
+
+class Vocabulary():
+    def __init__(self, hashes, ids):
+        self.hashes = hashes
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, mapping):
+        hashes = np.fromiter((hash_key(key) for key in mapping), dtype=np.uint64, count=len(mapping))
+        ids = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        order = np.argsort(hashes, kind="stable")
+        hashes, ids = hashes[order], ids[order]
+        if len(hashes) > 1 and np.any(hashes[1:] == hashes[:-1]):
+            raise ValueError("Vocabulary has colliding key hashes")
+        return cls(hashes, ids)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    # Same as dict.get: the id of key, or default when it is not in the vocabulary
+    def get(self, key, default=None):
+        h = np.uint64(hash_key(key))
+        i = np.searchsorted(self.hashes, h)
+        if i < len(self.hashes) and self.hashes[i] == h:
+            return int(self.ids[i])
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
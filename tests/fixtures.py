@@ -0,0 +1,48 @@
+'''
+Small synthetic inputs shared by the tests.
+'''
+import sys
+import os
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.data import get_num_features, get_good_for_features
+
+ARTISTS = ["Drake", "Adele", "Future", "SZA", "Kendrick Lamar", "Taylor Swift"]
+GENRES = ["hip hop", "pop", "rock,pop", "r&b"]
+EMOTIONS = ["joy", "sadness", "anger", "love"]
+
+# Writes a raw csv with the columns of spotify_dataset.csv. Lyrics hold quotes, commas and line breaks, so
+# records span several lines, and some artists are comma separated lists. A missing_text fraction of the rows
+# have no lyrics, which the pipelines drop.
+def write_raw_csv(path, n_rows, seed=0, first_song=0, missing_text=0.0):
+    rng = np.random.default_rng(seed)
+    artists = np.array(ARTISTS)
+    words = np.array(["love", "night", "\"yeah\"", "rain,", "home", "\n", "baby\r\n", "fire"])
+    columns = {
+        "Artist(s)": [f"{artists[a]}, {artists[b]}" if featuring else str(artists[a])
+                      for a, b, featuring in zip(rng.integers(0, len(artists), n_rows), rng.integers(0, len(artists), n_rows), rng.random(n_rows) < 0.3)],
+        "song": [f"song {first_song + i}" for i in range(n_rows)],
+        "text": [" ".join(words[rng.integers(0, len(words), 12)]) for _ in range(n_rows)],
+        "Length": "03:47",
+        "emotion": rng.choice(EMOTIONS, n_rows),
+        "Genre": rng.choice(GENRES, n_rows),
+        "Album": "album",
+        "Release Date": "2019-01-01",
+        "Key": "D min",
+        "Loudness (db)": "-6.2db",
+        "Time signature": "4/4",
+        "Explicit": rng.choice(["Yes", "No"], n_rows),
+    }
+    for feature in get_num_features():
+        columns[feature] = rng.integers(60, 200, n_rows) if feature == "Tempo" else rng.integers(0, 100, n_rows)
+    for feature in get_good_for_features():
+        columns[feature] = rng.integers(0, 2, n_rows)
+    for k in (1, 2, 3):
+        columns[f"Similar Artist {k}"] = artists[rng.integers(0, len(artists), n_rows)]
+        columns[f"Similar Song {k}"] = "song"
+        columns[f"Similarity Score {k}"] = rng.random(n_rows)
+    df = pd.DataFrame(columns)
+    df.loc[rng.random(n_rows) < missing_text, "text"] = np.nan
+    df.to_csv(path, index=False)
+    return path
@@ -0,0 +1,119 @@
+'''
+Downloads of scripts/artifacts.py against a local HTTP server that supports Range requests.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.artifacts import ArtifactManager, ArtifactError
+
+CONTENT = bytes(range(256)) * 4096 # 1 MiB
+
+# Serves FILES by name, answering "Range: bytes=<start>-" with a 206 of the rest of the file
+class RangeHandler(BaseHTTPRequestHandler):
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        self.requests.append((name, self.headers.get('Range')))
+        if name not in self.files:
+            self.send_error(404)
+            return
+        body = self.files[name]
+        start = int(self.headers['Range'][len('bytes='):].rstrip('-')) if self.headers.get('Range') else 0
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+class DownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        RangeHandler.files = {'latent-store.bin': CONTENT}
+        RangeHandler.requests = []
+
+    def manager(self, sha256=None, **kwargs):
+        manifest = {'latent_store': {'path': 'data/latent-store.bin', 'size': len(CONTENT),
+                                     'sha256': sha256 or hashlib.sha256(CONTENT).hexdigest()}}
+        return ArtifactManager(cache_dir=self.cache_dir, base_url=f'http://127.0.0.1:{self.server.server_port}',
+                               manifest=manifest, **kwargs)
+
+    def test_resumes_interrupted_download(self):
+        artifacts = self.manager()
+        part_path = artifacts.local_path('latent_store') + '.part'
+        os.makedirs(os.path.dirname(part_path))
+        with open(part_path, 'wb') as f:
+            f.write(CONTENT[:300000])
+
+        path = artifacts.fetch('latent_store')
+
+        self.assertEqual(RangeHandler.requests, [('latent-store.bin', 'bytes=300000-')])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertFalse(os.path.exists(part_path))
+
+    def test_rejects_corrupt_download(self):
+        RangeHandler.files = {'latent-store.bin': CONTENT[:-1] + b'\x00'} # right size, wrong bytes
+        artifacts = self.manager()
+
+        with self.assertRaises(ArtifactError):
+            artifacts.fetch('latent_store')
+        self.assertFalse(os.path.exists(artifacts.local_path('latent_store')))
+        self.assertFalse(os.path.exists(artifacts.local_path('latent_store') + '.part'))
+
+        # a cached file that no longer matches is downloaded again
+        RangeHandler.files = {'latent-store.bin': CONTENT}
+        with open(artifacts.local_path('latent_store'), 'wb') as f:
+            f.write(b'stale')
+        with open(artifacts.fetch('latent_store'), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_refuses_artifacts_without_sha256(self):
+        artifacts = self.manager(require_sha256=True)
+        del artifacts.manifest['latent_store']['sha256']
+        with self.assertRaises(ArtifactError):
+            artifacts.fetch('latent_store')
+        self.assertEqual(RangeHandler.requests, [])
+
+        artifacts.require_sha256 = False
+        with open(artifacts.fetch('latent_store'), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_checks_size_without_sha256(self):
+        RangeHandler.files = {'latent-store.bin': CONTENT[:-1]}
+        artifacts = self.manager(require_sha256=False)
+        del artifacts.manifest['latent_store']['sha256']
+        with self.assertRaises(ArtifactError):
+            artifacts.fetch('latent_store')
+        self.assertFalse(os.path.exists(artifacts.local_path('latent_store')))
+
+        RangeHandler.files = {'latent-store.bin': CONTENT}
+        with open(artifacts.fetch('latent_store'), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+'''
+Recommender.filter_rows over a small in-memory latent store.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import unittest
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.Recommender import Recommender
+from scripts.latent_store import LatentStore
+
+ARTISTS = ["Drake, Future", "drake", "Adele", "Future", "Adele", "SZA", "drake", "Kendrick Lamar"]
+GENRES = ["hip hop", "hip hop", "pop", "hip hop", "pop", "r&b", "hip hop", "hip hop"]
+EMOTIONS = ["joy", "sadness", "sadness", "joy", "love", "love", "joy", "anger"]
+TEMPOS = [60, 80, 100, 120, 140, 90, 130, 110]
+TEMPO_PARAMS = {"min": 50, "max": 150}
+
+# A Recommender around the store, without loading any artifacts. The state is set on the instance so the
+# class-level state other tests may share is left alone.
+def make_recommender():
+    vectors = np.random.default_rng(0).standard_normal((len(ARTISTS), 4)).astype(np.float32)
+    tempo = (np.asarray(TEMPOS, dtype=np.float32) - TEMPO_PARAMS["min"]) / (TEMPO_PARAMS["max"] - TEMPO_PARAMS["min"])
+    rec = Recommender.__new__(Recommender)
+    rec.latent_store = LatentStore.from_arrays(vectors, {"artist": ARTISTS, "genre": GENRES, "song": [f"song {i}" for i in range(len(ARTISTS))]},
+                                               {"emotion": EMOTIONS, "Tempo": tempo})
+    rec.normalized_params = {"Tempo": TEMPO_PARAMS}
+    return rec
+
+class FilterRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.rec = make_recommender()
+
+    def rows(self, filters):
+        return np.asarray(self.rec.filter_rows(filters)).tolist()
+
+    def test_no_filters(self):
+        self.assertIsNone(self.rec.filter_rows(None))
+        self.assertIsNone(self.rec.filter_rows({}))
+
+    def test_genre(self):
+        self.assertEqual(self.rows({"genre": "pop"}), [2, 4])
+        self.assertEqual(self.rows({"genre": "Hip Hop"}), [0, 1, 3, 6, 7])
+
+    def test_artist_list(self):
+        # a song matches on the first artist it lists, case insensitively
+        self.assertEqual(self.rows({"artist": ["drake", "future"]}), [0, 1, 3, 6])
+        self.assertEqual(self.rows({"artist": ["Kendrick Lamar"]}), [7])
+
+    def test_numeric_range(self):
+        self.assertEqual(self.rows({"tempo": {"min": 95, "max": 125}}), [2, 3, 7])
+        self.assertEqual(self.rows({"tempo": {"min": 125}}), [4, 6])
+        self.assertEqual(self.rows({"tempo": {"max": 85}}), [0, 1])
+
+    def test_combined_filters(self):
+        self.assertEqual(self.rows({"genre": "hip hop", "emotion": "joy", "tempo": {"min": 100}}), [3, 6])
+
+    def test_empty_result(self):
+        self.assertEqual(self.rows({"genre": "jazz"}), [])
+        self.assertEqual(self.rows({"genre": "pop", "emotion": "joy"}), [])
+        self.assertEqual(self.rows({"tempo": {"min": 141}}), [])
+
+    def test_invalid_filters(self):
+        for filters in [{"mood": "happy"}, ["genre"], {"tempo": 120}, {"tempo": {"low": 100}}, {"energy": {"min": 10}}]:
+            with self.assertRaises(ValueError, msg=filters):
+                self.rec.filter_rows(filters)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Failure handling of api/hot_swap.py, with stand-in recommenders and a temporary bundle directory.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.warmup import Warmup
+from api.hot_swap import HotSwap
+from scripts.bundles import active_version, set_active_version
+
+class HotSwapTest(unittest.TestCase):
+    def setUp(self):
+        self.bundles_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.bundles_dir)
+        for version in ("v1", "v2", "bad"):
+            os.makedirs(os.path.join(self.bundles_dir, version))
+            with open(os.path.join(self.bundles_dir, version, "bundle.json"), "w") as f:
+                json.dump({"version": version, "created_at": 0, "artifacts": {}}, f)
+        set_active_version("v1", self.bundles_dir)
+
+        self.loads = [] # versions load_version was called with
+        self.activated = [] # versions on_swap was called with
+        warmup = Warmup(lambda: self.load("v1"))
+        self.hot_swap = HotSwap(warmup, self.load, watch=lambda: active_version(self.bundles_dir), poll_seconds=0,
+                                on_swap=self.activate)
+        warmup.get()
+
+    def load(self, version):
+        self.loads.append(version)
+        if version == "bad":
+            raise ValueError("bundle bad does not match its bundle.json")
+        return SimpleNamespace(version=version)
+
+    def activate(self, version):
+        self.activated.append(version)
+        set_active_version(version, self.bundles_dir)
+
+    # Polls the ACTIVE file like a request would, and waits for any reload it started
+    def poll(self):
+        instance = self.hot_swap.get()
+        if self.hot_swap.thread is not None:
+            self.hot_swap.thread.join()
+        return instance
+
+    def reload(self, version, activate=True):
+        self.assertTrue(self.hot_swap.reload(version, activate=activate))
+        self.hot_swap.thread.join()
+
+    def test_activates_after_swap(self):
+        self.reload("v2")
+        self.assertEqual(self.poll().version, "v2")
+        self.assertEqual(self.activated, ["v2"])
+        self.assertEqual(active_version(self.bundles_dir), "v2")
+        self.assertEqual(self.hot_swap.status()["last_reload"]["state"], "swapped")
+
+    def test_failed_version_is_not_activated(self):
+        self.reload("bad")
+        self.assertEqual(active_version(self.bundles_dir), "v1")
+        self.assertEqual(self.activated, [])
+        self.assertEqual(self.poll().version, "v1")
+
+        status = self.hot_swap.status()
+        self.assertEqual(status["last_reload"]["state"], "failed")
+        self.assertIn("does not match", status["last_reload"]["error"])
+        self.assertEqual(status["failed"], ["bad"])
+
+    def test_failed_version_is_not_polled_again(self):
+        self.reload("bad", activate=False)
+        # another worker names it in ACTIVE anyway
+        set_active_version("bad", self.bundles_dir)
+        for _ in range(3):
+            self.assertEqual(self.poll().version, "v1")
+        self.assertEqual(self.loads.count("bad"), 1)
+
+        # an explicit reload still retries it, and polling still follows other versions
+        self.reload("bad")
+        self.assertEqual(self.loads.count("bad"), 2)
+        set_active_version("v2", self.bundles_dir)
+        self.poll()
+        self.assertEqual(self.poll().version, "v2")
+
+    def test_polled_reload_does_not_write_active(self):
+        set_active_version("v2", self.bundles_dir)
+        self.poll()
+        self.assertEqual(self.poll().version, "v2")
+        self.assertEqual(self.activated, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+The streaming pre-processing of scripts/data.py against the in-memory pipeline (`python data.py`), on a small
+csv whose lyrics span several lines.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import data
+from tests.fixtures import write_raw_csv
+
+N_ROWS = 400
+OUTPUT_FILES = ["normalization-params.json", "artist-json.json", "genre-json.json", "emotion-json.json", "counts.csv"]
+
+class StreamingPreprocessTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.data_dir = os.path.join(cls.tmp, "data")
+        os.makedirs(cls.data_dir)
+        cls.csv_path = write_raw_csv(os.path.join(cls.data_dir, "spotify_dataset.csv"), N_ROWS, seed=4, missing_text=0.05)
+        cls.expected, cls.expected_files = cls.run_in_memory()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    # The steps of `python data.py`, which reads and writes ../data relative to the working directory
+    @classmethod
+    def run_in_memory(cls):
+        cwd = os.getcwd()
+        os.makedirs(os.path.join(cls.tmp, "scripts"))
+        os.chdir(os.path.join(cls.tmp, "scripts"))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                df = data.load_data(p_col_names=False, max_rows=None)
+            df = data.embed_num_data(df)
+            df, artist_count, genre_count, emotion_count = data.process_non_num_features(df)
+            df = df.drop(columns=data.DROPPED_COLUMNS).reset_index(drop=True)
+            pd.DataFrame({'Category': ['Artists', 'Genres', 'Emotions'],
+                          'Count': [artist_count, genre_count, emotion_count]}).to_csv("../data/counts.csv", index=False)
+        finally:
+            os.chdir(cwd)
+        return df, cls.read_outputs(cls.data_dir)
+
+    @staticmethod
+    def read_outputs(directory):
+        outputs = {}
+        for name in OUTPUT_FILES:
+            with open(os.path.join(directory, name)) as f:
+                outputs[name] = json.load(f) if name.endswith(".json") else f.read()
+        return outputs
+
+    def run_streaming(self, n_jobs):
+        data_dir = os.path.join(self.tmp, f"stream-{n_jobs}")
+        out_dir = os.path.join(data_dir, "pre-processed")
+        os.makedirs(data_dir)
+        # small chunks, so chunk boundaries fall between records that span several lines
+        data.preprocess_streaming(self.csv_path, data_dir, out_dir, chunk_bytes=4096, n_jobs=n_jobs, verbose=False)
+        return data.load_columnar(out_dir, text=True), self.read_outputs(data_dir)
+
+    def assert_matches_in_memory(self, n_jobs):
+        (df, tables), files = self.run_streaming(n_jobs)
+        self.assertLess(len(self.expected), N_ROWS) # rows without lyrics were dropped
+        self.assertEqual(list(df.columns), list(self.expected.columns))
+        pd.testing.assert_frame_equal(df, self.expected, check_dtype=False)
+        self.assertEqual(files, self.expected_files)
+
+        songs = pd.read_csv(self.csv_path).dropna()
+        for column in data.TEXT_COLUMNS:
+            self.assertEqual(tables[column].strings(0, len(tables[column])), songs[column].tolist())
+
+    def test_one_worker(self):
+        self.assert_matches_in_memory(1)
+
+    def test_several_workers(self):
+        self.assert_matches_in_memory(3)
+
+    def test_chunks_end_on_records(self):
+        ranges = data.split_csv(self.csv_path, chunk_bytes=4096)
+        self.assertGreater(len(ranges), 10)
+        columns, dtype = data.csv_schema(self.csv_path)
+        rows = sum(len(data.read_range(self.csv_path, start, end, columns, dtype)) for start, end in ranges)
+        self.assertEqual(rows, len(self.expected))
+        with open(self.csv_path, "rb") as f:
+            content = f.read()
+        # the lyrics hold newlines, so splitting on every newline would cut records in two
+        self.assertGreater(content.count(b"\n"), N_ROWS + 1)
+        self.assertEqual([end for _, end in ranges][-1], len(content))
+        self.assertTrue(all(np.diff([start for start, _ in ranges]) > 0))
+
+if __name__ == '__main__':
+    unittest.main()
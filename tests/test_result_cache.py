@@ -0,0 +1,113 @@
+'''
+Keys and eviction of scripts/result_cache.py, for the memory and the SQLite backend.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.result_cache import ResultCache, MemoryBackend, SqliteBackend
+from scripts.Recommender import Recommender
+from scripts.latent_index import create_index
+from scripts.latent_store import LatentStore
+
+# Encoder inputs of a batch of profiles: normalized features and artist, genre and emotion ids
+def make_inputs(features, artist=3, genre=1, emotion=2):
+    features = np.asarray(features, dtype=np.float32).reshape(len(features), -1)
+    ids = np.full(len(features), 1, dtype=np.int32)
+    return [features, ids * artist, ids * genre, ids * emotion]
+
+class ResultCacheKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache(MemoryBackend(16), precision=1e-3)
+
+    def key(self, features=(0.5, 0.25), n=5, namespace="ns", **ids):
+        return self.cache.keys(make_inputs([features], **ids), n, namespace)[0]
+
+    def test_same_profile_same_key(self):
+        self.assertEqual(self.key(), self.key())
+        # differences below the quantization step share a key
+        self.assertEqual(self.key((0.5, 0.25)), self.key((0.5001, 0.2502)))
+
+    def test_key_parts(self):
+        key = self.key()
+        self.assertNotEqual(key, self.key(features=(0.5, 0.26)))
+        self.assertNotEqual(key, self.key(n=6))
+        self.assertNotEqual(key, self.key(namespace="other"))
+        self.assertNotEqual(key, self.key(artist=4))
+        self.assertNotEqual(key, self.key(genre=2))
+        self.assertNotEqual(key, self.key(emotion=3))
+
+    def test_one_key_per_profile(self):
+        keys = self.cache.keys(make_inputs([(0.5, 0.25), (0.1, 0.2), (0.5, 0.25)]), 5, "ns")
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(keys[0], keys[2])
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_namespace_names_filters_and_index(self):
+        rec = Recommender.__new__(Recommender)
+        vectors = np.random.default_rng(0).standard_normal((4, 3)).astype(np.float32)
+        rec.latent_store = LatentStore.from_arrays(vectors, {"artist": ["a", "b", "c", "d"], "genre": ["pop"] * 4, "song": ["s"] * 4})
+        rec.latent_index = create_index("brute_force").build(rec.latent_store.vectors)
+
+        namespaces = [
+            rec.cache_namespace(),
+            rec.cache_namespace({"genre": "pop"}),
+            rec.cache_namespace({"genre": "rock"}),
+            rec.cache_namespace({"genre": "pop", "tempo": {"min": 100}}),
+            rec.cache_namespace(None, {"lambda": 0.5}),
+        ]
+        self.assertEqual(len(set(namespaces)), len(namespaces))
+        self.assertEqual(rec.cache_namespace({"genre": "pop", "emotion": "joy"}), rec.cache_namespace({"emotion": "joy", "genre": "pop"}))
+
+        rec.latent_index = rec.latent_index.tuned(n_shards=2)
+        self.assertNotEqual(rec.cache_namespace(), namespaces[0])
+        rec.version = "v2"
+        self.assertNotIn(rec.cache_namespace(), namespaces)
+
+class EvictionTest(unittest.TestCase):
+    def backends(self, max_entries):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return [MemoryBackend(max_entries), SqliteBackend(os.path.join(directory, "cache.sqlite3"), max_entries)]
+
+    def test_lru_eviction(self):
+        for backend in self.backends(3):
+            with self.subTest(backend=backend.name):
+                # the SQLite backend orders entries by the wall clock time they were last used
+                expires = time.time() + 60
+                for key, value in [("a", "1"), ("b", "2"), ("c", "3")]:
+                    self.assertEqual(backend.set_many({key: value}, expires), 0)
+                # reading a makes b the least recently used entry
+                self.assertEqual(backend.get_many(["a"], time.time()), {"a": "1"})
+                self.assertEqual(backend.set_many({"d": "4"}, expires), 1)
+                self.assertEqual(backend.get_many(["a", "b", "c", "d"], time.time()), {"a": "1", "c": "3", "d": "4"})
+                self.assertEqual(len(backend), 3)
+
+    def test_ttl_expiry(self):
+        for backend in self.backends(10):
+            with self.subTest(backend=backend.name):
+                backend.set_many({"old": "1"}, expires=10)
+                backend.set_many({"new": "2"}, expires=20)
+                self.assertEqual(backend.get_many(["old", "new"], now=5), {"old": "1", "new": "2"})
+                self.assertEqual(backend.get_many(["old", "new"], now=10), {"new": "2"})
+                self.assertEqual(backend.get_many(["old", "new"], now=20), {})
+
+    def test_counters(self):
+        cache = ResultCache(MemoryBackend(2), ttl=60)
+        cache.set_many({"a": [{"id": 1}], "b": [{"id": 2}], "c": [{"id": 3}]})
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"b": [{"id": 2}], "c": [{"id": 3}]})
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["entries"]), (2, 1, 1, 2))
+
+        expired = ResultCache(MemoryBackend(2), ttl=-1)
+        expired.set_many({"a": [{"id": 1}]})
+        self.assertEqual(expired.get_many(["a"]), {})
+
+if __name__ == '__main__':
+    unittest.main()
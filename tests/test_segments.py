@@ -0,0 +1,167 @@
+'''
+Delta segments of scripts/segments.py: appending new songs and compacting them into a new base, over a small
+artifact cache with a synthetic encoder.
+
+    python -m unittest discover tests
+'''
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import segments
+from scripts.Recommender import Recommender
+from scripts.artifacts import ArtifactManager, MANIFEST, build_manifest, sha256_file
+from scripts.data import csv_schema, output_columns, get_num_features, ID_COLUMNS, MEDITATION
+from scripts.encoder_inference import WEIGHT_NAMES, save_encoder_weights
+from scripts.latent_index import SegmentedIndex, create_index
+from scripts.latent_store import LatentStore, SegmentedStore, write_latent_store
+from scripts.neighbors import load_neighbors
+from tests.fixtures import write_raw_csv, ARTISTS, GENRES, EMOTIONS
+
+BASE_SONGS = 50
+LATENT_DIM = 4
+
+class SegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.store_path = os.path.join(self.cache_dir, MANIFEST['latent_store']['path'])
+        os.makedirs(os.path.join(self.cache_dir, 'data'))
+        self.new_songs = write_raw_csv(os.path.join(self.cache_dir, 'new-songs.csv'), 20, seed=1, first_song=100)
+        self.more_songs = write_raw_csv(os.path.join(self.cache_dir, 'more-songs.csv'), 15, seed=2, first_song=200)
+        self.write_release()
+
+        # the published manifest has a sha256 for every artifact, so a rewritten release would not verify
+        manifest_path = os.path.join(self.cache_dir, 'artifact-manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump(build_manifest(self.cache_dir), f)
+        patcher = mock.patch.dict(os.environ, {'ARTIFACT_CACHE_DIR': self.cache_dir, 'ARTIFACT_MANIFEST': manifest_path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Vocabularies, normalization params, random encoder weights and a base store of BASE_SONGS songs
+    def write_release(self):
+        def write_json(key, value):
+            with open(os.path.join(self.cache_dir, MANIFEST[key]['path']), 'w') as f:
+                json.dump(value, f)
+        write_json('artist_json', {name: i for i, name in enumerate(ARTISTS)})
+        write_json('genre_json', {name: i for i, name in enumerate(GENRES)})
+        write_json('emotion_json', {name: i for i, name in enumerate(EMOTIONS)})
+        write_json('normalization_params', {feature: {"min": 0, "max": 200} for feature in get_num_features() + [MEDITATION]})
+
+        columns, _ = csv_schema(self.new_songs)
+        n_numerical = len([column for column in output_columns(columns) if column not in ID_COLUMNS])
+        rng = np.random.default_rng(0)
+        shapes = {"artist_embedding": (len(ARTISTS), 3), "genre_embedding": (len(GENRES), 2), "emotion_embedding": (len(EMOTIONS), 2),
+                  "hidden_kernel": (n_numerical + 7, 8), "hidden_bias": (8,), "latent_kernel": (8, LATENT_DIM), "latent_bias": (LATENT_DIM,)}
+        save_encoder_weights(os.path.join(self.cache_dir, MANIFEST['encoder_weights']['path']),
+                             {name: rng.standard_normal(shapes[name]).astype(np.float32) for name in WEIGHT_NAMES})
+
+        write_latent_store(self.store_path, rng.standard_normal((BASE_SONGS, LATENT_DIM)).astype(np.float32),
+                           {"artist": rng.choice(ARTISTS, BASE_SONGS).tolist(), "genre": rng.choice(GENRES, BASE_SONGS).tolist(),
+                            "song": [f"song {i}" for i in range(BASE_SONGS)]},
+                           {"emotion": rng.choice(EMOTIONS, BASE_SONGS).tolist()})
+
+    # A Recommender around a store and an exact index over it, without loading any other artifacts
+    def recommender(self, store, song_neighbors=None):
+        base = store.segments[0] if isinstance(store, SegmentedStore) else store
+        index = create_index("brute_force").build(base.vectors)
+        rec = Recommender.__new__(Recommender)
+        rec.artifacts = ArtifactManager()
+        rec.latent_store = store
+        rec.latent_index = SegmentedIndex(index, store) if isinstance(store, SegmentedStore) else index
+        rec.song_neighbors = song_neighbors
+        return rec
+
+    def all_vectors(self, store):
+        if isinstance(store, SegmentedStore):
+            return np.concatenate([np.asarray(segment.vectors) for segment in store.segments])
+        return np.asarray(store.vectors)
+
+    # ids of the k songs closest to a vector, by an exact scan of every song
+    def expected_ids(self, store, query, k, exclude=None):
+        scores = self.all_vectors(store) @ query
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        return np.argsort(-scores, kind="stable")[:k].tolist()
+
+    def test_append_keeps_ids(self):
+        segments.add_songs(self.new_songs, self.store_path)
+        first = segments.load_segmented_store(self.store_path)
+        self.assertIsInstance(first, SegmentedStore)
+        self.assertEqual(len(first), BASE_SONGS + 20)
+        self.assertEqual(first[BASE_SONGS]["song"], "song 100")
+
+        segments.add_songs(self.more_songs, self.store_path)
+        second = segments.load_segmented_store(self.store_path)
+        self.assertEqual(len(second), BASE_SONGS + 35)
+        self.assertEqual(second[BASE_SONGS + 20]["song"], "song 200")
+        # songs appended earlier keep their ids, vectors and metadata
+        for song_id in range(len(first)):
+            self.assertEqual(second[song_id], first[song_id])
+        np.testing.assert_array_equal(self.all_vectors(second)[:len(first)], self.all_vectors(first))
+
+    def test_search_spans_segments(self):
+        segments.add_songs(self.new_songs, self.store_path)
+        segments.add_songs(self.more_songs, self.store_path)
+        store = segments.load_segmented_store(self.store_path)
+        rec = self.recommender(store)
+
+        queries = np.random.default_rng(3).standard_normal((5, LATENT_DIM)).astype(np.float32)
+        for query, (ids, scores) in zip(queries, rec.latent_index.search_many(queries, 10)):
+            self.assertEqual(np.asarray(ids).tolist(), self.expected_ids(store, query, 10))
+            np.testing.assert_allclose(scores, np.sort(self.all_vectors(store) @ query)[::-1][:10], rtol=1e-5)
+
+        for song_id in (3, BASE_SONGS + 4, BASE_SONGS + 30):
+            similar = [song["id"] for song in rec.get_similar_songs(song_id, 5)]
+            self.assertEqual(similar, self.expected_ids(store, self.all_vectors(store)[song_id], 5, exclude=song_id))
+
+    def test_compaction(self):
+        segments.add_songs(self.new_songs, self.store_path)
+        segments.add_songs(self.more_songs, self.store_path)
+        segmented = segments.load_segmented_store(self.store_path)
+        release_sha256 = sha256_file(self.store_path)
+
+        segments.compact(self.store_path)
+        # the verified release is left alone and still fetched from the cache
+        self.assertEqual(sha256_file(self.store_path), release_sha256)
+        self.assertEqual(ArtifactManager().fetch('latent_store'), self.store_path)
+
+        compacted = segments.load_segmented_store(self.store_path)
+        self.assertIsInstance(compacted, LatentStore)
+        self.assertEqual(len(compacted), len(segmented))
+        for song_id in range(len(segmented)):
+            self.assertEqual(compacted[song_id], segmented[song_id])
+        np.testing.assert_allclose(self.all_vectors(compacted), self.all_vectors(segmented))
+
+        # similar songs come from the neighbour lists rebuilt over the compacted base
+        rec = self.recommender(compacted)
+        rec.song_neighbors = rec.load_song_neighbors()
+        self.assertEqual(len(rec.song_neighbors), len(compacted))
+        for song_id in (3, BASE_SONGS + 4, BASE_SONGS + 30):
+            similar = [song["id"] for song in rec.get_similar_songs(song_id, 5)]
+            self.assertEqual(similar, self.expected_ids(compacted, self.all_vectors(compacted)[song_id], 5, exclude=song_id))
+
+    def test_compaction_generations(self):
+        segments.add_songs(self.new_songs, self.store_path)
+        segments.compact(self.store_path)
+        segments.add_songs(self.more_songs, self.store_path)
+        self.assertEqual(len(segments.load_segmented_store(self.store_path)), BASE_SONGS + 35)
+        segments.compact(self.store_path)
+
+        deltas_dir = segments.deltas_dir(self.store_path)
+        self.assertEqual(sorted(os.listdir(deltas_dir)), ["base-00002.bin", "segments.json", "song-neighbors-00002.npy"])
+        self.assertEqual(len(load_neighbors(segments.compacted_neighbors(self.store_path))), BASE_SONGS + 35)
+
+        # a new release supersedes the compactions of the old one
+        os.utime(self.store_path, ns=(os.stat(self.store_path).st_atime_ns, os.stat(self.store_path).st_mtime_ns + 10**9))
+        self.assertEqual(len(segments.load_segmented_store(self.store_path)), BASE_SONGS)
+        self.assertIsNone(segments.compacted_neighbors(self.store_path))
+
+if __name__ == '__main__':
+    unittest.main()